@@ -0,0 +1,393 @@
+"""
+Weekly warning digest -> #prod-alerts.
+
+Fetches the ALERTS metric since the previous successful run with
+stepped range queries, rebuilds the firing intervals of every alert
+series locally, and posts a single per-alertname summary to slack via
+the webhook mounted at /etc/secrets/slack-webhook-url.
+
+The range is fetched in SLICE_HOURS-sized slices, at most
+QUERY_CONCURRENCY at a time, so every request to prometheus touches a
+bounded amount of data however long the range gets.
+
+Per-alertname aggregates of each run are kept in a small JSON state
+file (STATE_PATH, on the warning-digest-state PVC), so each run only
+queries new data and the digest can show deltas and trends against the
+previous HISTORY_RUNS runs. Without state, the first run covers
+LOOKBACK; after a long outage at most MAX_CATCHUP is fetched.
+
+No third-party deps — urllib only.
+
+Filed against ECHO-817. Companion to ECHO-813 which dropped
+severity=warning notifications.
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+PROMETHEUS_URL = os.environ.get(
+    "PROMETHEUS_URL", "http://prometheus.monitoring.svc:9090"
+)
+SLACK_WEBHOOK_PATH = os.environ.get(
+    "SLACK_WEBHOOK_PATH", "/etc/secrets/slack-webhook-url"
+)
+LOOKBACK = os.environ.get("LOOKBACK", "7d")
+EVAL_INTERVAL_SECONDS = int(os.environ.get("EVAL_INTERVAL_SECONDS", "15"))
+SLICE_HOURS = int(os.environ.get("SLICE_HOURS", "24"))
+QUERY_CONCURRENCY = int(os.environ.get("QUERY_CONCURRENCY", "4"))
+STATE_PATH = os.environ.get(
+    "STATE_PATH", "/var/lib/warning-digest/state.json"
+)
+MAX_CATCHUP = os.environ.get("MAX_CATCHUP", "14d")
+HISTORY_RUNS = int(os.environ.get("HISTORY_RUNS", "8"))
+
+ALERTS_QUERY = 'ALERTS{alertstate="firing", severity="warning"}'
+# Labels that are the same for every series of an alertname, or that
+# only describe the ALERTS series itself.
+IGNORED_LABELS = {"__name__", "alertname", "alertstate", "severity"}
+MAX_LABEL_VALUES = 5
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+def parse_duration(value: str) -> int:
+    """'7d' -> 604800. Accepts s/m/h/d/w suffixes or plain seconds."""
+    value = value.strip()
+    if value[-1:] in DURATION_UNITS:
+        return int(value[:-1]) * DURATION_UNITS[value[-1]]
+    return int(value)
+
+
+def format_duration(seconds: int) -> str:
+    minutes = seconds // 60
+    if minutes < 60:
+        return f"{minutes} min"
+    hours, minutes = divmod(minutes, 60)
+    if hours < 24:
+        return f"{hours}h {minutes:02d}m"
+    days, hours = divmod(hours, 24)
+    return f"{days}d {hours}h"
+
+
+def query_prom_range(promql: str, start: int, end: int, step: int) -> list:
+    params = urllib.parse.urlencode(
+        {"query": promql, "start": start, "end": end, "step": step}
+    )
+    url = f"{PROMETHEUS_URL}/api/v1/query_range?{params}"
+    with urllib.request.urlopen(url, timeout=60) as r:
+        body = json.loads(r.read())
+    if body.get("status") != "success":
+        raise RuntimeError(f"prometheus query failed: {body}")
+    return body["data"]["result"]
+
+
+def make_slices(start: int, end: int, step: int) -> list:
+    """Split [start, end) into SLICE_HOURS-sized pieces on the step grid.
+
+    The slice length is a multiple of the step, so every slice evaluates
+    on the same grid and adjacent slices never sample the same instant.
+    """
+    slice_seconds = max(step, SLICE_HOURS * 3600 // step * step)
+    return [
+        (t, min(t + slice_seconds, end))
+        for t in range(start, end, slice_seconds)
+    ]
+
+
+def fetch_intervals(window: tuple, step: int) -> dict:
+    """Firing intervals per series within one slice.
+
+    Returns {series labels: [[start, end), ...]}. A sample at t means the
+    alert was firing during [t, t + step); consecutive samples are merged
+    into one interval and a missing step starts a new one.
+    """
+    start, end = window
+    # query_range includes its end, which is the next slice's start.
+    result = query_prom_range(ALERTS_QUERY, start, end - step, step)
+    intervals = {}
+    for row in result:
+        key = tuple(sorted(row["metric"].items()))
+        spans = []
+        for ts, _ in row["values"]:
+            ts = int(float(ts))
+            if spans and spans[-1][1] == ts:
+                spans[-1][1] = ts + step
+            else:
+                spans.append([ts, ts + step])
+        intervals[key] = spans
+    return intervals
+
+
+def merge_slices(slices: list) -> dict:
+    """Join per-slice intervals into whole-lookback intervals per series.
+
+    slices must be in time order; an interval ending exactly where the
+    next slice's first interval starts is the same incident.
+    """
+    merged = defaultdict(list)
+    for intervals in slices:
+        for key, spans in intervals.items():
+            series = merged[key]
+            for span in spans:
+                if series and series[-1][1] >= span[0]:
+                    series[-1][1] = max(series[-1][1], span[1])
+                else:
+                    series.append(list(span))
+    return merged
+
+
+def union_length(spans: list) -> int:
+    """Total length covered by possibly overlapping [start, end) spans."""
+    total = 0
+    current_start = current_end = None
+    for start, end in sorted(spans):
+        if current_end is None or start > current_end:
+            if current_end is not None:
+                total += current_end - current_start
+            current_start, current_end = start, end
+        else:
+            current_end = max(current_end, end)
+    if current_end is not None:
+        total += current_end - current_start
+    return total
+
+
+def summarize(series: dict, window: tuple, open_since: dict) -> tuple:
+    """Per-alertname events, firing time, longest incident and labels.
+
+    Every firing interval of every series counts as one event. The
+    total duration is the time during which at least one series of the
+    alertname was firing, so an alert firing on three pods at once for
+    ten minutes counts ten minutes, not thirty.
+
+    open_since maps series that were still firing at the end of the
+    previous run to the start of that incident. If such a series is
+    still firing at the start of this window, it is the same incident:
+    it is not counted as a new event, and its length includes the part
+    before this window.
+
+    Returns (by_name, open_since for the next run).
+    """
+    window_start, window_end = window
+    by_name: dict = {}
+    still_open = {}
+    for key, spans in series.items():
+        labels = dict(key)
+        name = labels.get("alertname", "?")
+        series_id = json.dumps(key)
+        row = by_name.setdefault(
+            name,
+            {"events": 0, "spans": [], "longest": 0, "ongoing": False,
+             "labels": defaultdict(set)},
+        )
+        first_start = spans[0][0]
+        if series_id in open_since and first_start <= window_start:
+            first_start = open_since[series_id]
+            row["events"] -= 1
+        row["events"] += len(spans)
+        row["spans"].extend(spans)
+        row["longest"] = max(
+            row["longest"],
+            spans[0][1] - first_start,
+            *(e - s for s, e in spans[1:]),
+        )
+        if spans[-1][1] >= window_end:
+            row["ongoing"] = True
+            still_open[series_id] = (
+                first_start if len(spans) == 1 else spans[-1][0]
+            )
+        for label, value in labels.items():
+            if label not in IGNORED_LABELS:
+                row["labels"][label].add(value)
+    for row in by_name.values():
+        row["seconds"] = union_length(row.pop("spans"))
+        row["labels"] = {k: sorted(v) for k, v in row["labels"].items()}
+    return by_name, still_open
+
+
+def format_labels(labels: dict) -> str:
+    parts = []
+    for label in sorted(labels):
+        values = labels[label]
+        shown = ", ".join(values[:MAX_LABEL_VALUES])
+        if len(values) > MAX_LABEL_VALUES:
+            shown += f" (+{len(values) - MAX_LABEL_VALUES} more)"
+        parts.append(f"{label}: {shown}")
+    return "; ".join(parts)
+
+
+def load_state() -> dict:
+    try:
+        with open(STATE_PATH) as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return {"runs": [], "open": {}}
+    except (OSError, ValueError) as e:
+        print(
+            f"ignoring unreadable state at {STATE_PATH}: {e}",
+            file=sys.stderr,
+        )
+        return {"runs": [], "open": {}}
+    return state
+
+
+def save_state(state: dict) -> None:
+    """Write the state atomically, so a killed job never leaves half a file."""
+    directory = os.path.dirname(STATE_PATH) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(state, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, STATE_PATH)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def format_period(start: int, end: int) -> str:
+    fmt = "%a %d %b %H:%M"
+    return (
+        f"{time.strftime(fmt, time.gmtime(start))} – "
+        f"{time.strftime(fmt, time.gmtime(end))} UTC"
+    )
+
+
+def format_trend(name: str, row: dict, history: list) -> str:
+    """Compare an alertname with the previous run and the history average."""
+    if not history:
+        return ""
+    previous = history[-1]["alerts"].get(name)
+    if previous is None:
+        return " _(new)_"
+    average = sum(
+        run["alerts"].get(name, {}).get("seconds", 0) for run in history
+    ) // len(history)
+    trend = (
+        f"{row['events'] - previous['events']:+d} events, "
+        f"prev {format_duration(previous['seconds'])}"
+    )
+    if len(history) > 1:
+        trend += f", {len(history)}-run avg {format_duration(average)}"
+    return f" _({trend})_"
+
+
+def build_report(run: dict, history: list) -> str:
+    by_name = run["alerts"]
+    period = format_period(run["start"], run["end"])
+    previous = history[-1]["alerts"] if history else {}
+    quiet = sorted(set(previous) - set(by_name))
+
+    if not by_name:
+        lines = [
+            f":white_check_mark: *Warning digest — {period}*",
+            "No warnings fired.",
+        ]
+    else:
+        lines = [
+            f":bar_chart: *Warning digest — {period}*  "
+            f"({len(by_name)} unique alertnames)"
+        ]
+        for name in sorted(by_name, key=lambda n: -by_name[n]["seconds"]):
+            row = by_name[name]
+            if row["events"]:
+                events = f"{row['events']} firing event(s)"
+            else:
+                events = "firing since the last digest"
+            line = (
+                f"• *{name}* — {events}, "
+                f"{format_duration(row['seconds'])} total, "
+                f"longest {format_duration(row['longest'])}"
+            )
+            if row["ongoing"]:
+                line += " (still firing)"
+            line += format_trend(name, row, history)
+            if row["labels"]:
+                line += f"\n    {format_labels(row['labels'])}"
+            lines.append(line)
+    if quiet:
+        lines.append(f"Quiet since the last digest: {', '.join(quiet)}")
+    return "\n".join(lines)
+
+
+def main() -> int:
+    step = EVAL_INTERVAL_SECONDS
+    end = int(time.time()) // step * step
+    state = load_state()
+    if state["runs"]:
+        start = max(
+            state["runs"][-1]["end"], end - parse_duration(MAX_CATCHUP)
+        )
+    else:
+        start = end - parse_duration(LOOKBACK)
+    if start >= end:
+        print("nothing new since the last run")
+        return 0
+    slices = make_slices(start, end, step)
+
+    try:
+        with ThreadPoolExecutor(max_workers=QUERY_CONCURRENCY) as pool:
+            results = list(pool.map(lambda w: fetch_intervals(w, step), slices))
+    except Exception as e:
+        print(f"prometheus query error: {e}", file=sys.stderr)
+        return 1
+    # Incidents open at the last run only carry over if this run picks
+    # up exactly where it ended.
+    resumed = bool(state["runs"]) and state["runs"][-1]["end"] == start
+    open_since = state["open"] if resumed else {}
+    by_name, still_open = summarize(
+        merge_slices(results), (start, end), open_since
+    )
+    print(
+        f"fetched {len(slices)} slice(s), {len(by_name)} alertname(s)"
+    )
+
+    run = {"start": start, "end": end, "alerts": by_name}
+    history = state["runs"][-HISTORY_RUNS:]
+    text = build_report(run, history)
+
+    try:
+        with open(SLACK_WEBHOOK_PATH) as f:
+            webhook = f.read().strip()
+    except FileNotFoundError:
+        print(
+            f"slack webhook secret not at {SLACK_WEBHOOK_PATH}",
+            file=sys.stderr,
+        )
+        return 1
+
+    payload = json.dumps({"text": text}).encode()
+    req = urllib.request.Request(
+        webhook,
+        data=payload,
+        headers={"Content-Type": "application/json"},
+    )
+    try:
+        with urllib.request.urlopen(req, timeout=15) as r:
+            print(f"slack post: HTTP {r.status}")
+    except Exception as e:
+        print(f"slack post failed: {e}", file=sys.stderr)
+        return 1
+
+    # Only advance after a successful post, so a failed run is covered
+    # again by the next one.
+    state["runs"] = (history + [run])[-HISTORY_RUNS:]
+    state["open"] = still_open
+    try:
+        save_state(state)
+    except OSError as e:
+        # The digest is already posted; failing the job would make
+        # restartPolicy OnFailure post it again. The next run then just
+        # covers this period once more.
+        print(f"saving state to {STATE_PATH} failed: {e}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
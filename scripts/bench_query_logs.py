@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""Benchmarks for the hot paths and the query pipeline of query_logs.py.
+
+The micro-benchmarks run against a synthetic corpus of echo-style log lines
+and print the best-of-N timing. Where a hot path was rewritten for speed, the
+previous implementation is kept here as a reference: the benchmark first
+checks both give identical results, then reports the speedup.
+
+The pipeline benchmarks start a fake Loki query_range server in a separate
+process and drive the real fetch and output code against it, reporting
+throughput, request latency and peak memory. The pagination edge cases are
+checked in tests/test_pagination.py, against the same fake server.
+
+Results can be saved as a baseline and compared against later, so that
+regressions in the hot paths show up. A baseline only compares with runs
+over the same --lines and fake Loki data.
+
+Usage: python3 scripts/bench_query_logs.py [--lines N] [--repeat N] [--only NAME]
+                                           [--save-baseline FILE] [--compare FILE]
+"""
+import argparse
+import contextlib
+import datetime
+import gzip
+import heapq
+import http.server
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import timeit
+import tracemalloc
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import query_logs
+
+# Representative lines from the api (uvicorn + structured JSON), worker (dramatiq)
+# and directus (pino) containers, plus lines that mention no level at all
+SAMPLE_LINES = [
+    'INFO:     10.0.0.12:51234 - "GET /api/health HTTP/1.1" 200 OK',
+    '{"level":30,"time":1715700000000,"pid":1,"hostname":"directus-7d9f","msg":"request completed","res":{"statusCode":200}}',
+    '{"timestamp": "2026-05-01T10:00:00Z", "level": "error", "logger": "dembrane.tasks", "message": "Failed to transcribe chunk", "conversation_id": "{id}"}',
+    '2026-05-01 10:00:00,123 [WARNING] dembrane.api: slow request /api/conversations/{id} took 3.2s',
+    '[2026-05-01 10:00:00 +0000] [1] [DEBUG] worker heartbeat',
+    'Traceback (most recent call last): File "/app/dembrane/tasks.py", line 212, in task_process_conversation_chunk',
+    'level=warn msg="retrying connection" attempt=3',
+    'dramatiq.worker.WorkerThread: processing message task_process_conversation_chunk({id}) with id {id}',
+    'ERROR: could not connect to server: Connection refused',
+    '\tat Object.<anonymous> (/directus/node_modules/knex/lib/execution/runner.js:158:20)',
+]
+
+# Start of the synthetic time range served by the fake Loki (2026-01-01 00:00 UTC)
+FAKE_LOKI_EPOCH = 1767225600 * 10**9
+
+# Hours of logs each pipeline benchmark fetches, in one-hour chunks
+PIPELINE_HOURS = 3
+
+# Relative change of a baseline metric, in the bad direction, that counts as a regression
+REGRESSION_THRESHOLD = 0.2
+
+# Tokens used to fuzz the level parser with overlapping and partial patterns
+FUZZ_TOKENS = [
+    "INFO", "info", "DEBUG", "debug", "WARN", "WARNING", "warning", "ERR", "ERROR", "err", "Error",
+    "CRITICAL", "FATAL", "fatal", "TRACE", "trace", "level=", "level: ", "[", "]", ":", "\"", "'", " ", "x",
+]
+
+def legacy_parse_log_level(log_entry):
+    """parse_log_level as it was before the precomputed pattern table (reference only)."""
+    log_levels = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL", "WARN", "ERR", "FATAL", "TRACE"]
+    for level in log_levels:
+        patterns = [
+            f"{level}:", f"[{level}]", f"[{level.lower()}]",
+            f"level={level}", f"level={level.lower()}",
+            f"\"{level}\"", f"'{level}'", f"level: {level}"
+        ]
+        for pattern in patterns:
+            if pattern in log_entry:
+                return level
+    for level in log_levels:
+        if level.lower() in log_entry.lower():
+            return level
+    return "INFO"
+
+def make_corpus(line_count, seed=1):
+    """Return line_count synthetic log lines of varying length."""
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(line_count):
+        line = rng.choice(SAMPLE_LINES).replace("{id}", f"{i:08x}")
+        corpus.append(line + " " + "x" * rng.randint(0, 200))
+    return corpus
+
+def make_fuzz_corpus(line_count, seed=2):
+    """Return line_count lines stitched together from level-like tokens."""
+    rng = random.Random(seed)
+    return ["".join(rng.choice(FUZZ_TOKENS) for _ in range(rng.randint(1, 12))) for _ in range(line_count)]
+
+def make_loki_page(entry_count, stream_count=8, seed=3):
+    """Return the JSON body of a synthetic query_range page with entry_count entries."""
+    rng = random.Random(seed)
+    corpus = make_corpus(entry_count, seed)
+    start = 1767225600 * 10**9
+    streams = [
+        {"stream": {"namespace": "echo-prod", "app": "echo", "component": "api", "pod": f"echo-api-{i:04x}", "container": "api-server"}, "values": []}
+        for i in range(stream_count)
+    ]
+    timestamp = start
+    for line in corpus:
+        # Bursty arrivals: most lines land within a few milliseconds of the previous one
+        timestamp += rng.choice([rng.randint(1, 5 * 10**6), rng.randint(1, 2 * 10**9)])
+        streams[rng.randrange(stream_count)]["values"].append([str(timestamp), line])
+    return json.dumps({"status": "success", "data": {"resultType": "streams", "result": streams}}).encode("utf-8")
+
+def make_fake_config(entries=None, interval_ns=None, hours=PIPELINE_HOURS, streams=8, line_bytes=200, repeats=1, shared_timestamps=False):
+    """Return a fake Loki config: streams that each log repeats lines every interval_ns.
+
+    Without interval_ns, it is picked so that about entries lines fall in the
+    given hours. With shared_timestamps every stream logs at the same
+    timestamps, otherwise they are staggered. If interval_ns divides an
+    hour, the hour boundaries the chunks are cut on land on timestamps.
+    """
+    if interval_ns is None:
+        interval_ns = max(hours * 3600 * 10**9 * streams * repeats // entries, 1)
+    return {
+        "streams": streams,
+        "interval_ns": interval_ns,
+        "line_bytes": line_bytes,
+        "repeats": repeats,
+        "shared_timestamps": shared_timestamps,
+    }
+
+def get_fake_labels(config):
+    """Return the stream labels of every fake stream."""
+    return [
+        {"namespace": "echo-bench", "app": "echo", "component": "api", "pod": f"echo-api-{i:04x}", "container": "api-server"}
+        for i in range(config["streams"])
+    ]
+
+def iter_fake_stream(config, stream_index, start_time, end_time):
+    """Yield (timestamp, stream_index, line) for one fake stream in [start_time, end_time), oldest first."""
+    interval = config["interval_ns"]
+    offset = 0 if config["shared_timestamps"] else stream_index * interval // config["streams"]
+    timestamp = -(-(start_time - offset) // interval) * interval + offset
+    while timestamp < end_time:
+        for repeat in range(config["repeats"]):
+            line = SAMPLE_LINES[(timestamp // interval + stream_index + repeat) % len(SAMPLE_LINES)].replace("{id}", f"{timestamp:x}-{repeat}")
+            yield timestamp, stream_index, line + " " + "x" * max(config["line_bytes"] - len(line) - 1, 0)
+        timestamp += interval
+
+def iter_fake_entries(config, start_time, end_time):
+    """Yield (timestamp, stream_index, line) across all fake streams in the order Loki returns them."""
+    return heapq.merge(*(iter_fake_stream(config, i, start_time, end_time) for i in range(config["streams"])))
+
+def fake_query_range(config, params):
+    """Answer a forward query_range log query with the first limit entries in its time range."""
+    labels = get_fake_labels(config)
+    values = [[] for _ in labels]
+    entries = iter_fake_entries(config, int(params["start"]), int(params["end"]))
+    for timestamp, stream_index, line in itertools.islice(entries, int(params.get("limit", 100))):
+        values[stream_index].append([str(timestamp), line])
+    return {"status": "success", "data": {"resultType": "streams", "result": [
+        {"stream": labels[i], "values": stream_values} for i, stream_values in enumerate(values) if stream_values
+    ]}}
+
+class FakeLokiHandler(http.server.BaseHTTPRequestHandler):
+    """Serves query_range log queries from the synthetic streams in server.config.
+
+    Responses are gzipped when the client accepts it, like Loki with
+    compress_responses, and kept in server.responses so repeated benchmark
+    runs measure the client rather than the fake.
+    """
+    protocol_version = "HTTP/1.1"
+    # Send each response in a single write; a separate write for the headers stalls on delayed ACKs
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != "/loki/api/v1/query_range":
+            self.send_error(404)
+            return
+        gzipped = "gzip" in self.headers.get("Accept-Encoding", "")
+        body = self.server.responses.get((url.query, gzipped))
+        if body is None:
+            params = {name: values[0] for name, values in parse_qs(url.query).items()}
+            body = json.dumps(fake_query_range(self.server.config, params)).encode("utf-8")
+            if gzipped:
+                body = gzip.compress(body)
+            self.server.responses[(url.query, gzipped)] = body
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        if gzipped:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def serve_fake_loki(config, port_queue):
+    """Run a fake Loki server on a free port until terminated, reporting the port on port_queue."""
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FakeLokiHandler)
+    server.config = config
+    server.responses = {}
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+@contextlib.contextmanager
+def fake_loki(config):
+    """Run a fake Loki server in a child process, so it does not compete for the GIL, and yield its URL."""
+    port_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve_fake_loki, args=(config, port_queue), daemon=True)
+    process.start()
+    try:
+        yield f"http://127.0.0.1:{port_queue.get(timeout=10)}"
+    finally:
+        process.terminate()
+        process.join()
+
+def make_query_args(url, hours, *options):
+    """Parse query_logs.py options for a query against url over the first hours of the synthetic range."""
+    start = datetime.datetime.fromtimestamp(FAKE_LOKI_EPOCH / 1e9)
+    end = datetime.datetime.fromtimestamp(FAKE_LOKI_EPOCH / 1e9 + hours * 3600)
+    argv = sys.argv
+    sys.argv = [
+        "query_logs.py", "--url", url, "--namespace", "echo-bench", "--chunk-hours", "1",
+        "--from-date", start.strftime("%Y-%m-%d"), "--from-time", start.strftime("%H:%M:%S"),
+        "--to-date", end.strftime("%Y-%m-%d"), "--to-time", end.strftime("%H:%M:%S"),
+        *options,
+    ]
+    try:
+        return query_logs.setup_arg_parser()
+    finally:
+        sys.argv = argv
+
+def reset_query_logs():
+    """Drop query_logs' shared session, chunk cache, scheduler and stats, so each run starts from scratch."""
+    query_logs._session = None
+    query_logs._cache = None
+    query_logs._scheduler = None
+    query_logs._stats = None
+
+def run_quietly(func, *func_args):
+    """Call func with stdout discarded."""
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        return func(*func_args)
+
+def peak_memory(func):
+    """Return the peak traced memory allocated while running func, in bytes."""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def best_time(func, repeat):
+    """Return the fastest of repeat runs of func, in seconds."""
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+def bench_parse_log_level(args):
+    """Compare parse_log_level against the legacy implementation."""
+    corpus = make_corpus(args.lines)
+
+    for line in corpus + make_fuzz_corpus(args.lines * 5):
+        expected = legacy_parse_log_level(line)
+        actual = query_logs.parse_log_level(line)
+        if expected != actual:
+            print(f"parse_log_level mismatch: {actual!r} != {expected!r} for {line!r}", file=sys.stderr)
+            return None
+
+    legacy = best_time(lambda: [legacy_parse_log_level(line) for line in corpus], args.repeat)
+    current = best_time(lambda: [query_logs.parse_log_level(line) for line in corpus], args.repeat)
+    print(f"parse_log_level: {len(corpus)} lines")
+    print(f"  legacy   {legacy * 1e6 / len(corpus):8.2f} us/line")
+    print(f"  current  {current * 1e6 / len(corpus):8.2f} us/line  ({legacy / current:.1f}x faster)")
+    return {"per_line_us": current * 1e6 / len(corpus)}
+
+def bench_decode(args):
+    """Compare decoding a Loki page with decode_json against the stdlib json module."""
+    body = make_loki_page(args.lines)
+
+    if query_logs.decode_json(body) != json.loads(body):
+        print("decode_json result differs from json.loads", file=sys.stderr)
+        return None
+
+    legacy = best_time(lambda: json.loads(body), args.repeat)
+    current = best_time(lambda: query_logs.decode_json(body), args.repeat)
+    legacy_memory = peak_memory(lambda: json.loads(body))
+    current_memory = peak_memory(lambda: query_logs.decode_json(body))
+    compressed = gzip.compress(body, compresslevel=6)
+    decoder = "orjson" if query_logs.orjson is not None else "json, install orjson for the C decoder"
+    print(f"decode: {args.lines} entries, {len(body) / 1e6:.1f} MB page ({len(compressed) / 1e6:.1f} MB gzipped on the wire)")
+    print(f"  legacy   {legacy * 1e6 / args.lines:8.2f} us/entry  peak {legacy_memory / 1e6:6.1f} MB")
+    print(f"  current  {current * 1e6 / args.lines:8.2f} us/entry  peak {current_memory / 1e6:6.1f} MB  ({legacy / current:.1f}x faster, {decoder})")
+    return {"per_entry_us": current * 1e6 / args.lines, "peak_mb": current_memory / 1e6}
+
+def bench_pipeline(args, name, options, run):
+    """Time run(query_args) against a fake Loki holding about --lines entries and return its metrics.
+
+    Each run starts with a fresh HTTP session. The server is warmed up first,
+    so the timings are of query_logs rather than of the fake.
+    """
+    config = make_fake_config(args.lines)
+    with tempfile.TemporaryDirectory() as tmp_dir, fake_loki(config) as url:
+        query_args = make_query_args(url, PIPELINE_HOURS, "--stats", *[option.format(tmp_dir=tmp_dir) for option in options])
+        start_time, end_time = query_logs.get_time_range(query_args)
+        entries = sum(1 for _ in iter_fake_entries(config, int(start_time), int(end_time)))
+
+        def run_once():
+            reset_query_logs()
+            run_quietly(run, query_args)
+
+        run_once()
+        seconds = best_time(run_once, args.repeat)
+        report = query_logs._stats.get_report()
+        memory = peak_memory(run_once)
+
+    latency = report["requests"]["latency_ms"]
+    print(f"{name}: {entries} entries in {report['requests']['count']} requests")
+    print(f"  {entries / seconds:10.0f} entries/s  latency p50 {latency['p50']:.1f} ms  p95 {latency['p95']:.1f} ms  peak {memory / 1e6:6.1f} MB")
+    return {
+        "entries_per_second": entries / seconds,
+        "latency_p50_ms": latency["p50"],
+        "latency_p95_ms": latency["p95"],
+        "peak_mb": memory / 1e6,
+    }
+
+def bench_fetch_chunked(args):
+    """Fetch with query_loki_logs_chunked, one request per one-hour chunk."""
+    return bench_pipeline(args, "fetch_chunked", ["--limit", str(args.lines)], query_logs.query_loki_logs_chunked)
+
+def bench_fetch_paginated(args):
+    """Fetch with query_loki_logs_chunked and --paginate, in pages of 1000 entries."""
+    return bench_pipeline(args, "fetch_paginated", ["--paginate"], query_logs.query_loki_logs_chunked)
+
+def bench_csv(args):
+    """Fetch with --paginate and write a CSV file with output_as_csv."""
+    return bench_pipeline(args, "csv", ["--paginate", "--output", "csv", "--csv-file", "{tmp_dir}/logs.csv"], query_logs.query_loki_logs)
+
+def bench_json(args):
+    """Fetch with --paginate and print the json output."""
+    return bench_pipeline(args, "json", ["--paginate", "--output", "json"], query_logs.query_loki_logs)
+
+def bench_raw(args):
+    """Fetch with --paginate and print the raw output."""
+    return bench_pipeline(args, "raw", ["--paginate", "--output", "raw"], query_logs.query_loki_logs)
+
+# Benchmarks by name, run in this order
+BENCHMARKS = {
+    "parse_log_level": bench_parse_log_level,
+    "decode": bench_decode,
+    "fetch_chunked": bench_fetch_chunked,
+    "fetch_paginated": bench_fetch_paginated,
+    "csv": bench_csv,
+    "json": bench_json,
+    "raw": bench_raw,
+}
+
+def is_regression(metric, baseline, current, threshold):
+    """Return whether a metric got worse than its baseline by more than threshold.
+
+    Metrics ending in _per_second should go up; _us, _ms and _mb should go down.
+    """
+    if metric.endswith("_per_second"):
+        return current < baseline * (1 - threshold)
+    if metric.endswith(("_us", "_ms", "_mb")):
+        return current > baseline * (1 + threshold)
+    return False
+
+def get_baseline_settings(args):
+    """Return the settings that the numbers of a run depend on, saved with every baseline."""
+    return {"lines": args.lines, "fake_loki": dict(make_fake_config(args.lines), hours=PIPELINE_HOURS)}
+
+def compare_results(args, results, baseline_file, threshold):
+    """Print each metric next to its baseline value and return the number of regressions.
+
+    Returns None without comparing if the baseline was run over different data.
+    """
+    with open(baseline_file, encoding="utf-8") as f:
+        baseline = json.load(f)
+    settings = get_baseline_settings(args)
+    mismatched = [name for name in settings if baseline.get(name) != settings[name]]
+    if mismatched:
+        print(f"Error: {baseline_file} was saved with different {' and '.join(mismatched)} settings "
+              f"(--lines {baseline.get('lines')} instead of {args.lines}); rerun with the same --lines "
+              "or save a new baseline", file=sys.stderr)
+        return None
+    regressions = 0
+    print(f"\nCompared with {baseline_file} (regression: {threshold:.0%} worse):")
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            baseline_value = baseline.get(name, {}).get(metric)
+            if baseline_value is None:
+                continue
+            change = (value - baseline_value) / baseline_value if baseline_value else 0
+            regressed = is_regression(metric, baseline_value, value, threshold)
+            regressions += regressed
+            print(f"  {name + '.' + metric:36} {baseline_value:12.2f} -> {value:12.2f}  {change:+7.1%}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the query_logs.py hot paths and query pipeline')
+    parser.add_argument('--lines', type=int, default=20000, help='Number of synthetic log lines (default: 20000)')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per benchmark, the fastest is reported (default: 5)')
+    parser.add_argument('--only', choices=list(BENCHMARKS), action='append', help='Only run this benchmark (repeatable)')
+    parser.add_argument('--save-baseline', metavar='FILE', help='Save the results as a baseline to FILE')
+    parser.add_argument('--compare', metavar='FILE', help='Compare the results with a baseline saved with --save-baseline, exiting non-zero on regressions')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD, help=f'Relative slowdown that counts as a regression (default: {REGRESSION_THRESHOLD})')
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.only or BENCHMARKS:
+        metrics = BENCHMARKS[name](args)
+        if metrics is None:
+            return 1
+        if metrics:
+            results[name] = metrics
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump({**get_baseline_settings(args), **results}, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\nBaseline saved to {args.save_baseline}")
+    if args.compare:
+        regressions = compare_results(args, results, args.compare, args.threshold)
+        if regressions is None or regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
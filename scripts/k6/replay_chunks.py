@@ -0,0 +1,646 @@
+#!/usr/bin/env python3
+"""Replay the audioChunks/ upload flow against the API with asyncio.
+
+Python counterpart of sendChunks.js that does not need k6. Each simulated
+participant initiates a conversation, uploads chunk_START..chunk_END and
+calls finish. Participants arrive at --rate per second (or all at once) and
+at most --concurrency of them run at a time, sharing a pool of keep-alive
+connections. Latencies are recorded per endpoint in HDR-style histograms and
+can be exported as CSV or JSON.
+"""
+
+import argparse
+import asyncio
+import csv
+import datetime
+import json
+import math
+import os
+import random
+import ssl
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+try:
+    # Optional, a faster and more battle-tested client than the built-in one below
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+DEFAULT_API_BASE = 'https://api.dembrane.com'
+CHUNK_FIELD = 'chunk'
+USER_AGENT = 'replay_chunks.py (load test script)'
+
+# Histogram precision: values are exact up to 2**HISTOGRAM_SUB_BUCKET_BITS
+# microseconds and within 1/2**(HISTOGRAM_SUB_BUCKET_BITS - 1) (under 1%) above
+HISTOGRAM_SUB_BUCKET_BITS = 8
+
+# Percentiles in the summary table and exports
+REPORT_PERCENTILES = (50, 90, 95, 99, 99.9)
+
+ENDPOINTS = ('initiate', 'upload_chunk', 'finish')
+
+# Pooled connections idle longer than this are closed instead of reused.
+# Servers drop idle keep-alive connections after a few seconds (uvicorn: 5s),
+# and --sleep between uploads is usually longer than that.
+POOL_IDLE_SECONDS = 4
+
+
+class LatencyHistogram:
+    """Log-linear latency histogram in the style of HdrHistogram.
+
+    Values (microseconds) are counted in buckets whose width grows with the
+    value, so memory stays small and constant however many requests are
+    recorded, while every percentile is accurate to HISTOGRAM_SUB_BUCKET_BITS.
+    """
+
+    def __init__(self):
+        self.counts = defaultdict(int)
+        self.total = 0
+        self.min = None
+        self.max = 0
+        self.sum = 0
+
+    def record(self, micros):
+        value = max(0, int(micros))
+        shift = max(0, value.bit_length() - HISTOGRAM_SUB_BUCKET_BITS)
+        self.counts[(shift << HISTOGRAM_SUB_BUCKET_BITS) | (value >> shift)] += 1
+        self.total += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        self.min = value if self.min is None else min(self.min, value)
+
+    @staticmethod
+    def bucket_upper_bound(index):
+        shift = index >> HISTOGRAM_SUB_BUCKET_BITS
+        mantissa = index & ((1 << HISTOGRAM_SUB_BUCKET_BITS) - 1)
+        return ((mantissa + 1) << shift) - 1
+
+    def percentile(self, percent):
+        """Highest value (microseconds) in the bucket holding the given percentile."""
+        if not self.total:
+            return 0
+        rank = max(1, math.ceil(self.total * percent / 100))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self.bucket_upper_bound(index), self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.total,
+            'min_ms': (self.min or 0) / 1000,
+            'mean_ms': self.sum / self.total / 1000 if self.total else 0,
+            'max_ms': self.max / 1000,
+            **{f'p{percent:g}_ms': self.percentile(percent) / 1000 for percent in REPORT_PERCENTILES},
+            # Sparse buckets as [upper bound in microseconds, count], enough to merge runs later
+            'buckets': [[self.bucket_upper_bound(index), self.counts[index]] for index in sorted(self.counts)],
+        }
+
+
+class RunResults:
+    """Latency histograms and status counts per endpoint, overall and per --step bucket."""
+
+    def __init__(self, step_seconds):
+        self.step_seconds = step_seconds
+        self.histograms = defaultdict(LatencyHistogram)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        # (bucket end timestamp, endpoint) -> [histogram, errors]
+        self.buckets = {}
+        self.started = time.time()
+        self.finished = None
+        self.conversations = 0
+        self.failed_conversations = 0
+
+    def record(self, endpoint, started, seconds, status):
+        """Record one request; status is the HTTP status or an exception class name."""
+        micros = seconds * 1e6
+        self.histograms[endpoint].record(micros)
+        self.statuses[endpoint][str(status)] += 1
+        # Bucket on the step end like a Loki range query, whose point at T covers (T - step, T]
+        bucket_end = math.ceil((started + seconds) / self.step_seconds) * self.step_seconds
+        bucket = self.buckets.setdefault((bucket_end, endpoint), [LatencyHistogram(), 0])
+        bucket[0].record(micros)
+        if is_error(status):
+            bucket[1] += 1
+
+    def errors(self, endpoint):
+        return sum(count for status, count in self.statuses[endpoint].items() if is_error(status))
+
+    def iter_series_rows(self):
+        """Long format rows like `query_logs.py --metric ... --output csv`."""
+        for (bucket_end, endpoint), (histogram, errors) in sorted(self.buckets.items()):
+            timestamp = datetime.datetime.fromtimestamp(bucket_end).isoformat()
+            yield {'timestamp': timestamp, 'endpoint': endpoint, 'stat': 'count', 'value': histogram.total}
+            yield {'timestamp': timestamp, 'endpoint': endpoint, 'stat': 'errors', 'value': errors}
+            for percent in REPORT_PERCENTILES:
+                yield {'timestamp': timestamp, 'endpoint': endpoint, 'stat': f'p{percent:g}_ms',
+                       'value': histogram.percentile(percent) / 1000}
+
+    def to_dict(self, args):
+        duration = (self.finished or time.time()) - self.started
+        return {
+            'base_url': args.base_url,
+            'started': datetime.datetime.fromtimestamp(self.started).isoformat(),
+            'duration_seconds': duration,
+            'conversations': self.conversations,
+            'failed_conversations': self.failed_conversations,
+            'settings': {
+                'concurrency': args.concurrency, 'rate': args.rate, 'connections': args.connections,
+                'chunks': [args.start, args.end], 'sleep': args.sleep, 'finish': not args.no_finish,
+                'client': 'aiohttp' if use_aiohttp(args) else 'asyncio',
+            },
+            'endpoints': {
+                endpoint: dict(histogram.to_dict(), errors=self.errors(endpoint),
+                               statuses=dict(self.statuses[endpoint]),
+                               rps=histogram.total / duration if duration else 0)
+                for endpoint, histogram in sorted(self.histograms.items())
+            },
+            'step_seconds': self.step_seconds,
+            'series': list(self.iter_series_rows()),
+        }
+
+
+def is_error(status):
+    return not str(status).isdigit() or int(status) >= 400
+
+
+def use_aiohttp(args):
+    return aiohttp is not None and not args.no_aiohttp
+
+
+class NoResponseError(ConnectionResetError):
+    """The connection failed before any byte of the response arrived."""
+
+
+class HttpClient:
+    """Minimal HTTP/1.1 client over a bounded pool of keep-alive connections.
+
+    Used when aiohttp is not installed. Only what the upload flow needs:
+    requests with a complete body in memory and responses with a
+    Content-Length or chunked body.
+
+    A server may close an idle connection just as it is reused. Connections
+    idle for POOL_IDLE_SECONDS are not reused at all, and a request on a
+    reused connection that is closed before the response starts or before
+    its body is complete is sent once more on a new connection.
+    """
+
+    def __init__(self, base_url, connections, timeout):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.ssl = ssl.create_default_context() if parts.scheme == 'https' else None
+        self.host_header = parts.netloc
+        self.prefix = parts.path.rstrip('/')
+        self.timeout = timeout
+        self.idle = []
+        self.slots = asyncio.Semaphore(connections)
+
+    async def request(self, method, path, body=b'', headers=None):
+        """Return (status, body bytes)."""
+        async with self.slots:
+            connection = self.take_idle()
+            if connection is not None:
+                try:
+                    return await self.send(connection, method, path, body, headers or {})
+                except (NoResponseError, asyncio.IncompleteReadError):
+                    # Closed by the server while idle or just as it was reused
+                    pass
+            return await self.send(None, method, path, body, headers or {})
+
+    def take_idle(self):
+        """Pop the most recently used idle connection, closing those idle for too long."""
+        now = time.monotonic()
+        while self.idle:
+            reader, writer, idle_since = self.idle.pop()
+            if now - idle_since < POOL_IDLE_SECONDS and not reader.at_eof():
+                return reader, writer
+            writer.close()
+        return None
+
+    async def send(self, connection, method, path, body, headers):
+        """Send one request on connection, or a new one if None, and pool it again if kept alive."""
+        try:
+            if connection is None:
+                connection = await asyncio.wait_for(
+                    asyncio.open_connection(self.host, self.port, ssl=self.ssl), self.timeout)
+            status, data, keep_alive = await asyncio.wait_for(
+                self.exchange(connection, method, path, body, headers), self.timeout)
+        except BaseException:
+            if connection is not None:
+                connection[1].close()
+            raise
+        if keep_alive:
+            self.idle.append((*connection, time.monotonic()))
+        else:
+            connection[1].close()
+        return status, data
+
+    async def exchange(self, connection, method, path, body, headers):
+        reader, writer = connection
+        lines = [f'{method} {self.prefix}{path} HTTP/1.1', f'Host: {self.host_header}',
+                 f'User-Agent: {USER_AGENT}', f'Content-Length: {len(body)}']
+        lines += [f'{name}: {value}' for name, value in headers.items()]
+        try:
+            writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+            await writer.drain()
+            status_line = await reader.readline()
+        except (ConnectionResetError, BrokenPipeError) as e:
+            raise NoResponseError(str(e)) from e
+        if not status_line:
+            raise NoResponseError('connection closed by server')
+        status = int(status_line.split()[1])
+        response_headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+
+        if response_headers.get('transfer-encoding', '').lower() == 'chunked':
+            data = bytearray()
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if not size:
+                    await reader.readline()
+                    break
+                data += await reader.readexactly(size)
+                await reader.readline()
+            data = bytes(data)
+        elif 'content-length' in response_headers:
+            data = await reader.readexactly(int(response_headers['content-length']))
+        else:
+            # Body runs until the server closes the connection
+            data = await reader.read()
+            return status, data, False
+        keep_alive = response_headers.get('connection', '').lower() != 'close'
+        return status, data, keep_alive
+
+    async def close(self):
+        for _, writer, _ in self.idle:
+            writer.close()
+        self.idle = []
+
+
+class AiohttpClient:
+    """Same interface as HttpClient on top of an aiohttp session."""
+
+    def __init__(self, base_url, connections, timeout):
+        self.base_url = base_url.rstrip('/')
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=connections),
+            timeout=aiohttp.ClientTimeout(total=timeout),
+            headers={'User-Agent': USER_AGENT},
+        )
+
+    async def request(self, method, path, body=b'', headers=None):
+        async with self.session.request(method, self.base_url + path, data=body, headers=headers) as response:
+            return response.status, await response.read()
+
+    async def close(self):
+        await self.session.close()
+
+
+def load_chunks(args):
+    """Read chunk_START..chunk_END from --chunks-dir, skipping missing files like sendChunks.js."""
+    chunks = []
+    for i in range(args.start, args.end + 1):
+        filename = f'chunk_{i:03d}.webm'
+        try:
+            with open(os.path.join(args.chunks_dir, filename), 'rb') as f:
+                chunks.append((filename, f.read()))
+        except FileNotFoundError:
+            pass
+    return chunks
+
+
+def build_multipart(fields, files):
+    """Encode form fields and (name, filename, content type, data) files as multipart/form-data."""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, filename, content_type, data in files:
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n'.encode() + data + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+async def timed_request(client, results, endpoint, method, path, body=b'', headers=None):
+    """Send a request and record its latency; returns (status, body) or (None, None) on failure."""
+    started = time.time()
+    clock = time.perf_counter()
+    try:
+        status, data = await client.request(method, path, body, headers)
+    except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError) as e:
+        results.record(endpoint, started, time.perf_counter() - clock, type(e).__name__)
+        return None, None
+    results.record(endpoint, started, time.perf_counter() - clock, status)
+    return status, data
+
+
+async def run_conversation(args, client, results, chunks):
+    """One participant: initiate, upload every chunk, finish. Returns True on success."""
+    body = json.dumps({
+        'name': 'replay_chunks.py User Talks',
+        'pin': '',
+        'tag_id_list': [],
+        'user_agent': USER_AGENT,
+        'source': 'PORTAL_AUDIO',
+    }).encode()
+    status, data = await timed_request(
+        client, results, 'initiate', 'POST',
+        f'/api/participant/projects/{args.project_id}/conversations/initiate', body,
+        {'accept': 'application/json, text/plain, */*', 'content-type': 'application/json'})
+    if status is None or is_error(status):
+        return False
+    try:
+        response = json.loads(data)
+        conversation_id = (response.get('conversation_id') or (response.get('conversation') or {}).get('id')
+                           or response.get('id'))
+    except (ValueError, AttributeError):
+        conversation_id = None
+    if not conversation_id:
+        return False
+
+    ok = True
+    for i, (filename, data) in enumerate(chunks):
+        is_last = i == len(chunks) - 1
+        body, content_type = build_multipart(
+            {'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+             'source': 'PORTAL_AUDIO',
+             'run_finish_hook': str(is_last).lower()},
+            [(CHUNK_FIELD, filename, 'audio/webm', data)])
+        status, _ = await timed_request(
+            client, results, 'upload_chunk', 'POST',
+            f'/api/participant/conversations/{conversation_id}/upload-chunk', body,
+            {'accept': 'application/json, text/plain, */*', 'content-type': content_type})
+        ok = ok and status is not None and not is_error(status)
+        if not is_last and args.sleep:
+            await asyncio.sleep(args.sleep)
+
+    if not args.no_finish:
+        status, _ = await timed_request(
+            client, results, 'finish', 'POST', f'/api/participant/conversations/{conversation_id}/finish',
+            b'', {'accept': 'application/json, text/plain, */*'})
+        ok = ok and status is not None and not is_error(status)
+    return ok
+
+
+async def run_load(args, chunks):
+    """Start --conversations participants at --rate, at most --concurrency at a time."""
+    results = RunResults(args.step)
+    client_class = AiohttpClient if use_aiohttp(args) else HttpClient
+    client = client_class(args.base_url, args.connections, args.timeout)
+    slots = asyncio.Semaphore(args.concurrency)
+    # Participants that arrive while all slots are busy wait; that wait is
+    # recorded too, so an overloaded server cannot hide behind a slow driver
+    start_lag = LatencyHistogram()
+
+    async def participant(scheduled):
+        async with slots:
+            start_lag.record((time.perf_counter() - scheduled) * 1e6)
+            try:
+                ok = await run_conversation(args, client, results, chunks)
+            except Exception as e:
+                print(f"Warning: conversation failed: {e}", file=sys.stderr)
+                ok = False
+            results.conversations += 1
+            if not ok:
+                results.failed_conversations += 1
+
+    tasks = []
+    next_arrival = time.perf_counter()
+    try:
+        for _ in range(args.conversations):
+            delay = next_arrival - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(participant(next_arrival)))
+            if args.rate:
+                # Poisson arrivals by default, evenly spaced with --constant-rate
+                gap = 1 / args.rate if args.constant_rate else random.expovariate(args.rate)
+                next_arrival += gap
+        await asyncio.gather(*tasks)
+    finally:
+        results.finished = time.time()
+        await client.close()
+    return results, start_lag
+
+
+def print_summary(results, start_lag):
+    duration = results.finished - results.started
+    print(f"{results.conversations} conversations in {duration:.1f}s, {results.failed_conversations} failed")
+    header = ['endpoint', 'count', 'errors', 'req/s', 'min'] + [f'p{p:g}' for p in REPORT_PERCENTILES] + ['max']
+    rows = [header]
+    for endpoint in sorted(results.histograms, key=lambda e: ENDPOINTS.index(e) if e in ENDPOINTS else len(ENDPOINTS)):
+        histogram = results.histograms[endpoint]
+        rows.append([endpoint, str(histogram.total), str(results.errors(endpoint)),
+                     f'{histogram.total / duration:.1f}' if duration else '-',
+                     f'{(histogram.min or 0) / 1000:.1f}']
+                    + [f'{histogram.percentile(p) / 1000:.1f}' for p in REPORT_PERCENTILES]
+                    + [f'{histogram.max / 1000:.1f}'])
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    for row in rows:
+        print("  ".join(cell.rjust(width) if i else cell.ljust(width) for i, (cell, width) in enumerate(zip(row, widths))))
+    print("Latencies in ms.", end=' ')
+    if start_lag.max >= 100_000:
+        print(f"Participants waited up to {start_lag.max / 1e6:.2f}s (p95 {start_lag.percentile(95) / 1e6:.2f}s) "
+              "for a free --concurrency slot.")
+    else:
+        print()
+    for endpoint in sorted(results.statuses):
+        statuses = results.statuses[endpoint]
+        if any(is_error(status) for status in statuses):
+            print(f"{endpoint} statuses: " + ", ".join(f"{status}: {count}" for status, count in sorted(statuses.items())))
+
+
+def export_results(args, results, start_lag):
+    if args.csv_file:
+        with open(args.csv_file, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=['timestamp', 'endpoint', 'stat', 'value'])
+            writer.writeheader()
+            writer.writerows(results.iter_series_rows())
+        print(f"CSV output written to {args.csv_file}")
+    if args.json_file:
+        report = results.to_dict(args)
+        report['start_lag'] = start_lag.to_dict()
+        with open(args.json_file, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"JSON output written to {args.json_file}")
+
+
+class StubApiHandler(BaseHTTPRequestHandler):
+    """Answers the three upload flow endpoints after --stub-latency, like a healthy API would."""
+
+    protocol_version = 'HTTP/1.1'
+    # Small responses are sent in one segment; the default write buffer splits them
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.idle_since = time.monotonic()
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        keepalive_timeout = self.server.keepalive_timeout
+        if keepalive_timeout and time.monotonic() - self.idle_since > keepalive_timeout:
+            # As if the keep-alive timeout fired just before the request came in:
+            # close without an answer, which the client cannot see coming
+            self.close_connection = True
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        self.rfile.read(length)
+        latency = self.server.latency_ms / 1000
+        if latency:
+            time.sleep(random.uniform(0.5, 1.5) * latency)
+        if self.server.error_rate and random.random() < self.server.error_rate:
+            self.reply(503, {'detail': 'stub error'})
+        elif self.path.endswith('/conversations/initiate'):
+            self.reply(200, {'id': str(uuid.uuid4())})
+        elif self.path.endswith('/upload-chunk') or self.path.endswith('/finish'):
+            self.reply(200, {'status': 'ok'})
+        else:
+            self.reply(404, {'detail': 'not found'})
+
+    def reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.server.truncate_rate and random.random() < self.server.truncate_rate:
+            # Close halfway through the body, as when the API or a proxy drops the connection
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+        else:
+            self.wfile.write(body)
+        self.idle_since = time.monotonic()
+
+
+def start_stub_server(args, port=0):
+    """Run the stub API in a background thread and return the server."""
+    server = ThreadingHTTPServer(('127.0.0.1', port), StubApiHandler)
+    server.daemon_threads = True
+    server.latency_ms = args.stub_latency
+    server.error_rate = args.stub_error_rate
+    server.keepalive_timeout = args.stub_keepalive_timeout
+    server.truncate_rate = args.stub_truncate_rate
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def setup_arg_parser():
+    parser = argparse.ArgumentParser(description='Replay audio chunk uploads against the API with asyncio')
+    parser.add_argument('--base-url', default=os.environ.get('API_BASE', DEFAULT_API_BASE),
+                        help=f'API base URL (default: $API_BASE or {DEFAULT_API_BASE})')
+    parser.add_argument('--project-id', default=os.environ.get('PROJECT_ID'),
+                        help='Target project id (default: $PROJECT_ID, required unless --stub)')
+    parser.add_argument('--chunks-dir', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'audioChunks'),
+                        help='Directory of chunk_XXX.webm files (default: audioChunks next to this script)')
+    parser.add_argument('--start', type=int, default=0, help='First chunk index (default: 0)')
+    parser.add_argument('--end', type=int, default=3, help='Last chunk index, inclusive (default: 3)')
+    parser.add_argument('--sleep', type=float, default=30,
+                        help='Seconds between the uploads of one conversation (default: 30)')
+    parser.add_argument('--no-finish', action='store_true', help="Don't call /finish after the last chunk")
+    parser.add_argument('--conversations', type=int, default=10,
+                        help='Number of conversations to run (default: 10)')
+    parser.add_argument('--concurrency', type=int, default=10,
+                        help='Conversations in flight at once (default: 10)')
+    parser.add_argument('--rate', type=float, default=0,
+                        help='New conversations per second; 0 starts them as fast as --concurrency allows (default: 0)')
+    parser.add_argument('--constant-rate', action='store_true',
+                        help='Space --rate arrivals evenly instead of as a Poisson process')
+    parser.add_argument('--connections', type=int,
+                        help='Size of the connection pool (default: --concurrency)')
+    parser.add_argument('--timeout', type=float, default=120, help='Seconds per request (default: 120)')
+    parser.add_argument('--no-aiohttp', action='store_true',
+                        help='Use the built-in HTTP client even if aiohttp is installed')
+    parser.add_argument('--step', type=int, default=60,
+                        help='Seconds per time bucket in the CSV/JSON series (default: 60)')
+    parser.add_argument('--csv-file', help='Write per-step, per-endpoint series to this CSV file')
+    parser.add_argument('--json-file', help='Write the full results, histograms included, to this JSON file')
+    parser.add_argument('--stub', action='store_true',
+                        help='Run against a local stub API started in-process instead of --base-url')
+    parser.add_argument('--serve-stub', type=int, metavar='PORT',
+                        help='Only run the stub API on this port (e.g. to point k6 at it)')
+    parser.add_argument('--stub-latency', type=float, default=20,
+                        help='Mean stub response time in ms (default: 20)')
+    parser.add_argument('--stub-error-rate', type=float, default=0,
+                        help='Fraction of stub responses that are 503s (default: 0)')
+    parser.add_argument('--stub-keepalive-timeout', type=float, default=0,
+                        help='Drop the next request on a stub connection idle for this many seconds, closing it '
+                             'unanswered like a keep-alive timeout racing the request (default: 0, never)')
+    parser.add_argument('--stub-truncate-rate', type=float, default=0,
+                        help='Fraction of stub responses cut off halfway through the body (default: 0)')
+    parser.add_argument('--seed', type=int, help='Random seed for arrivals and the stub')
+
+    args = parser.parse_args()
+    if args.connections is None:
+        args.connections = args.concurrency
+    if args.concurrency < 1 or args.connections < 1 or args.conversations < 0:
+        parser.error("--concurrency and --connections must be at least 1, --conversations not negative")
+    if args.rate < 0:
+        parser.error("--rate must not be negative")
+    if args.step < 1:
+        parser.error("--step must be at least 1 second")
+    if not (args.stub or args.serve_stub or args.project_id):
+        parser.error("--project-id (or $PROJECT_ID) is required unless --stub is given")
+    return args
+
+
+def main(args):
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    if args.serve_stub:
+        server = start_stub_server(args, args.serve_stub)
+        print(f"Stub API listening on http://127.0.0.1:{server.server_port}")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
+        return 0
+
+    chunks = load_chunks(args)
+    if not chunks:
+        print(f"Error: no chunk_{args.start:03d}..chunk_{args.end:03d}.webm files in {args.chunks_dir}", file=sys.stderr)
+        return 1
+
+    server = None
+    if args.stub:
+        server = start_stub_server(args)
+        args.base_url = f"http://127.0.0.1:{server.server_port}"
+        args.project_id = args.project_id or 'stub-project'
+    print(f"Replaying {len(chunks)} chunk(s) x {args.conversations} conversation(s) against {args.base_url} "
+          f"({'aiohttp' if use_aiohttp(args) else 'built-in client'})")
+    try:
+        results, start_lag = asyncio.run(run_load(args, chunks))
+    finally:
+        if server:
+            server.shutdown()
+
+    print_summary(results, start_lag)
+    export_results(args, results, start_lag)
+    return 1 if results.failed_conversations else 0
+
+
+if __name__ == '__main__':
+    try:
+        sys.exit(main(setup_arg_parser()))
+    except KeyboardInterrupt:
+        sys.exit(130)
@@ -3,7 +3,7 @@ import http from 'k6/http'
 
 // Minimal configuration
 const PROJECT_ID = __ENV.PROJECT_ID
-const API_BASE = 'https://api.dembrane.com'
+const API_BASE = __ENV.API_BASE || 'https://api.dembrane.com'
 const CHUNKS_DIR = __ENV.CHUNKS_DIR || 'audioChunks'
 const START = Number(__ENV.START || 0)
 const END = Number(__ENV.END || 3)
@@ -4,14 +4,183 @@ import requests
 import json
 import time
 import argparse
+import collections
+import base64
+import copy
+import cProfile
 import datetime
 import sys
 import os
+import pstats
 import csv
-from io import StringIO
-from urllib.parse import quote
+import email.utils
+import gzip
+import hashlib
+import heapq
+import itertools
+import math
+import queue
+import random
+import re
+import sqlite3
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, urlencode
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 
+try:
+    # Optional C JSON decoder, several times faster than json on large Loki pages
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    # Peak RSS for the --stats report (Unix only)
+    import resource
+except ImportError:
+    resource = None
+
+# Shared HTTP session so every request reuses pooled keep-alive connections
+_session = None
+
+# Shared on-disk chunk cache, only set up when --cache is given
+_cache = None
+
+# Shared pacing of Loki requests (--max-rps, --max-concurrent, backoff after overload)
+_scheduler = None
+
+# Counters and timings for the --stats report, only set up when --stats is given
+_stats = None
+
+# Loki requests that fail with a connection error, timeout or one of these
+# statuses are retried with full-jitter exponential backoff
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+RETRY_BASE_SECONDS = 0.5
+RETRY_MAX_SECONDS = 30
+
+# Cap on a Retry-After delay asked for by Loki or a proxy in front of it
+RETRY_AFTER_MAX_SECONDS = 300
+
+# Seconds to wait for a connection to Loki; --timeout covers the response
+CONNECT_TIMEOUT_SECONDS = 10
+
+# Functions listed by --profile when the profile is printed rather than saved
+PROFILE_TOP_FUNCTIONS = 25
+
+# Bucket size of the log volume probe used by --adaptive-chunks
+ADAPTIVE_PROBE_STEP_SECONDS = 10 * 60
+
+# Seconds to wait before reconnecting a dropped --follow tail, doubling up to the maximum
+FOLLOW_RECONNECT_MIN_SECONDS = 1
+FOLLOW_RECONNECT_MAX_SECONDS = 30
+
+# A reconnected --follow tail resumes this far before the newest line seen,
+# so lines of streams that lag behind the others are not skipped
+FOLLOW_RESUME_OVERLAP_SECONDS = 30
+
+# Pages each namespace may queue up ahead of the merged multi-namespace timeline
+NAMESPACE_FEED_PAGES = 4
+
+# Components searched by --correlate, the path of an upload through the app
+CORRELATE_COMPONENTS = "api,worker,directus"
+
+# ID-like tokens indexed by --correlate: UUIDs and long hex ids
+ID_TOKEN_PATTERN = re.compile(r"\b[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\b|\b[0-9a-fA-F]{16,}\b")
+
+# key=value pairs of logfmt lines, values optionally double-quoted
+LOGFMT_PATTERN = re.compile(r'([A-Za-z_][\w.\-]*)=("(?:[^"\\]|\\.)*"|[^\s"]*)')
+
+# Structured fields that hold the message, level and time of a log line
+MESSAGE_FIELDS = ("message", "msg", "event")
+LEVEL_FIELDS = ("level", "levelname", "severity")
+TIME_FIELDS = ("time", "timestamp", "ts", "asctime")
+
+# Numeric levels of pino (directus) JSON logs
+PINO_LEVELS = {10: "TRACE", 20: "DEBUG", 30: "INFO", 40: "WARN", 50: "ERROR", 60: "FATAL"}
+
+# Placeholder for the variable parts of a --cluster pattern
+CLUSTER_WILDCARD = "<*>"
+
+# Variable parts masked before --cluster mines templates: timestamps, UUIDs,
+# hex ids, IP addresses and any other token with a number in it
+CLUSTER_MASK_PATTERN = re.compile(
+    r"\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:[.,]\d+)?(?:Z|[+-]\d{2}:?\d{2})?"
+    r"|\b[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\b"
+    r"|\b(?:0x)?(?=[0-9a-fA-F]*\d)[0-9a-fA-F]{8,}\b"
+    r"|\b\d{1,3}(?:\.\d{1,3}){3}(?::\d+)?\b"
+    r"|[-+]?\b\d+(?:\.\d+)?[a-zA-Z%]*\b"
+)
+
+# Distinct components and pods listed per --cluster pattern, and sample length
+CLUSTER_MAX_LABEL_VALUES = 20
+CLUSTER_SAMPLE_CHARS = 1000
+
+# Chunks ending less than this long ago may still receive late log lines, so they are never cached
+CACHE_SETTLE_SECONDS = 10 * 60
+
+# Tables of the --index local log store. Streams are kept per selector (the
+# label matchers of a query) with their labels as columns; entries_fts is a
+# trigram full-text index over the lines. New lines are indexed in bulk by
+# LogIndex.store_chunk, which is several times faster than a per-row trigger.
+LOG_INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS streams (
+    id INTEGER PRIMARY KEY,
+    selector TEXT NOT NULL,
+    labels TEXT NOT NULL,
+    namespace TEXT NOT NULL,
+    component TEXT NOT NULL,
+    pod TEXT NOT NULL,
+    container TEXT NOT NULL,
+    UNIQUE (selector, labels)
+);
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    stream_id INTEGER NOT NULL REFERENCES streams (id),
+    ts INTEGER NOT NULL,
+    level TEXT NOT NULL,
+    line TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_ts ON entries (ts);
+CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5 (line, content='entries', content_rowid='id', tokenize='trigram');
+CREATE TRIGGER IF NOT EXISTS entries_fts_delete AFTER DELETE ON entries BEGIN
+    INSERT INTO entries_fts (entries_fts, rowid, line) VALUES ('delete', old.id, old.line);
+END;
+CREATE TABLE IF NOT EXISTS coverage (
+    selector TEXT NOT NULL,
+    start_ts INTEGER NOT NULL,
+    end_ts INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS coverage_selector ON coverage (selector, start_ts);
+"""
+
+# Columns --count-by can group the local index by
+INDEX_COUNT_COLUMNS = {
+    "namespace": "streams.namespace",
+    "component": "streams.component",
+    "pod": "streams.pod",
+    "container": "streams.container",
+    "level": "entries.level",
+}
+
+# Characters that make a --text-contains pattern a regular expression rather than plain text
+REGEX_METACHARACTERS = set(".^$*+?{}[]\\|()")
+
+def parse_duration(value):
+    """Parse a duration such as 30s, 5m, 1h or 1d (bare numbers are seconds) into seconds."""
+    units = {"s": 1, "m": 60, "h": 60 * 60, "d": 24 * 60 * 60}
+    try:
+        if value[-1] in units:
+            seconds = int(value[:-1]) * units[value[-1]]
+        else:
+            seconds = int(value)
+    except (ValueError, IndexError):
+        raise argparse.ArgumentTypeError(f"invalid duration: {value!r}")
+    if seconds <= 0:
+        raise argparse.ArgumentTypeError(f"duration must be positive: {value!r}")
+    return seconds
+
 def setup_arg_parser():
     parser = argparse.ArgumentParser(description='Query Loki logs for echo app')
     parser.add_argument('--url', default='http://localhost:3100', help='Loki API URL')
@@ -24,19 +193,94 @@ def setup_arg_parser():
     parser.add_argument('--to-date', help='End date in YYYY-MM-DD format')
     parser.add_argument('--to-time', default='23:59:59', help='End time in HH:MM:SS format (used with --to-date)')
     parser.add_argument('--component', default='api', help='Echo component to filter logs (e.g., api, worker, directus)')
-    parser.add_argument('--namespace', default='echo-dev', help='Kubernetes namespace')
+    parser.add_argument('--namespace', default='echo-dev', help='Kubernetes namespace, or a comma-separated list to query and merge several')
     parser.add_argument('--limit', type=int, default=1000, help='Maximum number of log lines per request')
     parser.add_argument('--max-entries', type=int, help='Maximum total log entries to retrieve (default: unlimited)')
-    parser.add_argument('--output', default='json', choices=['json', 'raw', 'csv'], help='Output format')
+    parser.add_argument('--output', default='json', choices=['json', 'raw', 'csv', 'ndjson', 'parquet', 'arrow'], help='Output format')
     parser.add_argument('--debug', action='store_true', help='Enable debug output')
     parser.add_argument('--all', action='store_true', help='Get all logs regardless of component')
     parser.add_argument('--csv-file', help='CSV file to save the output (only for CSV output)')
+    parser.add_argument('--output-file', help='File to write the output to (required for parquet and arrow output)')
+    parser.add_argument('--row-group-size', type=int, default=100000, help='Log entries per row group for parquet and arrow output (default: 100000)')
     parser.add_argument('--text-contains', help='Filter logs to include only those containing this text')
     parser.add_argument('--text-not-contains', help='Filter logs to exclude those containing this text')
     parser.add_argument('--container', help='Container name to filter logs')
     parser.add_argument('--paginate', action='store_true', help='Use pagination to retrieve all logs within time range')
     parser.add_argument('--chunk-hours', type=int, default=11, help='Hours per time chunk for Loki queries (max 12, default: 11)')
-    return parser.parse_args()
+    parser.add_argument('--workers', type=int, default=1, help='Number of time chunks to fetch concurrently (default: 1)')
+    parser.add_argument('--follow', action='store_true', help='Live tail new logs over Loki\'s websocket tail endpoint until interrupted')
+    parser.add_argument('--metric', choices=['count_over_time', 'rate', 'bytes_over_time', 'bytes_rate'], help='Aggregate in Loki with this LogQL range function and print time series instead of log lines')
+    parser.add_argument('--step', type=parse_duration, default=300, help='Time series resolution for --metric, e.g. 30s, 5m, 1h (default: 5m)')
+    parser.add_argument('--by', default='component,pod', help='Comma-separated labels to group --metric series by, empty for a single total (default: component,pod)')
+    parser.add_argument('--adaptive-chunks', action='store_true', help='Size time chunks from a log volume probe so each holds about one page (--limit) of logs')
+    parser.add_argument('--cache', action='store_true', help='Cache fetched time chunks that lie fully in the past on disk')
+    parser.add_argument('--cache-dir', default='~/.cache/echo-query-logs', help='Directory for the chunk cache (default: ~/.cache/echo-query-logs)')
+    parser.add_argument('--cache-size-mb', type=int, default=512, help='Maximum size of the chunk cache in MB (default: 512)')
+    parser.add_argument('--checkpoint', action='store_true', help='Write --csv-file chunk by chunk and record the progress in a <csv-file>.manifest.json sidecar, so an interrupted export can be resumed')
+    parser.add_argument('--resume', action='store_true', help='Continue the checkpointed export of --csv-file from its manifest (implies --checkpoint)')
+    parser.add_argument('--timeout', type=float, default=60, help='Seconds to wait for each Loki response before retrying it (default: 60)')
+    parser.add_argument('--retries', type=int, default=5, help='Times to retry a Loki request after a timeout, connection error, 429 or 5xx before giving up (default: 5)')
+    parser.add_argument('--max-rps', type=float, default=0, help='Maximum Loki requests per second across all workers, 0 for no limit (default: 0)')
+    parser.add_argument('--max-concurrent', type=int, default=0, help='Maximum Loki requests in flight across all workers and namespaces, 0 for no limit (default: 0)')
+    parser.add_argument('--stats', nargs='?', const='-', metavar='FILE', help='Write a JSON report of request latency, bytes, throughput, time spent and peak memory to FILE, or to stderr if no FILE is given')
+    parser.add_argument('--profile', nargs='?', const='-', metavar='FILE', help='Run under cProfile and print the top functions to stderr, or save the profile to FILE for pstats/snakeviz')
+    parser.add_argument('--index', metavar='PATH', help='Keep fetched logs in a local SQLite store at PATH and answer the query from it, fetching only time ranges it does not hold yet')
+    parser.add_argument('--offline', action='store_true', help='Answer the query from the --index store only, without contacting Loki')
+    parser.add_argument('--level', help='Comma-separated log levels to keep, e.g. ERROR,WARNING (requires --index)')
+    parser.add_argument('--correlate', metavar='ID[,ID]', help='Follow these IDs (e.g. a conversation or request id) through the logs of every --correlate-components component and print a timeline per ID; - reads the IDs from stdin after one unfiltered pull')
+    parser.add_argument('--correlate-components', default=CORRELATE_COMPONENTS, help=f'Comma-separated components searched concurrently by --correlate (default: {CORRELATE_COMPONENTS})')
+    parser.add_argument('--cluster', action='store_true', help='Mine the log lines into patterns (variable parts as <*>) in one streaming pass and print one row per pattern with its count, first/last seen, components, pods and a sample')
+    parser.add_argument('--cluster-similarity', type=float, default=0.4, help='Fraction of equal tokens a line needs to join a --cluster pattern (default: 0.4)')
+    parser.add_argument('--cluster-depth', type=int, default=4, help='Depth of the --cluster parse tree; lines are grouped by their first depth-2 tokens (default: 4)')
+    parser.add_argument('--cluster-max', type=int, default=5000, help='Maximum --cluster patterns kept in memory, the least recently seen are dropped beyond it (default: 5000)')
+    parser.add_argument('--count-by', help='Print entry counts grouped by these comma-separated columns (namespace, component, pod, container, level) instead of log lines (requires --index)')
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.retries < 0 or args.max_rps < 0 or args.max_concurrent < 0 or args.timeout <= 0:
+        parser.error("--retries, --max-rps and --max-concurrent cannot be negative, and --timeout must be positive")
+    if args.follow and args.output not in ('raw', 'csv', 'ndjson'):
+        parser.error("--follow supports --output raw, csv or ndjson")
+    if args.metric and args.output in ('parquet', 'arrow'):
+        parser.error(f"--output {args.output} is not supported with --metric")
+    if args.output in ('parquet', 'arrow') and not args.output_file:
+        parser.error(f"--output {args.output} requires --output-file")
+    if args.resume:
+        args.checkpoint = True
+    if args.checkpoint:
+        if args.output != 'csv' or not args.csv_file:
+            parser.error("--checkpoint and --resume require --output csv with --csv-file")
+        if args.follow or args.metric or args.index or ',' in args.namespace:
+            parser.error("--checkpoint and --resume cannot be combined with --follow, --metric, --index or several namespaces")
+    for option in ('offline', 'level', 'count_by'):
+        if getattr(args, option) and not args.index:
+            parser.error(f"--{option.replace('_', '-')} requires --index")
+    if args.index and (args.follow or args.metric):
+        parser.error("--index cannot be combined with --follow or --metric")
+    if args.level:
+        args.level = [level.strip().upper() for level in args.level.split(',')]
+        if not set(args.level) <= set(LOG_LEVELS):
+            parser.error(f"--level must be one of {', '.join(LOG_LEVELS)}")
+    if args.correlate:
+        args.correlate = [correlate_id.strip() for correlate_id in args.correlate.split(',') if correlate_id.strip()]
+        if '-' in args.correlate and len(args.correlate) > 1:
+            parser.error("--correlate - reads the IDs from stdin and cannot be combined with other IDs")
+        if any('`' in correlate_id for correlate_id in args.correlate):
+            parser.error("--correlate IDs cannot contain backticks")
+        if args.follow or args.metric or args.index or args.checkpoint or args.output in ('parquet', 'arrow'):
+            parser.error("--correlate cannot be combined with --follow, --metric, --index, --checkpoint or --output parquet/arrow")
+    if args.cluster:
+        if args.follow or args.metric or args.correlate or args.count_by or args.checkpoint or args.output in ('parquet', 'arrow'):
+            parser.error("--cluster cannot be combined with --follow, --metric, --correlate, --count-by, --checkpoint or --output parquet/arrow")
+        if not 0 < args.cluster_similarity <= 1 or args.cluster_depth < 3 or args.cluster_max < 1:
+            parser.error("--cluster-similarity must be in (0, 1], --cluster-depth at least 3 and --cluster-max at least 1")
+    if args.count_by:
+        args.count_by = [column.strip() for column in args.count_by.split(',')]
+        if not set(args.count_by) <= set(INDEX_COUNT_COLUMNS):
+            parser.error(f"--count-by columns must be among {', '.join(INDEX_COUNT_COLUMNS)}")
+        if args.output in ('parquet', 'arrow'):
+            parser.error(f"--output {args.output} is not supported with --count-by")
+    return args
 
 def get_time_range(args):
     """Calculate the time range based on the input arguments."""
@@ -70,16 +314,22 @@ def get_time_range(args):
 def build_query(args):
     """Build the Loki query based on input arguments."""
     # Build base query
-    query = f'{{namespace="{args.namespace}", app="echo"}}'
+    if ',' in args.namespace:
+        namespace_list = [ns.strip() for ns in args.namespace.split(',')]
+        namespace_regex = '|'.join(namespace_list)
+        namespace_filter = f'namespace=~"({namespace_regex})"'
+    else:
+        namespace_filter = f'namespace="{args.namespace}"'
+    query = f'{{{namespace_filter}, app="echo"}}'
     
     # Add component filter if not getting all components
     if not args.all and args.component:
         if ',' in args.component:
             component_list = [comp.strip() for comp in args.component.split(',')]
             component_regex = '|'.join(component_list)
-            query = f'{{namespace="{args.namespace}", app="echo", component=~"({component_regex})"}}'
+            query = f'{{{namespace_filter}, app="echo", component=~"({component_regex})"}}'
         else:
-            query = f'{{namespace="{args.namespace}", app="echo", component="{args.component}"}}'
+            query = f'{{{namespace_filter}, app="echo", component="{args.component}"}}'
     
     # Add container filter if specified
     if args.container:
@@ -87,6 +337,10 @@ def build_query(args):
         # Need to remove the closing brace, add the filter, and close it again
         query = query[:-1] + f', container="{args.container}"}}'
     
+    # The --correlate ID filter goes first, it is by far the most selective
+    if getattr(args, 'correlate', None) and args.correlate != ['-']:
+        query = f'{query} {build_id_filter(args.correlate)}'
+    
     # Add text filtering if specified
     if args.text_contains or args.text_not_contains:
         query_with_filter = query
@@ -101,76 +355,726 @@ def build_query(args):
     
     return query
 
-def create_time_chunks(start_time, end_time, chunk_hours):
-    """Split a time range into chunks under 12 hours to comply with Loki's limit."""
+def build_stream_selector(args):
+    """Build the Loki query for the selected streams, without the text line filters."""
+    selector_args = copy.copy(args)
+    selector_args.text_contains = None
+    selector_args.text_not_contains = None
+    selector_args.correlate = None
+    return build_query(selector_args)
+
+def build_id_filter(ids):
+    """Build the LogQL line filter keeping lines that mention any of the IDs.
+
+    A single ID is a plain substring filter, the cheapest kind for Loki;
+    several are one regex alternation in a raw (backtick) string, so only
+    the regex needs escaping.
+    """
+    if len(ids) == 1:
+        escaped = ids[0].replace('\\', '\\\\').replace('"', '\\"')
+        return f'|= "{escaped}"'
+    return f"|~ `{'|'.join(re.escape(correlate_id) for correlate_id in ids)}`"
+
+def create_time_chunks(start_time, end_time, chunk_hours, align=False):
+    """Split a time range into chunks under 12 hours to comply with Loki's limit.
+
+    With align=True chunks are cut on a fixed chunk_hours grid instead of
+    starting at start_time, so repeated runs over overlapping ranges produce
+    the same chunk boundaries (which is what makes them cacheable).
+    """
     # Convert chunk hours to nanoseconds
     chunk_size = chunk_hours * 60 * 60 * 1e9
     
     chunks = []
     current_start = start_time
     
+    if align:
+        chunk_size = int(chunk_size)
+        current_start = int(start_time)
+        end_time = int(end_time)
+    
     while current_start < end_time:
-        current_end = min(current_start + chunk_size, end_time)
+        if align:
+            current_end = min((current_start // chunk_size + 1) * chunk_size, end_time)
+        else:
+            current_end = min(current_start + chunk_size, end_time)
         chunks.append((current_start, current_end))
         current_start = current_end
     
     return chunks
 
-def query_loki_logs_chunked(args):
-    """Query Loki logs in time chunks to handle the 12-hour limit."""
+def build_metric_query(query, function, range_seconds, by=None):
+    """Wrap a log query in a LogQL range aggregation, e.g. sum by (pod) (count_over_time({...} [300s]))."""
+    aggregation = f"sum by ({', '.join(by)})" if by else "sum"
+    return f"{aggregation} ({function}({query} [{range_seconds}s]))"
+
+def create_adaptive_time_chunks(args, query, start_time, end_time):
+    """Split a time range into windows that each hold roughly one page of logs.
+
+    Loki is first asked for the log volume per ADAPTIVE_PROBE_STEP_SECONDS
+    bucket with a cheap count_over_time query. Quiet buckets are then merged
+    into windows of up to --chunk-hours, and buckets holding more than a page
+    are split evenly, so sparse ranges need fewer round trips and dense ones
+    give --workers more to do in parallel. The probe itself is one query per
+    --chunk-hours window, and up to --workers of them run at a time. Falls
+    back to fixed chunks if the volume probe fails.
+    """
+    step_ns = ADAPTIVE_PROBE_STEP_SECONDS * 10**9
+    start_time, end_time = int(start_time), int(end_time)
+    metric_query = build_metric_query(query, "count_over_time", ADAPTIVE_PROBE_STEP_SECONDS)
+    
+    # A point at time t counts the entries in the bucket (t - step, t]. The probe
+    # is a range query too, so it has to be chunked for Loki's max query length.
+    probe_chunks = create_time_chunks(start_time, end_time + step_ns, args.chunk_hours, align=True)
+    # Size the shared connection pool before the probe threads start
+    get_session(args)
+    executor = ThreadPoolExecutor(max_workers=args.workers)
+    bucket_counts = {}
+    try:
+        futures = [executor.submit(query_loki_metric, args, metric_query, probe_start, probe_end, ADAPTIVE_PROBE_STEP_SECONDS)
+                   for probe_start, probe_end in probe_chunks]
+        # Results are merged in probe order, whichever finishes first
+        for future in futures:
+            try:
+                series = future.result()
+            except LokiQueryError as e:
+                print(f"Warning: Log volume probe failed ({e}), falling back to fixed --chunk-hours chunks", file=sys.stderr)
+                return create_time_chunks(start_time, end_time, args.chunk_hours)
+            probe_counts = {}
+            for metric in series:
+                for point_time, value in metric.get("values", []):
+                    point_ns = int(round(float(point_time))) * 10**9
+                    probe_counts[point_ns] = probe_counts.get(point_ns, 0) + int(float(value))
+            # Neighbouring probes share their boundary point, so overwrite rather than add
+            bucket_counts.update(probe_counts)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+    
+    # Aim a little under --limit, the probe is only an estimate
+    target = max(int(args.limit * 0.9), 1)
+    max_window = args.chunk_hours * 60 * 60 * 10**9
+    
+    chunks = []
+    window_start = start_time
+    window_count = 0
+    bucket_start = start_time
+    while bucket_start < end_time:
+        bucket_boundary = (bucket_start // step_ns + 1) * step_ns
+        bucket_end = min(bucket_boundary, end_time)
+        bucket_count = bucket_counts.get(bucket_boundary, 0)
+        
+        if bucket_count > target:
+            # Close the current window and split the dense bucket into even slices
+            if window_start < bucket_start:
+                chunks.append((window_start, bucket_start))
+            slices = min(-(-bucket_count // target), bucket_end - bucket_start)
+            bounds = [bucket_start + (bucket_end - bucket_start) * i // slices for i in range(slices + 1)]
+            chunks.extend(zip(bounds, bounds[1:]))
+            window_start = bucket_end
+            window_count = 0
+        elif window_count + bucket_count > target or bucket_end - window_start > max_window:
+            # This bucket doesn't fit, so it starts the next window
+            chunks.append((window_start, bucket_start))
+            window_start = bucket_start
+            window_count = bucket_count
+        else:
+            window_count += bucket_count
+        
+        bucket_start = bucket_end
+    
+    if window_start < end_time:
+        chunks.append((window_start, end_time))
+    
+    if args.debug:
+        print(f"DEBUG: Log volume probe estimated {sum(bucket_counts.values())} entries")
+    
+    return chunks
+
+class LokiQueryError(Exception):
+    """A Loki request that failed for good, after any retries."""
+
+class RequestScheduler:
+    """Paces the Loki requests of every worker and namespace thread.
+
+    At most max_concurrent requests are in flight and at most max_rps start
+    per second (a token bucket that allows bursts of one second's worth);
+    0 means no limit. When Loki reports it is overloaded (429 or 503), every
+    thread holds off until the backoff delay has passed, not just the one
+    whose request was rejected.
+    """
+
+    def __init__(self, max_rps=0, max_concurrent=0):
+        self.max_rps = max_rps
+        self.tokens = max(max_rps, 1)
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.retries = 0
+        self.lock = threading.Lock()
+        self.in_flight = threading.BoundedSemaphore(max_concurrent) if max_concurrent else None
+
+    def acquire(self):
+        """Block until another request may be sent."""
+        if self.in_flight:
+            self.in_flight.acquire()
+        with self.lock:
+            now = time.monotonic()
+            delay = self.paused_until - now
+            if self.max_rps:
+                # Take a token, going into debt (and waiting it off) if there is none
+                self.tokens = min(max(self.max_rps, 1), self.tokens + (now - self.updated) * self.max_rps) - 1
+                self.updated = now
+                delay = max(delay, -self.tokens / self.max_rps)
+        if delay > 0:
+            time.sleep(delay)
+
+    def release(self):
+        """Mark a request sent with acquire() as finished."""
+        if self.in_flight:
+            self.in_flight.release()
+
+    def backoff(self, attempt, retry_after=None, overloaded=False):
+        """Return the seconds to wait before retrying after the given failed attempt (0-based).
+
+        Full jitter: a random delay up to RETRY_BASE_SECONDS * 2**attempt,
+        capped at RETRY_MAX_SECONDS, but never less than a Retry-After delay.
+        If Loki is overloaded all requests are paused for that long.
+        """
+        delay = random.uniform(0, min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, RETRY_AFTER_MAX_SECONDS))
+        with self.lock:
+            self.retries += 1
+            if overloaded:
+                self.paused_until = max(self.paused_until, time.monotonic() + delay)
+        return delay
+
+class RunStats:
+    """Counters and timings of a run, reported with --stats.
+
+    Network time is measured per request and summed over all threads, so
+    with --workers > 1 it can exceed the wall time. Format time is the time
+    the output writer spends beyond waiting for its input (see iter_timed).
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.request_seconds = []
+        self.failed_requests = 0
+        self.bytes_received = 0
+        self.decode_seconds = 0
+        self.input_seconds = 0
+        self.format_seconds = 0
+        self.entries = 0
+        self.lock = threading.Lock()
+
+    def add_request(self, seconds, bytes_received, failed=False):
+        """Record one HTTP request to Loki."""
+        with self.lock:
+            self.request_seconds.append(seconds)
+            self.bytes_received += bytes_received
+            if failed:
+                self.failed_requests += 1
+
+    def add_decode(self, seconds):
+        """Record the time spent decoding one response."""
+        with self.lock:
+            self.decode_seconds += seconds
+
+    def iter_timed(self, items, count=None):
+        """Yield items, timing how long each took to produce and counting entries.
+
+        count(item) is the number of log entries in an item (default 1).
+        """
+        items = iter(items)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(items)
+            except StopIteration:
+                self.input_seconds += time.perf_counter() - started
+                return
+            self.input_seconds += time.perf_counter() - started
+            self.entries += count(item) if count else 1
+            yield item
+
+    def get_report(self):
+        """Return the report as a JSON-serialisable dict."""
+        wall_seconds = time.perf_counter() - self.started
+        latencies = sorted(self.request_seconds)
+        
+        def percentile(fraction):
+            """Nearest-rank percentile of the request latencies, in milliseconds."""
+            if not latencies:
+                return None
+            return round(latencies[max(math.ceil(fraction * len(latencies)) - 1, 0)] * 1000, 1)
+        
+        report = {
+            "wall_seconds": round(wall_seconds, 3),
+            "requests": {
+                "count": len(latencies),
+                "failed": self.failed_requests,
+                "retries": _scheduler.retries if _scheduler else 0,
+                "latency_ms": {"p50": percentile(0.5), "p95": percentile(0.95), "max": percentile(1)},
+                "bytes_received": self.bytes_received,
+            },
+            "entries": self.entries,
+            "entries_per_second": round(self.entries / wall_seconds, 1) if wall_seconds else None,
+            "time_seconds": {
+                "network": round(sum(latencies), 3),
+                "decode": round(self.decode_seconds, 3),
+                "format": round(self.format_seconds, 3),
+            },
+            "peak_rss_mb": None,
+        }
+        if resource is not None:
+            # ru_maxrss is in kilobytes on Linux, bytes on macOS
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            report["peak_rss_mb"] = round(max_rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+        if _cache:
+            report["cache"] = {"hits": _cache.hits, "misses": _cache.misses, "uncached": _cache.uncached}
+        return report
+
+def get_stats(args):
+    """Return the shared run stats, or None when --stats is not given."""
+    global _stats
+    if _stats is None and args.stats:
+        _stats = RunStats()
+    return _stats
+
+def get_scheduler(args):
+    """Return the shared request scheduler, creating it on first use."""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = RequestScheduler(args.max_rps, args.max_concurrent)
+    return _scheduler
+
+def parse_retry_after(value):
+    """Return the delay in seconds asked for by a Retry-After header, or None."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+        return max((retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds(), 0)
+    except (TypeError, ValueError):
+        return None
+
+def get_session(args):
+    """Return the shared HTTP session, creating it on first use."""
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        # One pooled connection per worker (per namespace and --correlate component) so concurrent chunks never wait on the pool
+        pool_size = args.workers * len(args.namespace.split(','))
+        if args.correlate:
+            pool_size *= len(args.correlate_components.split(','))
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        _session.mount("http://", adapter)
+        _session.mount("https://", adapter)
+        _session.headers.update({"Accept": "application/json"})
+        if args.username and args.password:
+            _session.auth = HTTPBasicAuth(args.username, args.password)
+    return _session
+
+class ChunkCache:
+    """On-disk LRU cache of fully fetched time chunks.
+
+    Entries are keyed by the Loki endpoint (--url and --username, so two
+    servers behind the same local port-forward never share entries), the
+    query, the chunk boundaries and the settings that change what a chunk
+    fetch returns (--limit, --paginate). Each entry is a
+    gzipped JSON list of pages; its mtime is bumped on every hit, and the
+    least recently used entries are evicted once the cache grows past max_bytes.
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.uncached = 0
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def is_closed(self, chunk_end):
+        """Return True if a chunk ending at chunk_end can no longer change."""
+        return chunk_end <= (time.time() - CACHE_SETTLE_SECONDS) * 1e9
+
+    def path_for(self, args, query, chunk_start, chunk_end):
+        """Return the cache file path for a chunk."""
+        key = json.dumps([args.url.rstrip('/'), args.username, query, int(chunk_start), int(chunk_end), args.limit, args.paginate])
+        return os.path.join(self.cache_dir, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".json.gz")
+
+    def get(self, path):
+        """Return the cached pages at path, or None on a miss."""
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                pages = json.load(f)
+            # Mark as recently used for LRU eviction
+            os.utime(path)
+        except FileNotFoundError:
+            pages = None
+        except (OSError, ValueError) as e:
+            print(f"Warning: Ignoring unreadable cache entry {path}: {e}", file=sys.stderr)
+            pages = None
+        with self.lock:
+            if pages is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return pages
+
+    def put(self, path, pages):
+        """Store pages at path, then evict old entries if over the size cap."""
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+                json.dump(pages, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Warning: Could not write cache entry {path}: {e}", file=sys.stderr)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        with self.lock:
+            self.evict()
+
+    def add_uncached(self):
+        """Count a chunk fetched past the cache; called from --workers threads."""
+        with self.lock:
+            self.uncached += 1
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits max_bytes."""
+        entries = []
+        total_bytes = 0
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".json.gz"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total_bytes += stat.st_size
+        entries.sort()
+        while entries and total_bytes > self.max_bytes:
+            _, size, path = entries.pop(0)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+
+def get_cache(args):
+    """Return the shared chunk cache, or None when caching is disabled."""
+    global _cache
+    if _cache is None and args.cache:
+        _cache = ChunkCache(os.path.expanduser(args.cache_dir), args.cache_size_mb * 1024 * 1024)
+    return _cache
+
+def regexp_search(pattern, value):
+    """SQLite REGEXP function: whether the regular expression pattern matches anywhere in value."""
+    return re.search(pattern, value) is not None
+
+class LogIndex:
+    """Local SQLite store of fetched log lines, queried instead of Loki with --index.
+
+    Everything is stored per selector, the label matchers of a query without
+    its line filters, so one fetch serves every --text-contains,
+    --text-not-contains and --level variation over the same streams. The
+    coverage table records which time ranges of a selector were fetched
+    completely; only the rest is ever fetched from Loki.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.create_function("regexp", 2, regexp_search, deterministic=True)
+        self.conn.executescript(LOG_INDEX_SCHEMA)
+        self.stream_ids = {}
+
+    def get_missing_ranges(self, selector, start_time, end_time):
+        """Return the (start, end) ranges within start_time-end_time not covered for selector."""
+        rows = self.conn.execute(
+            "SELECT start_ts, end_ts FROM coverage WHERE selector = ? AND end_ts > ? AND start_ts < ? ORDER BY start_ts",
+            (selector, start_time, end_time))
+        missing = []
+        current_start = start_time
+        for covered_start, covered_end in rows:
+            if covered_start > current_start:
+                missing.append((current_start, covered_start))
+            current_start = max(current_start, covered_end)
+        if current_start < end_time:
+            missing.append((current_start, end_time))
+        return missing
+
+    def add_coverage(self, selector, start_time, end_time):
+        """Record start_time-end_time as fully fetched, merging it with touching ranges."""
+        with self.conn:
+            rows = self.conn.execute(
+                "SELECT rowid, start_ts, end_ts FROM coverage WHERE selector = ? AND end_ts >= ? AND start_ts <= ?",
+                (selector, start_time, end_time)).fetchall()
+            for rowid, covered_start, covered_end in rows:
+                start_time = min(start_time, covered_start)
+                end_time = max(end_time, covered_end)
+                self.conn.execute("DELETE FROM coverage WHERE rowid = ?", (rowid,))
+            self.conn.execute("INSERT INTO coverage (selector, start_ts, end_ts) VALUES (?, ?, ?)",
+                              (selector, start_time, end_time))
+
+    def get_stream_id(self, selector, labels):
+        """Return the id of a stream of selector, adding it if it is new."""
+        key = json.dumps(labels, sort_keys=True)
+        stream_id = self.stream_ids.get((selector, key))
+        if stream_id is None:
+            component, pod, container = get_stream_fields(labels)
+            self.conn.execute(
+                "INSERT OR IGNORE INTO streams (selector, labels, namespace, component, pod, container) VALUES (?, ?, ?, ?, ?, ?)",
+                (selector, key, labels.get("namespace", "unknown"), component, pod, container))
+            stream_id = self.conn.execute("SELECT id FROM streams WHERE selector = ? AND labels = ?", (selector, key)).fetchone()[0]
+            self.stream_ids[(selector, key)] = stream_id
+        return stream_id
+
+    def store_chunk(self, selector, chunk_start, chunk_end, pages):
+        """Replace whatever is stored for selector in a time chunk with its fetched pages.
+
+        Returns the number of entries stored.
+        """
+        stored = 0
+        with self.conn:
+            # A range is only fetched while it is not covered, so anything stored
+            # there is from a run that failed or ended too recently to be final
+            self.conn.execute(
+                "DELETE FROM entries WHERE ts >= ? AND ts < ? AND stream_id IN (SELECT id FROM streams WHERE selector = ?)",
+                (chunk_start, chunk_end, selector))
+            last_id = self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM entries").fetchone()[0]
+            for streams in pages:
+                for stream in streams:
+                    values = stream.get("values", [])
+                    if not values:
+                        continue
+                    stream_id = self.get_stream_id(selector, stream.get("stream", {}))
+                    cursor = self.conn.executemany(
+                        "INSERT INTO entries (stream_id, ts, level, line) VALUES (?, ?, ?, ?)",
+                        ((stream_id, int(timestamp), parse_log_level(log_entry), log_entry) for timestamp, log_entry in values))
+                    stored += cursor.rowcount
+            self.conn.execute("INSERT INTO entries_fts (rowid, line) SELECT id, line FROM entries WHERE id > ?", (last_id,))
+        return stored
+
+    def get_filter(self, args, selector, start_time, end_time):
+        """Return the SQL WHERE clause and parameters selecting the entries a query asks for."""
+        conditions = ["streams.selector = ?", "entries.ts >= ?", "entries.ts < ?"]
+        params = [selector, start_time, end_time]
+        if args.text_contains:
+            if len(args.text_contains) >= 3 and not REGEX_METACHARACTERS & set(args.text_contains):
+                # Plain text: narrow down with the trigram index first (it matches
+                # case-insensitively, the REGEXP below makes it exact)
+                conditions.append("entries.id IN (SELECT rowid FROM entries_fts WHERE entries_fts MATCH ?)")
+                params.append('"' + args.text_contains.replace('"', '""') + '"')
+            conditions.append("entries.line REGEXP ?")
+            params.append(args.text_contains)
+        if args.text_not_contains:
+            conditions.append("NOT entries.line REGEXP ?")
+            params.append(args.text_not_contains)
+        if args.level:
+            conditions.append(f"entries.level IN ({', '.join('?' * len(args.level))})")
+            params.extend(args.level)
+        return " AND ".join(conditions), params
+
+    def iter_entries(self, args, selector, start_time, end_time):
+        """Yield (timestamp, log_entry, labels) for the matching entries, in chronological order."""
+        labels_by_id = {
+            stream_id: json.loads(labels)
+            for stream_id, labels in self.conn.execute("SELECT id, labels FROM streams WHERE selector = ?", (selector,))
+        }
+        where, params = self.get_filter(args, selector, start_time, end_time)
+        sql = (f"SELECT entries.ts, entries.line, entries.stream_id FROM entries JOIN streams ON streams.id = entries.stream_id "
+               f"WHERE {where} ORDER BY entries.ts, entries.id")
+        if args.max_entries:
+            sql += f" LIMIT {int(args.max_entries)}"
+        for timestamp, log_entry, stream_id in self.conn.execute(sql, params):
+            yield str(timestamp), log_entry, labels_by_id[stream_id]
+
+    def count_entries_by(self, args, selector, start_time, end_time, columns):
+        """Return (group values..., count) rows for the matching entries, largest groups first."""
+        where, params = self.get_filter(args, selector, start_time, end_time)
+        group = ", ".join(INDEX_COUNT_COLUMNS[column] for column in columns)
+        sql = (f"SELECT {group}, COUNT(*) FROM entries JOIN streams ON streams.id = entries.stream_id "
+               f"WHERE {where} GROUP BY {group} ORDER BY COUNT(*) DESC, {group}")
+        return self.conn.execute(sql, params).fetchall()
+
+def open_log_index(args):
+    """Open the --index store, exiting with an error if it cannot be used."""
+    try:
+        return LogIndex(args.index)
+    except sqlite3.Error as e:
+        print(f"Error opening log index {args.index}: {e}", file=sys.stderr)
+        sys.exit(1)
+
+def get_streams(result):
+    """Return the list of streams in a Loki response, or an empty list."""
+    if not result or "data" not in result or "result" not in result["data"]:
+        return []
+    return result["data"]["result"]
+
+def count_entries(streams):
+    """Count the log entries across a list of streams."""
+    return sum(len(stream.get("values", [])) for stream in streams)
+
+def truncate_page(streams, max_count):
+    """Cut a page down to its max_count oldest entries, keeping its streams layout.
+
+    Ties on the timestamp keep the earlier stream first, like iter_page_entries.
+    """
+    if count_entries(streams) <= max_count:
+        return streams
+    oldest = itertools.islice(heapq.merge(*(
+        zip((int(timestamp) for timestamp, _ in stream.get("values", [])), itertools.repeat(index))
+        for index, stream in enumerate(streams)
+    )), max_count)
+    kept = [0] * len(streams)
+    for _, index in oldest:
+        kept[index] += 1
+    return [dict(stream, values=stream["values"][:kept[index]]) for index, stream in enumerate(streams) if kept[index]]
+
+def iter_chunk_pages(args, query, chunk_start, chunk_end, cursor=None):
+    """Yield the streams of each page for a single time chunk, using the cache if enabled.
+
+    A cursor is passed on to iter_loki_pages with --paginate. Since it tracks
+    progress page by page, a chunk fetched with a cursor skips the cache.
+    """
+    cache = get_cache(args)
+    if not cache or not cache.is_closed(chunk_end) or cursor is not None:
+        if cache:
+            cache.add_uncached()
+        yield from iter_loki_chunk_pages(args, query, chunk_start, chunk_end, cursor)
+        return
+    
+    cache_path = cache.path_for(args, query, chunk_start, chunk_end)
+    pages = cache.get(cache_path)
+    if pages is None:
+        # A failed request raises LokiQueryError, so only complete chunks get cached
+        pages = list(iter_loki_chunk_pages(args, query, chunk_start, chunk_end))
+        cache.put(cache_path, pages)
+    yield from pages
+
+def iter_loki_chunk_pages(args, query, chunk_start, chunk_end, cursor=None):
+    """Yield the streams of each page fetched from Loki for a single time chunk."""
+    if args.paginate:
+        # Use pagination within each time chunk
+        yield from iter_loki_pages(args, query, chunk_start, chunk_end, cursor)
+        return
+    # Single query for this time chunk
+    streams = get_streams(query_loki_batch(args, query, chunk_start, chunk_end, args.limit))
+    if streams:
+        yield streams
+
+def fetch_time_chunk(args, query, chunk_start, chunk_end):
+    """Fetch every page of a single time chunk."""
+    return list(iter_chunk_pages(args, query, chunk_start, chunk_end))
+
+def iter_time_chunk_pages(args, query, time_chunks):
+    """Yield (chunk_index, pages) for each time chunk in chronological order.
+
+    Sequentially, pages is a lazy generator so each page can be written out
+    as soon as it arrives. With --workers > 1 up to that many chunks are
+    fetched concurrently and pages is the list of a whole chunk. Only
+    --workers chunks are ever in flight, so stopping early (e.g. on
+    --max-entries) wastes at most that many chunk fetches.
+    """
+    if args.workers == 1:
+        for chunk_index, (chunk_start, chunk_end) in enumerate(time_chunks):
+            yield chunk_index, iter_chunk_pages(args, query, chunk_start, chunk_end)
+        return
+
+    executor = ThreadPoolExecutor(max_workers=args.workers)
+    pending = deque()
+    next_index = 0
+    try:
+        while pending or next_index < len(time_chunks):
+            # Top up the in-flight window, keeping submission order
+            while next_index < len(time_chunks) and len(pending) < args.workers:
+                chunk_start, chunk_end = time_chunks[next_index]
+                pending.append((next_index, executor.submit(fetch_time_chunk, args, query, chunk_start, chunk_end)))
+                next_index += 1
+
+            # Results are handed out in chunk order, whichever finishes first
+            chunk_index, future = pending.popleft()
+            yield chunk_index, future.result()
+    finally:
+        for _, future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+def iter_log_pages(args):
+    """Yield the streams of every fetched page across the whole time range.
+
+    Pages come out in chronological order and are never accumulated, so
+    memory stays flat however long the range is.
+    """
     start_time, end_time = get_time_range(args)
     query = build_query(args)
     
     # Calculate time chunks (each under 12 hours)
-    time_chunks = create_time_chunks(start_time, end_time, args.chunk_hours)
+    if args.adaptive_chunks:
+        time_chunks = create_adaptive_time_chunks(args, query, start_time, end_time)
+    else:
+        time_chunks = create_time_chunks(start_time, end_time, args.chunk_hours, align=args.cache)
     
     if args.debug:
         print(f"DEBUG: Full time range - from {datetime.datetime.fromtimestamp(start_time / 1e9)} to {datetime.datetime.fromtimestamp(end_time / 1e9)}")
         print(f"DEBUG: Using query: {query}")
         print(f"DEBUG: Split into {len(time_chunks)} time chunks")
+        if args.workers > 1:
+            print(f"DEBUG: Fetching up to {args.workers} chunks concurrently")
     
-    # Store all results
-    all_results = []
     total_entries = 0
     
     # Process each time chunk
-    for chunk_index, (chunk_start, chunk_end) in enumerate(time_chunks):
+    for chunk_index, chunk_pages in iter_time_chunk_pages(args, query, time_chunks):
         if args.debug:
+            chunk_start, chunk_end = time_chunks[chunk_index]
             chunk_start_dt = datetime.datetime.fromtimestamp(chunk_start / 1e9)
             chunk_end_dt = datetime.datetime.fromtimestamp(chunk_end / 1e9)
             print(f"DEBUG: Processing chunk {chunk_index+1}/{len(time_chunks)}: {chunk_start_dt} to {chunk_end_dt}")
         
-        # Process this time chunk
-        if args.paginate:
-            # Use pagination within each time chunk
-            chunk_results = query_loki_logs_paginated(args, query, chunk_start, chunk_end)
-        else:
-            # Single query for this time chunk
-            chunk_results = query_loki_batch(args, query, chunk_start, chunk_end, args.limit)
-        
-        if not chunk_results or "data" not in chunk_results or "result" not in chunk_results["data"]:
-            if args.debug:
-                print(f"DEBUG: No results for chunk {chunk_index+1}")
-            continue
-        
-        # Add results from this chunk
-        chunk_streams = chunk_results["data"]["result"]
-        all_results.extend(chunk_streams)
+        this_chunk_count = 0
+        for streams in chunk_pages:
+            if args.max_entries:
+                # Stop at exactly --max-entries, like the merged multi-namespace timeline
+                streams = truncate_page(streams, args.max_entries - total_entries - this_chunk_count)
+            this_chunk_count += count_entries(streams)
+            yield streams
+            
+            # Check if we've hit the max entries limit
+            if args.max_entries and total_entries + this_chunk_count >= args.max_entries:
+                break
         
-        # Update counter
-        this_chunk_count = sum(len(stream.get("values", [])) for stream in chunk_streams)
         total_entries += this_chunk_count
         
         if args.debug:
-            print(f"DEBUG: Got {this_chunk_count} log entries from chunk {chunk_index+1}")
-            print(f"DEBUG: Total entries so far: {total_entries}")
+            if this_chunk_count:
+                print(f"DEBUG: Got {this_chunk_count} log entries from chunk {chunk_index+1}")
+                print(f"DEBUG: Total entries so far: {total_entries}")
+            else:
+                print(f"DEBUG: No results for chunk {chunk_index+1}")
         
-        # Check if we've hit the max entries limit
         if args.max_entries and total_entries >= args.max_entries:
             if args.debug:
                 print(f"DEBUG: Reached maximum entries limit of {args.max_entries}")
             break
     
+    cache = get_cache(args)
+    if args.debug and cache:
+        print(f"DEBUG: Cache: {cache.hits} hits, {cache.misses} misses, {cache.uncached} open chunks fetched uncached")
+
+def query_loki_logs_chunked(args):
+    """Query Loki logs in time chunks to handle the 12-hour limit."""
+    all_results = []
+    for streams in iter_log_pages(args):
+        all_results.extend(streams)
+    
     # Construct a result that matches the structure expected by our existing processing code
     result = {
         "status": "success",
@@ -180,59 +1084,119 @@ def query_loki_logs_chunked(args):
         }
     }
     
-    return result, total_entries
+    return result, count_entries(all_results)
 
-def query_loki_logs_paginated(args, query, start_time, end_time):
-    """Query Loki logs with pagination within a single time chunk."""
-    # Store all results
-    all_results = []
-    
-    # For paginated requests, we need to keep track of the last timestamp
-    current_start = start_time
+def iter_loki_pages(args, query, start_time, end_time, cursor=None):
+    """Yield the streams of each page while paginating through a single time chunk.
+
+    Several entries can share a nanosecond, and a full page may cut that
+    timestamp off halfway, so each page restarts *at* the newest timestamp of
+    the previous one rather than just after it. Entries at that boundary which
+    were already returned are dropped via a small seen-set, so nothing is
+    skipped or duplicated.
+
+    If a cursor dict is given, paging resumes from it, and whenever a page is
+    yielded it holds the JSON-serialisable position right after that page
+    (see get_page_cursor), so a checkpointed export can pick up mid-chunk.
+    """
+    # For paginated requests, we need to keep track of the last timestamp.
+    # Unaligned chunk boundaries are floats, which cannot represent every
+    # nanosecond, so work in integers to keep the boundary comparison exact.
+    current_start = int(start_time)
+    end_time = int(end_time)
+    # (stream labels, line) pairs already returned at timestamp current_start
+    boundary_seen = set()
+    if cursor:
+        current_start = cursor["start"]
+        boundary_seen = {(tuple(map(tuple, stream_key)), log_entry) for stream_key, log_entry in cursor["seen"]}
     
     while current_start < end_time:
         if args.debug:
             print(f"DEBUG: Fetching page from {datetime.datetime.fromtimestamp(current_start / 1e9)}")
         
         # Get a batch of logs
-        batch_result = query_loki_batch(args, query, current_start, end_time, args.limit)
+        batch_streams = get_streams(query_loki_batch(args, query, current_start, end_time, args.limit))
         
-        if not batch_result or "data" not in batch_result or "result" not in batch_result["data"] or not batch_result["data"]["result"]:
+        if not batch_streams:
             if args.debug:
                 print("DEBUG: No more logs found in this time range")
             break
         
-        # Add this batch to our results
-        batch_streams = batch_result["data"]["result"]
-        
-        # Find the newest timestamp to use for the next query
+        # One pass over the page: drop repeats of the previous boundary and find
+        # the newest timestamp. Values are sorted oldest first, so repeats can
+        # only sit at the head of a stream and the newest entry at its tail.
+        page_streams = []
         newest_ts = current_start
+        page_count = 0
+        new_count = 0
         for stream in batch_streams:
             values = stream.get("values", [])
-            if values:
-                # Get timestamps from all values (first element of each value pair)
-                timestamps = [int(ts) for ts, _ in values]
-                if timestamps:
-                    stream_newest = max(timestamps)
-                    # Keep track of the overall newest
-                    newest_ts = max(newest_ts, stream_newest)
-        
-        # Add the streams to our results
-        all_results.extend(batch_streams)
-        
-        # Update the count
-        this_batch_count = sum(len(stream.get("values", [])) for stream in batch_streams)
+            if not values:
+                continue
+            page_count += len(values)
+            newest_ts = max(newest_ts, int(values[-1][0]))
+            
+            if boundary_seen:
+                stream_key = tuple(sorted(stream.get("stream", {}).items()))
+                skip = 0
+                while skip < len(values) and int(values[skip][0]) == current_start and (stream_key, values[skip][1]) in boundary_seen:
+                    skip += 1
+                if skip:
+                    values = values[skip:]
+                    if not values:
+                        continue
+                    stream = dict(stream, values=values)
+            
+            new_count += len(values)
+            page_streams.append(stream)
         
         if args.debug:
-            print(f"DEBUG: Got {this_batch_count} log entries in this page")
+            print(f"DEBUG: Got {new_count} log entries in this page ({page_count - new_count} repeated from the previous page)")
+        
+        # A page with fewer entries than --limit holds everything left in the range.
+        # This counts the raw page, repeats included, since those took up room in it.
+        last_page = page_count < args.limit
+        
+        if not last_page:
+            if new_count == 0:
+                # The whole page is entries sharing one nanosecond that were already
+                # returned, so restarting at it again would never make progress
+                print(f"Warning: More than {args.limit} log entries share timestamp {newest_ts}; "
+                      f"skipping the rest of them (raise --limit to get them all)", file=sys.stderr)
+                current_start = newest_ts + 1
+                boundary_seen = set()
+            else:
+                # Remember what was returned at the newest timestamp, so the next page can
+                # restart there without repeating it
+                if newest_ts != current_start:
+                    boundary_seen = set()
+                for stream in batch_streams:
+                    values = stream.get("values", [])
+                    stream_key = tuple(sorted(stream.get("stream", {}).items()))
+                    for timestamp, log_entry in reversed(values):
+                        if int(timestamp) != newest_ts:
+                            break
+                        boundary_seen.add((stream_key, log_entry))
+                current_start = newest_ts
+        
+        if cursor is not None:
+            cursor.update(get_page_cursor(current_start, boundary_seen))
         
-        # Set the next start time slightly after the newest timestamp
-        # Add 1 nanosecond to avoid getting the same log again
-        current_start = newest_ts + 1
+        if page_streams:
+            yield page_streams
         
-        # If we didn't get a full batch, we're probably at the end
-        if this_batch_count < args.limit:
+        if last_page:
             break
+
+def get_page_cursor(current_start, boundary_seen):
+    """Return the iter_loki_pages position as a JSON-serialisable dict."""
+    return {"start": current_start, "seen": [[list(map(list, stream_key)), log_entry] for stream_key, log_entry in boundary_seen]}
+
+def query_loki_logs_paginated(args, query, start_time, end_time):
+    """Query Loki logs with pagination within a single time chunk."""
+    all_results = []
+    for batch_streams in iter_loki_pages(args, query, start_time, end_time):
+        all_results.extend(batch_streams)
     
     # Construct a result that matches the structure expected by our existing processing code
     result = {
@@ -247,9 +1211,6 @@ def query_loki_logs_paginated(args, query, start_time, end_time):
 
 def query_loki_batch(args, query, start_time, end_time, limit):
     """Query a single batch of logs from Loki."""
-    # Prepare API endpoint
-    query_endpoint = f"{args.url}/loki/api/v1/query_range"
-    
     # Prepare query parameters
     params = {
         "query": query,
@@ -259,37 +1220,185 @@ def query_loki_batch(args, query, start_time, end_time, limit):
         "direction": "forward"  # Oldest first for consistent pagination
     }
     
+    return query_loki_range(args, params)
+
+def query_loki_metric(args, metric_query, start_time, end_time, step_seconds):
+    """Run a LogQL metric query and return its matrix of series."""
+    params = {
+        "query": metric_query,
+        "start": str(int(start_time)),
+        "end": str(int(end_time)),
+        "step": f"{step_seconds}s"
+    }
+    
+    return get_streams(query_loki_range(args, params))
+
+def decode_json(body):
+    """Decode a JSON response body, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+def query_loki_range(args, params):
+    """Send a request to Loki's query_range endpoint and return the decoded response.
+
+    Timeouts, connection errors, 429 and 5xx responses are retried up to
+    --retries times with backoff (see RequestScheduler.backoff), honouring
+    Retry-After. Raises LokiQueryError once the retries are used up or on any
+    other error, so a failed chunk is never mistaken for an empty one.
+    """
+    # Prepare API endpoint
+    query_endpoint = f"{args.url}/loki/api/v1/query_range"
+    scheduler = get_scheduler(args)
+    stats = get_stats(args)
+    
     if args.debug:
         print(f"DEBUG: Query parameters: {params}")
     
-    # Set up authentication if provided
-    auth = None
+    for attempt in range(args.retries + 1):
+        retry_after = None
+        status_code = None
+        scheduler.acquire()
+        started = time.perf_counter()
+        try:
+            # Make the request to Loki API over the pooled session
+            response = get_session(args).get(query_endpoint, params=params, timeout=(CONNECT_TIMEOUT_SECONDS, args.timeout))
+            if stats:
+                stats.add_request(time.perf_counter() - started, response.raw.tell(), failed=not response.ok)
+            
+            if args.debug:
+                # raw.tell() counts the bytes read off the wire, i.e. before decompression
+                print(f"DEBUG: Response status code: {response.status_code} "
+                      f"({response.raw.tell()} bytes, content-encoding: {response.headers.get('Content-Encoding', 'none')})")
+            
+            if response.status_code in RETRY_STATUS_CODES:
+                status_code = response.status_code
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                error = f"{response.status_code} {response.reason}: {response.text.strip()[:200]}"
+            else:
+                # Check for successful response
+                response.raise_for_status()
+                
+                # Return the JSON result
+                if not stats:
+                    return decode_json(response.content)
+                decode_started = time.perf_counter()
+                result = decode_json(response.content)
+                stats.add_decode(time.perf_counter() - decode_started)
+                return result
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                requests.exceptions.ChunkedEncodingError, requests.exceptions.ContentDecodingError) as e:
+            if stats:
+                stats.add_request(time.perf_counter() - started, 0, failed=True)
+            error = str(e)
+        except requests.exceptions.HTTPError as e:
+            raise LokiQueryError(f"{e}: {e.response.text.strip()}") from e
+        except (requests.exceptions.RequestException, ValueError) as e:
+            raise LokiQueryError(str(e)) from e
+        finally:
+            scheduler.release()
+        
+        if attempt < args.retries:
+            delay = scheduler.backoff(attempt, retry_after, overloaded=status_code in (429, 503))
+            print(f"Warning: Loki request failed ({error}), retrying in {delay:.1f}s "
+                  f"(attempt {attempt + 2}/{args.retries + 1})", file=sys.stderr)
+            time.sleep(delay)
+    
+    raise LokiQueryError(f"{error} (gave up after {args.retries + 1} attempts)")
+
+def iter_tail_pages(args):
+    """Yield the streams of each message from Loki's websocket tail endpoint.
+
+    Runs until interrupted. Streams are not in step: one may still have lines
+    to deliver that are older than the newest line of another. A dropped
+    connection is therefore reopened FOLLOW_RESUME_OVERLAP_SECONDS before the
+    newest timestamp seen so far. Loki resends entries from that point on, so
+    per stream the newest timestamp and the lines already seen at it are
+    remembered, and anything at or before that is dropped. That way lines are
+    neither lost nor duplicated across reconnects.
+    """
+    try:
+        import websocket
+    except ImportError:
+        print("Error: --follow requires websocket-client (pip install websocket-client)", file=sys.stderr)
+        sys.exit(1)
+    
+    tail_url = args.url.replace("https://", "wss://", 1).replace("http://", "ws://", 1) + "/loki/api/v1/tail"
+    headers = []
     if args.username and args.password:
-        auth = HTTPBasicAuth(args.username, args.password)
+        credentials = base64.b64encode(f"{args.username}:{args.password}".encode("utf-8")).decode("ascii")
+        headers.append(f"Authorization: Basic {credentials}")
+    
+    query = build_query(args)
+    tail_start = int(time.time() * 1e9)
+    newest_ts = tail_start
+    # stream labels -> (newest timestamp, lines already seen at that timestamp)
+    stream_positions = {}
+    reconnect_delay = FOLLOW_RECONNECT_MIN_SECONDS
+    
+    if args.debug:
+        print(f"DEBUG: Following query: {query}")
     
     try:
-        # Make the request to Loki API
-        response = requests.get(
-            query_endpoint,
-            params=params,
-            auth=auth,
-            headers={"Accept": "application/json"}
-        )
-        
-        if args.debug:
-            print(f"DEBUG: Response status code: {response.status_code}")
-        
-        # Check for successful response
-        response.raise_for_status()
-        
-        # Return the JSON result
-        return response.json()
-        
-    except requests.exceptions.RequestException as e:
-        print(f"Error querying Loki: {e}", file=sys.stderr)
-        if hasattr(e, 'response') and e.response is not None:
-            print(f"Response: {e.response.text}", file=sys.stderr)
-        return None
+        while True:
+            resume_ts = max(newest_ts - int(FOLLOW_RESUME_OVERLAP_SECONDS * 1e9), tail_start)
+            params = {"query": query, "limit": str(args.limit), "start": str(resume_ts)}
+            try:
+                ws = websocket.create_connection(f"{tail_url}?{urlencode(params)}", header=headers, timeout=60)
+            except (websocket.WebSocketException, OSError) as e:
+                print(f"Error connecting to Loki tail: {e} (retrying in {reconnect_delay}s)", file=sys.stderr)
+                time.sleep(reconnect_delay)
+                reconnect_delay = min(reconnect_delay * 2, FOLLOW_RECONNECT_MAX_SECONDS)
+                continue
+            
+            if args.debug:
+                print(f"DEBUG: Tailing from {datetime.datetime.fromtimestamp(resume_ts / 1e9)}")
+            
+            try:
+                while True:
+                    try:
+                        raw_message = ws.recv()
+                    except websocket.WebSocketTimeoutException:
+                        # Quiet period, keep waiting
+                        continue
+                    if not raw_message:
+                        raise websocket.WebSocketConnectionClosedException("connection closed by Loki")
+                    message = decode_json(raw_message)
+                    reconnect_delay = FOLLOW_RECONNECT_MIN_SECONDS
+                    
+                    dropped = message.get("dropped_entries") or []
+                    if dropped:
+                        print(f"Warning: Loki dropped {len(dropped)} tailed entries (the tail could not keep up)", file=sys.stderr)
+                    
+                    page_streams = []
+                    for stream in message.get("streams") or []:
+                        stream_key = tuple(sorted(stream.get("stream", {}).items()))
+                        stream_ts, seen_lines = stream_positions.get(stream_key, (0, set()))
+                        new_values = []
+                        for timestamp, log_entry in stream.get("values", []):
+                            ts = int(timestamp)
+                            if ts < stream_ts or (ts == stream_ts and log_entry in seen_lines):
+                                continue
+                            if ts > stream_ts:
+                                stream_ts, seen_lines = ts, set()
+                            seen_lines.add(log_entry)
+                            new_values.append([timestamp, log_entry])
+                        stream_positions[stream_key] = (stream_ts, seen_lines)
+                        newest_ts = max(newest_ts, stream_ts)
+                        if new_values:
+                            page_streams.append(dict(stream, values=new_values))
+                    
+                    if page_streams:
+                        yield page_streams
+            except (websocket.WebSocketException, OSError, ValueError) as e:
+                print(f"Loki tail disconnected: {e} (reconnecting in {reconnect_delay}s)", file=sys.stderr)
+            finally:
+                ws.close()
+            
+            time.sleep(reconnect_delay)
+            reconnect_delay = min(reconnect_delay * 2, FOLLOW_RECONNECT_MAX_SECONDS)
+    except KeyboardInterrupt:
+        return
 
 def sanitize_filepath(filepath):
     """Sanitize and validate a file path."""
@@ -320,8 +1429,87 @@ def sanitize_filepath(filepath):
         return None
 
 def query_loki_logs(args):
-    # Use time-chunked querying approach (handles any time range safely)
-    result, total_entries = query_loki_logs_chunked(args)
+    # Validate CSV file path if output is CSV
+    if args.output == 'csv' and args.csv_file:
+        sanitized_path = sanitize_filepath(args.csv_file)
+        if sanitized_path:
+            args.csv_file = sanitized_path
+            if args.debug:
+                print(f"DEBUG: Will attempt to write CSV to {args.csv_file}")
+        else:
+            print("Warning: Invalid CSV file path. Will output to stdout instead.", file=sys.stderr)
+            args.csv_file = None
+    
+    if args.metric:
+        return query_loki_metrics(args)
+    
+    if args.correlate:
+        return query_correlation(args)
+    
+    if args.cluster:
+        return query_clusters(args)
+    
+    if args.count_by:
+        return query_log_index_counts(args)
+    
+    if args.checkpoint:
+        return export_csv_checkpointed(args)
+    
+    # Several namespaces are queried separately and merged into one timeline.
+    # A live tail simply follows them all with one namespace=~ selector, and
+    # the log index stores them under one selector too.
+    include_namespace = ',' in args.namespace and not args.follow
+    multi_namespace = include_namespace and not args.index
+    
+    if args.output != 'json':
+        # Every other format is written page by page as the logs arrive
+        if args.follow:
+            # Show each tailed line as soon as it is written, even when piped
+            sys.stdout.reconfigure(line_buffering=True)
+            pages = iter_tail_pages(args)
+        elif not multi_namespace and not args.index:
+            pages = iter_log_pages(args)
+        
+        if args.index:
+            entries = iter_index_entries(args)
+        elif multi_namespace:
+            entries = iter_namespace_entries(args)
+        else:
+            entries = iter_entries(pages)
+        
+        stats = get_stats(args)
+        if stats:
+            # Time the writer separately from the fetching it waits on
+            if args.output == 'raw' and not (multi_namespace or args.index):
+                pages = stats.iter_timed(pages, count=count_entries)
+            else:
+                entries = stats.iter_timed(entries)
+            started = time.perf_counter()
+        
+        exit_code = 0
+        if args.output == 'csv':
+            output_as_csv(entries, args.csv_file, include_namespace=include_namespace)
+        elif args.output == 'ndjson':
+            output_as_ndjson(entries)
+        elif args.output in ('parquet', 'arrow'):
+            exit_code = output_as_columnar(entries, sanitize_filepath(args.output_file), args.output, args.row_group_size,
+                                           include_namespace=include_namespace)
+        elif multi_namespace or args.index:
+            output_as_timeline(entries)
+        else:
+            output_as_raw(pages)
+        
+        if stats:
+            stats.format_seconds = time.perf_counter() - started - stats.input_seconds
+        return exit_code
+    
+    if args.index:
+        result, total_entries = query_log_index(args)
+    elif multi_namespace:
+        result, total_entries = query_loki_logs_namespaces(args)
+    else:
+        # Use time-chunked querying approach (handles any time range safely)
+        result, total_entries = query_loki_logs_chunked(args)
     
     # Process and output the results
     if args.debug:
@@ -337,112 +1525,377 @@ def query_loki_logs(args):
                     if 'stream' in first_stream:
                         print(f"DEBUG: Sample labels: {first_stream['stream']}")
     
-    # Validate CSV file path if output is CSV
-    if args.output == 'csv' and args.csv_file:
-        sanitized_path = sanitize_filepath(args.csv_file)
-        if sanitized_path:
-            args.csv_file = sanitized_path
-            if args.debug:
-                print(f"DEBUG: Will attempt to write CSV to {args.csv_file}")
+    stats = get_stats(args)
+    if stats:
+        stats.entries = total_entries
+        started = time.perf_counter()
+    
+    print(json.dumps(result, indent=2))
+    
+    if stats:
+        stats.format_seconds = time.perf_counter() - started
+    return 0
+
+def get_stream_fields(labels):
+    """Return the (component, pod, container) shown for a stream's labels."""
+    component = labels.get("component", "unknown")
+    pod = labels.get("pod", "unknown").split('/')[-1] if '/' in labels.get("pod", "unknown") else labels.get("pod", "unknown")
+    container = labels.get("container", "unknown")
+    return component, pod, container
+
+def iter_stream_entries(stream):
+    """Yield (timestamp, log_entry, labels) for each value in a stream."""
+    labels = stream.get("stream", {})
+    for timestamp, log_entry in stream.get("values", []):
+        yield timestamp, log_entry, labels
+
+def entry_sort_key(entry):
+    """Sort key for (timestamp, log_entry, labels) entries: the numeric timestamp."""
+    return int(entry[0])
+
+def iter_page_entries(streams):
+    """Yield (timestamp, log_entry, labels) for a page in chronological order.
+
+    Loki returns each stream's values already sorted (direction=forward), so a
+    k-way merge orders the page without building and sorting a combined list.
+    """
+    return heapq.merge(*(iter_stream_entries(stream) for stream in streams), key=entry_sort_key)
+
+def iter_entries(pages):
+    """Yield (timestamp, log_entry, labels) for every page, in chronological order."""
+    for streams in pages:
+        yield from iter_page_entries(streams)
+
+def feed_namespace_entries(args, feed):
+    """Query one namespace and put its ordered entries on feed, one page at a time.
+
+    Ends with None, after any error that stopped the query.
+    """
+    try:
+        for streams in iter_log_pages(args):
+            for stream in streams:
+                stream.setdefault("stream", {}).setdefault("namespace", args.namespace)
+            feed.put(list(iter_page_entries(streams)))
+    except Exception as e:
+        feed.put(e)
+    finally:
+        feed.put(None)
+
+def iter_feed(feed):
+    """Yield the entries put on a feed by feed_namespace_entries."""
+    while True:
+        batch = feed.get()
+        if batch is None:
+            return
+        if isinstance(batch, Exception):
+            raise batch
+        yield from batch
+
+def iter_merged_entries(args, query_args):
+    """Yield (timestamp, log_entry, labels) of several queries as one timeline.
+
+    Every query (one args copy in query_args) runs concurrently in its own
+    thread, which queues up at most NAMESPACE_FEED_PAGES pages of its already
+    ordered entries. A heap-based k-way merge of those feeds yields the
+    combined timeline without a global sort. --max-entries caps the merged
+    timeline.
+    """
+    # Size the shared connection pool for every query before the threads start
+    get_session(args)
+    
+    feeds = []
+    for single_args in query_args:
+        feed = queue.Queue(maxsize=NAMESPACE_FEED_PAGES)
+        threading.Thread(target=feed_namespace_entries, args=(single_args, feed), daemon=True).start()
+        feeds.append(iter_feed(feed))
+    
+    timeline = heapq.merge(*feeds, key=entry_sort_key)
+    if args.max_entries:
+        timeline = itertools.islice(timeline, args.max_entries)
+    return timeline
+
+def iter_namespace_entries(args):
+    """Yield (timestamp, log_entry, labels) across several namespaces as one timeline."""
+    namespace_args = []
+    for namespace in args.namespace.split(','):
+        namespace_args.append(copy.copy(args))
+        namespace_args[-1].namespace = namespace.strip()
+    return iter_merged_entries(args, namespace_args)
+
+def query_loki_logs_namespaces(args):
+    """Query several namespaces concurrently and combine their results into one."""
+    get_session(args)
+    namespace_args = []
+    for namespace in args.namespace.split(','):
+        namespace_args.append(copy.copy(args))
+        namespace_args[-1].namespace = namespace.strip()
+    
+    all_results = []
+    with ThreadPoolExecutor(max_workers=len(namespace_args)) as executor:
+        for ns_args, (result, _) in zip(namespace_args, executor.map(query_loki_logs_chunked, namespace_args)):
+            for stream in get_streams(result):
+                stream.setdefault("stream", {}).setdefault("namespace", ns_args.namespace)
+                all_results.append(stream)
+    
+    result = {
+        "status": "success",
+        "data": {
+            "resultType": "streams",
+            "result": all_results
+        }
+    }
+    
+    return result, count_entries(all_results)
+
+def update_log_index(args, index, selector, start_time, end_time):
+    """Fetch the parts of a time range the log index does not hold yet and store them.
+
+    Chunks are always paginated, since the index has to hold every line. A
+    chunk only counts as covered up to CACHE_SETTLE_SECONDS ago, so recent
+    lines are fetched again next time. A failed request raises
+    LokiQueryError; the chunks stored before it are kept.
+    """
+    fill_args = copy.copy(args)
+    fill_args.paginate = True
+    settled_time = int((time.time() - CACHE_SETTLE_SECONDS) * 1e9)
+    
+    missing_ranges = index.get_missing_ranges(selector, start_time, end_time)
+    if args.debug:
+        print(f"DEBUG: Index {args.index} is missing {len(missing_ranges)} time ranges for {selector}")
+    
+    for range_start, range_end in missing_ranges:
+        if args.adaptive_chunks:
+            time_chunks = create_adaptive_time_chunks(fill_args, selector, range_start, range_end)
         else:
-            print("Warning: Invalid CSV file path. Will output to stdout instead.", file=sys.stderr)
-            args.csv_file = None
+            time_chunks = create_time_chunks(range_start, range_end, args.chunk_hours, align=True)
+        
+        for chunk_index, pages in iter_time_chunk_pages(fill_args, selector, time_chunks):
+            chunk_start, chunk_end = (int(t) for t in time_chunks[chunk_index])
+            stored = index.store_chunk(selector, chunk_start, chunk_end, pages)
+            if chunk_start < settled_time:
+                index.add_coverage(selector, chunk_start, min(chunk_end, settled_time))
+            if args.debug:
+                print(f"DEBUG: Stored {stored} log entries for {datetime.datetime.fromtimestamp(chunk_start / 1e9)} to "
+                      f"{datetime.datetime.fromtimestamp(chunk_end / 1e9)}")
+
+def iter_index_entries(args):
+    """Yield (timestamp, log_entry, labels) for the query from the --index store, in chronological order.
+
+    The store is brought up to date from Loki first, unless --offline is given.
+    --text-contains, --text-not-contains and --level are applied locally.
+    """
+    start_time, end_time = (int(t) for t in get_time_range(args))
+    selector = build_stream_selector(args)
+    index = open_log_index(args)
+    if not args.offline:
+        update_log_index(args, index, selector, start_time, end_time)
+    yield from index.iter_entries(args, selector, start_time, end_time)
+
+def query_log_index(args):
+    """Answer the query from the --index store, collected into one Loki-style result."""
+    streams = {}
+    for timestamp, log_entry, labels in iter_index_entries(args):
+        key = json.dumps(labels, sort_keys=True)
+        if key not in streams:
+            streams[key] = {"stream": labels, "values": []}
+        streams[key]["values"].append([timestamp, log_entry])
+    
+    all_results = list(streams.values())
+    result = {
+        "status": "success",
+        "data": {
+            "resultType": "streams",
+            "result": all_results
+        }
+    }
+    
+    return result, count_entries(all_results)
+
+def query_log_index_counts(args):
+    """Print entry counts from the --index store, grouped by the --count-by columns."""
+    start_time, end_time = (int(t) for t in get_time_range(args))
+    selector = build_stream_selector(args)
+    index = open_log_index(args)
+    if not args.offline:
+        update_log_index(args, index, selector, start_time, end_time)
+    
+    started = time.time()
+    counts = [dict(zip(args.count_by + ["count"], row)) for row in index.count_entries_by(args, selector, start_time, end_time, args.count_by)]
+    if args.debug:
+        print(f"DEBUG: Counted {len(counts)} groups in {(time.time() - started) * 1000:.1f} ms")
     
     if args.output == 'json':
-        print(json.dumps(result, indent=2))
+        print(json.dumps(counts, indent=2))
+    elif args.output == 'ndjson':
+        for row in counts:
+            sys.stdout.write(json.dumps(row) + "\n")
     elif args.output == 'csv':
-        output_as_csv(result, args.csv_file)
-    else:
-        # Format logs in a readable way
-        if "data" in result and "result" in result["data"]:
-            if len(result["data"]["result"]) == 0:
-                print("No logs found for the specified criteria")
-                return 0
-
-            for stream in result["data"]["result"]:
-                labels = stream.get("stream", {})
-                component = labels.get("component", "unknown")
-                pod = labels.get("pod", "unknown").split('/')[-1] if '/' in labels.get("pod", "unknown") else labels.get("pod", "unknown")
-                
-                print(f"\n=== Logs for echo-{component} pod: {pod} ===\n")
-                
-                for timestamp, log_entry in stream.get("values", []):
-                    # Convert timestamp to human-readable format
-                    ts = datetime.datetime.fromtimestamp(float(timestamp) / 1e9)
-                    print(f"[{ts}] {log_entry}")
+        fieldnames = args.count_by + ["count"]
+        if args.csv_file:
+            with open(args.csv_file, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.DictWriter(f, fieldnames=fieldnames)
+                writer.writeheader()
+                writer.writerows(counts)
+            print(f"CSV output written to {args.csv_file} ({len(counts)} groups)")
         else:
-            print("No logs found for the specified criteria")
+            writer = csv.DictWriter(sys.stdout, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(counts)
+    elif not counts:
+        print("No logs found for the specified criteria")
+    else:
+        header = args.count_by + ["count"]
+        table = [[str(row[column]) for column in header] for row in counts]
+        widths = [max(len(row[i]) for row in [header] + table) for i in range(len(header))]
+        for row in [header] + table:
+            print("  ".join(cell.rjust(width) if i == len(row) - 1 else cell.ljust(width) for i, (cell, width) in enumerate(zip(row, widths))))
     
     return 0
 
+def peek_iterator(items):
+    """Return an iterator over items, or None if there are no items at all."""
+    items = iter(items)
+    first_item = next(items, None)
+    if first_item is None:
+        return None
+    return itertools.chain([first_item], items)
+
+def output_as_raw(pages):
+    """Output the logs in a human-readable format as pages arrive."""
+    pages = peek_iterator(pages)
+    if pages is None:
+        print("No logs found for the specified criteria")
+        return
+    
+    for streams in pages:
+        for stream in streams:
+            component, pod, _ = get_stream_fields(stream.get("stream", {}))
+            
+            print(f"\n=== Logs for echo-{component} pod: {pod} ===\n")
+            
+            for timestamp, log_entry in stream.get("values", []):
+                # Convert timestamp to human-readable format
+                ts = datetime.datetime.fromtimestamp(float(timestamp) / 1e9)
+                print(f"[{ts}] {log_entry}")
+
+def output_as_timeline(entries):
+    """Output the logs as a single human-readable timeline, one tagged line per entry."""
+    entries = peek_iterator(entries)
+    if entries is None:
+        print("No logs found for the specified criteria")
+        return
+    
+    for timestamp, log_entry, labels in entries:
+        component, pod, _ = get_stream_fields(labels)
+        ts = datetime.datetime.fromtimestamp(float(timestamp) / 1e9)
+        print(f"[{ts}] [{labels.get('namespace', 'unknown')}] echo-{component}/{pod}: {log_entry}")
+
+def output_as_ndjson(entries):
+    """Output one JSON object per log entry, in chronological order, as they arrive."""
+    for timestamp, log_entry, labels in entries:
+        sys.stdout.write(json.dumps({"timestamp": timestamp, "stream": labels, "line": log_entry}) + "\n")
+
+# Common log level indicators, in order of precedence
+LOG_LEVELS = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL", "WARN", "ERR", "FATAL", "TRACE"]
+
+# (level, lowercase level, patterns that mark it) for every level, built once at import
+LOG_LEVEL_PATTERNS = [
+    (level, level.lower(), (
+        f"{level}:", f"[{level}]", f"[{level.lower()}]",
+        f"level={level}", f"level={level.lower()}",
+        f"\"{level}\"", f"'{level}'", f"level: {level}"
+    ))
+    for level in LOG_LEVELS
+]
+
 def parse_log_level(log_entry):
-    """Extract log level from log entry if possible."""
-    # Common log level indicators
-    log_levels = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL", "WARN", "ERR", "FATAL", "TRACE"]
-    
-    # Try different patterns for log levels
-    for level in log_levels:
-        patterns = [
-            f"{level}:", f"[{level}]", f"[{level.lower()}]",
-            f"level={level}", f"level={level.lower()}",
-            f"\"{level}\"", f"'{level}'", f"level: {level}"
-        ]
+    """Extract log level from log entry if possible.
+
+    Returns the first level (in LOG_LEVELS order) with one of its patterns in
+    the entry, else the first level whose name appears in any case, else INFO.
+    Every pattern contains the level name in upper or lower case, so a level
+    whose name isn't in the lowercased entry can't match any of its patterns;
+    that single check skips almost all pattern scans on a typical line.
+    """
+    lowered = log_entry.lower()
+    first_mentioned = None
+    
+    for level, level_lower, patterns in LOG_LEVEL_PATTERNS:
+        if level_lower not in lowered:
+            continue
         for pattern in patterns:
             if pattern in log_entry:
                 return level
-    
-    # Check for lowercase versions
-    for level in log_levels:
-        if level.lower() in log_entry.lower():
-            return level
+        # Fall back to the first level mentioned anywhere if no pattern matches
+        if first_mentioned is None:
+            first_mentioned = level
     
     # Default level if none found
-    return "INFO"
+    return first_mentioned or "INFO"
+
+# Field names for CSV output
+CSV_FIELDNAMES = ["timestamp", "component", "pod", "container", "level", "message"]
+
+def iter_csv_rows(entries, include_namespace=False):
+    """Yield a CSV row dict for every log entry, in chronological order."""
+    for timestamp, log_entry, labels in entries:
+        try:
+            component, pod, container = get_stream_fields(labels)
+            
+            # Convert timestamp to human-readable format
+            ts = datetime.datetime.fromtimestamp(float(timestamp) / 1e9)
+            
+            # Try to extract severity/log level
+            log_level = parse_log_level(log_entry)
+            
+            # Clean the log message to handle CSV special characters
+            # This will help prevent CSV injection and formatting issues
+            safe_log_entry = log_entry.replace('\r', ' ').replace('\n', ' ')
+            
+            row = {
+                "timestamp": ts.isoformat(),
+                "component": component,
+                "pod": pod,
+                "container": container,
+                "level": log_level,
+                "message": safe_log_entry
+            }
+            if include_namespace:
+                row["namespace"] = labels.get("namespace", "unknown")
+            yield row
+        except Exception as e:
+            print(f"Warning: Could not process log entry: {e}", file=sys.stderr)
+            continue
+
+def get_csv_fieldnames(include_namespace=False):
+    """Return the CSV columns, with a namespace column after the timestamp if requested."""
+    if include_namespace:
+        return CSV_FIELDNAMES[:1] + ["namespace"] + CSV_FIELDNAMES[1:]
+    return CSV_FIELDNAMES
 
-def output_as_csv(result, csv_file=None):
-    """Output the logs in CSV format."""
-    if "data" not in result or "result" not in result["data"] or not result["data"]["result"]:
+def write_csv_rows(f, rows, fieldnames=CSV_FIELDNAMES):
+    """Write CSV rows to an open file and return how many were written."""
+    writer = csv.DictWriter(f, fieldnames=fieldnames, quoting=csv.QUOTE_ALL)
+    writer.writeheader()
+    row_count = 0
+    for row in rows:
+        writer.writerow(row)
+        row_count += 1
+    return row_count
+
+def output_as_csv(entries, csv_file=None, include_namespace=False):
+    """Output the logs in CSV format, writing each entry as it arrives.
+
+    Entries come in chronological order (see iter_entries), so rows come out
+    sorted without holding them all in memory.
+    """
+    entries = peek_iterator(entries)
+    if entries is None:
         print("No logs found for the specified criteria")
         return
     
-    # Prepare CSV data
-    csv_data = []
-    
-    for stream in result["data"]["result"]:
-        labels = stream.get("stream", {})
-        component = labels.get("component", "unknown")
-        pod = labels.get("pod", "unknown").split('/')[-1] if '/' in labels.get("pod", "unknown") else labels.get("pod", "unknown")
-        container = labels.get("container", "unknown")
-        
-        for timestamp, log_entry in stream.get("values", []):
-            try:
-                # Convert timestamp to human-readable format
-                ts = datetime.datetime.fromtimestamp(float(timestamp) / 1e9)
-                
-                # Try to extract severity/log level
-                log_level = parse_log_level(log_entry)
-                
-                # Clean the log message to handle CSV special characters
-                # This will help prevent CSV injection and formatting issues
-                safe_log_entry = log_entry.replace('\r', ' ').replace('\n', ' ')
-                
-                csv_data.append({
-                    "timestamp": ts.isoformat(),
-                    "component": component,
-                    "pod": pod,
-                    "container": container,
-                    "level": log_level,
-                    "message": safe_log_entry
-                })
-            except Exception as e:
-                print(f"Warning: Could not process log entry: {e}", file=sys.stderr)
-                continue
-    
-    # Sort by timestamp (for paginated requests, ensure chronological order)
-    csv_data.sort(key=lambda x: x["timestamp"])
-    
-    # Define field names for CSV
-    fieldnames = ["timestamp", "component", "pod", "container", "level", "message"]
+    rows = iter_csv_rows(entries, include_namespace)
+    fieldnames = get_csv_fieldnames(include_namespace)
     
     if csv_file:
         try:
@@ -450,32 +1903,796 @@ def output_as_csv(result, csv_file=None):
             directory = os.path.dirname(csv_file)
             if directory and not os.path.exists(directory):
                 os.makedirs(directory)
-                
-            # Write to file
-            with open(csv_file, 'w', newline='', encoding='utf-8') as f:
-                writer = csv.DictWriter(f, fieldnames=fieldnames, quoting=csv.QUOTE_ALL)
-                writer.writeheader()
-                writer.writerows(csv_data)
-            print(f"CSV output written to {csv_file} ({len(csv_data)} entries)")
+            f = open(csv_file, 'w', newline='', encoding='utf-8')
         except IOError as e:
             print(f"Error writing to CSV file: {e}", file=sys.stderr)
             print("Outputting to stdout instead:")
             # Fall back to stdout on error
-            output = StringIO()
-            writer = csv.DictWriter(output, fieldnames=fieldnames, quoting=csv.QUOTE_ALL)
-            writer.writeheader()
-            writer.writerows(csv_data)
-            print(output.getvalue())
+            write_csv_rows(sys.stdout, rows, fieldnames)
+            return
+        
+        try:
+            # Write to file
+            with f:
+                row_count = write_csv_rows(f, rows, fieldnames)
+            print(f"CSV output written to {csv_file} ({row_count} entries)")
+        except IOError as e:
+            print(f"Error writing to CSV file: {e}", file=sys.stderr)
         except Exception as e:
             print(f"Unexpected error writing CSV file: {e}", file=sys.stderr)
     else:
         # Print to stdout
-        output = StringIO()
-        writer = csv.DictWriter(output, fieldnames=fieldnames, quoting=csv.QUOTE_ALL)
-        writer.writeheader()
-        writer.writerows(csv_data)
-        print(output.getvalue())
+        write_csv_rows(sys.stdout, rows, fieldnames)
+
+def get_manifest_path(csv_file):
+    """Return the path of the checkpoint manifest kept next to a CSV export."""
+    return f"{csv_file}.manifest.json"
+
+def save_export_manifest(manifest_path, manifest):
+    """Write the checkpoint manifest atomically, so a crash leaves the old or the new one."""
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, manifest_path)
+
+def load_export_manifest(args, manifest_path, query):
+    """Return the manifest of the export to resume, or None to start from scratch.
+
+    Exits with an error if the manifest belongs to a different query.
+    """
+    if not os.path.exists(manifest_path) or not os.path.exists(args.csv_file):
+        print(f"No checkpoint found for {args.csv_file}, starting a new export", file=sys.stderr)
+        return None
+    try:
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Error reading checkpoint {manifest_path}: {e}", file=sys.stderr)
+        sys.exit(1)
+    
+    # Everything that changes which rows end up in the file has to match
+    for key, value in (("query", query), ("limit", args.limit), ("paginate", args.paginate), ("max_entries", args.max_entries)):
+        if manifest.get(key) != value:
+            print(f"Error: {args.csv_file} was exported with {key}={manifest.get(key)!r}, not {value!r}; "
+                  f"re-run with the same options or without --resume", file=sys.stderr)
+            sys.exit(1)
+    return manifest
+
+def export_csv_checkpointed(args):
+    """Export the logs to --csv-file, committing progress to a manifest as it goes.
+
+    Rows are appended page by page. After each page (with --workers 1) or
+    each chunk (with --workers > 1) the file is flushed to disk and the
+    manifest records its size, the chunks that are done and, mid-chunk, the
+    pagination cursor. The manifest also pins the time range and chunks, so
+    --resume continues the same export even with a relative --hours/--days.
+    On resume the file is cut back to the recorded size, dropping any rows
+    written after the last checkpoint, and fetching picks up from there.
+    """
+    query = build_query(args)
+    manifest_path = get_manifest_path(args.csv_file)
+    manifest = load_export_manifest(args, manifest_path, query) if args.resume else None
+    
+    if manifest is None:
+        start_time, end_time = get_time_range(args)
+        if args.adaptive_chunks:
+            time_chunks = create_adaptive_time_chunks(args, query, start_time, end_time)
+        else:
+            time_chunks = create_time_chunks(start_time, end_time, args.chunk_hours, align=args.cache)
+        manifest = {
+            "query": query,
+            "limit": args.limit,
+            "paginate": args.paginate,
+            "max_entries": args.max_entries,
+            "chunks": [[int(chunk_start), int(chunk_end)] for chunk_start, chunk_end in time_chunks],
+            "next_chunk": 0,
+            "cursor": None,
+            "offset": 0,
+            "entries": 0,
+            "complete": False,
+        }
+    elif manifest["complete"]:
+        print(f"Export to {args.csv_file} is already complete ({manifest['entries']} entries)")
+        return 0
+    else:
+        print(f"Resuming export to {args.csv_file} at chunk {manifest['next_chunk'] + 1}/{len(manifest['chunks'])} "
+              f"({manifest['entries']} entries so far)", file=sys.stderr)
+    
+    time_chunks = [tuple(chunk) for chunk in manifest["chunks"]]
+    fieldnames = get_csv_fieldnames()
+    
+    directory = os.path.dirname(args.csv_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if manifest["offset"]:
+        f = open(args.csv_file, 'r+', newline='', encoding='utf-8')
+        f.truncate(manifest["offset"])
+        f.seek(manifest["offset"])
+    else:
+        f = open(args.csv_file, 'w', newline='', encoding='utf-8')
+    
+    def commit():
+        """Make everything written so far durable and record it in the manifest."""
+        f.flush()
+        os.fsync(f.fileno())
+        manifest["offset"] = f.tell()
+        save_export_manifest(manifest_path, manifest)
+    
+    with f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames, quoting=csv.QUOTE_ALL)
+        if not manifest["offset"]:
+            writer.writeheader()
+            commit()
+        
+        def write_page(streams):
+            """Write one page of rows and return whether --max-entries has been reached."""
+            for row in iter_csv_rows(iter_page_entries(streams)):
+                writer.writerow(row)
+                manifest["entries"] += 1
+                if args.max_entries and manifest["entries"] >= args.max_entries:
+                    return True
+            return False
+        
+        done = bool(args.max_entries and manifest["entries"] >= args.max_entries)
+        
+        # Sequential pagination is checkpointed after every page. A chunk that was
+        # interrupted halfway always continues from its cursor this way.
+        while (not done and manifest["next_chunk"] < len(time_chunks)
+               and (manifest["cursor"] is not None or (args.workers == 1 and args.paginate))):
+            chunk_start, chunk_end = time_chunks[manifest["next_chunk"]]
+            cursor = manifest["cursor"] or {}
+            manifest["cursor"] = cursor
+            for streams in iter_chunk_pages(args, query, chunk_start, chunk_end, cursor):
+                done = write_page(streams)
+                commit()
+                if done:
+                    break
+            manifest["next_chunk"] += 1
+            manifest["cursor"] = None
+            commit()
+        
+        # Otherwise whole chunks are checkpointed as they come back
+        if not done and manifest["next_chunk"] < len(time_chunks):
+            first_chunk = manifest["next_chunk"]
+            for chunk_index, chunk_pages in iter_time_chunk_pages(args, query, time_chunks[first_chunk:]):
+                for streams in chunk_pages:
+                    done = write_page(streams)
+                    if done:
+                        break
+                manifest["next_chunk"] = first_chunk + chunk_index + 1
+                commit()
+                if done:
+                    break
+        
+        manifest["complete"] = True
+        commit()
+    
+    print(f"CSV output written to {args.csv_file} ({manifest['entries']} entries)")
+    return 0
+
+def output_as_columnar(entries, output_file, output_format, row_group_size, include_namespace=False):
+    """Write the logs as a Parquet or Arrow IPC file, one row group at a time as entries arrive.
+
+    The low-cardinality label columns are dictionary encoded. Their
+    dictionaries only ever grow (new values are appended), which keeps every
+    row group readable against the same dictionary and lets the Arrow IPC
+    file format store the growth as deltas.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        print(f"Error: --output {output_format} requires pyarrow (pip install pyarrow)", file=sys.stderr)
+        return 1
+    
+    if not output_file:
+        print("Error: Invalid output file path", file=sys.stderr)
+        return 1
+    
+    label_columns = ["component", "pod", "container", "level"]
+    if include_namespace:
+        label_columns.insert(0, "namespace")
+    label_type = pa.dictionary(pa.int32(), pa.string())
+    schema = pa.schema(
+        [("timestamp", pa.timestamp("ns", tz="UTC"))]
+        + [(name, label_type) for name in label_columns]
+        + [("message", pa.string())]
+    )
+    
+    # Append-only dictionary per label column: value -> index, and the values in index order
+    label_indexes = {name: {} for name in label_columns}
+    label_values = {name: [] for name in label_columns}
+    
+    def new_row_group():
+        return {name: [] for name in schema.names}
+    
+    def to_record_batch(rows):
+        arrays = [pa.array(rows["timestamp"], type=pa.timestamp("ns", tz="UTC"))]
+        for name in label_columns:
+            arrays.append(pa.DictionaryArray.from_arrays(
+                pa.array(rows[name], type=pa.int32()), pa.array(label_values[name], type=pa.string())))
+        arrays.append(pa.array(rows["message"], type=pa.string()))
+        return pa.record_batch(arrays, schema=schema)
+    
+    directory = os.path.dirname(output_file)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    
+    if output_format == "parquet":
+        writer = pq.ParquetWriter(output_file, schema, compression="zstd", use_dictionary=label_columns)
+    else:
+        writer = pa.ipc.new_file(output_file, schema, options=pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True))
+    
+    row_count = 0
+    row_groups = 0
+    rows = new_row_group()
+    with writer:
+        for timestamp, log_entry, labels in entries:
+            component, pod, container = get_stream_fields(labels)
+            label_row = (component, pod, container, parse_log_level(log_entry))
+            if include_namespace:
+                label_row = (labels.get("namespace", "unknown"),) + label_row
+            for name, value in zip(label_columns, label_row):
+                index = label_indexes[name].get(value)
+                if index is None:
+                    index = label_indexes[name][value] = len(label_values[name])
+                    label_values[name].append(value)
+                rows[name].append(index)
+            rows["timestamp"].append(int(timestamp))
+            rows["message"].append(log_entry)
+            
+            if len(rows["timestamp"]) >= row_group_size:
+                writer.write_batch(to_record_batch(rows))
+                row_count += len(rows["timestamp"])
+                row_groups += 1
+                rows = new_row_group()
+        
+        if rows["timestamp"]:
+            writer.write_batch(to_record_batch(rows))
+            row_count += len(rows["timestamp"])
+            row_groups += 1
+    
+    print(f"{output_format.capitalize()} output written to {output_file} ({row_count} entries in {row_groups} row groups)")
+    return 0
+
+def query_loki_metric_series(args):
+    """Run the --metric aggregation over the whole time range.
+
+    Returns {labels: {timestamp: value}} with labels a sorted tuple of label
+    pairs and timestamps in seconds. Like log
+    queries, the range is split into chunks for Loki's max query length; the
+    chunks share their boundary point, which is simply written twice.
+    """
+    start_time, end_time = get_time_range(args)
+    by = [label.strip() for label in args.by.split(',') if label.strip()]
+    metric_query = build_metric_query(build_query(args), args.metric, args.step, by)
+    time_chunks = create_time_chunks(start_time, end_time, args.chunk_hours, align=True)
+    
+    if args.debug:
+        print(f"DEBUG: Full time range - from {datetime.datetime.fromtimestamp(start_time / 1e9)} to {datetime.datetime.fromtimestamp(end_time / 1e9)}")
+        print(f"DEBUG: Using metric query: {metric_query}")
+        print(f"DEBUG: Split into {len(time_chunks)} time chunks")
+    
+    series = {}
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        chunk_results = executor.map(
+            lambda chunk: query_loki_metric(args, metric_query, chunk[0], chunk[1], args.step), time_chunks)
+        for chunk_series in chunk_results:
+            for metric in chunk_series:
+                points = series.setdefault(tuple(sorted(metric.get("metric", {}).items())), {})
+                for point_time, value in metric.get("values", []):
+                    points[int(round(float(point_time)))] = value
+    
+    return series
+
+def get_series_name(labels):
+    """Return a short column name for a series, e.g. api/echo-api-7d9f."""
+    if not labels:
+        return "total"
+    return "/".join(value.split('/')[-1] for _, value in labels)
+
+def format_metric_value(value):
+    """Format a sample value compactly, dropping needless decimals."""
+    return f"{float(value):.6g}"
+
+def query_loki_metrics(args):
+    """Query and output a --metric time series aggregation."""
+    series = query_loki_metric_series(args)
+    if not series:
+        print("No logs found for the specified criteria")
+        return 0
+    
+    series_keys = sorted(series)
+    timestamps = sorted(set().union(*(points.keys() for points in series.values())))
+    
+    if args.output == 'json':
+        # Same shape as a Loki matrix response, with the chunks stitched together
+        result = {
+            "status": "success",
+            "data": {
+                "resultType": "matrix",
+                "result": [
+                    {"metric": dict(labels), "values": [[ts, series[labels][ts]] for ts in sorted(series[labels])]}
+                    for labels in series_keys
+                ]
+            }
+        }
+        print(json.dumps(result, indent=2))
+    elif args.output == 'ndjson':
+        for ts in timestamps:
+            for labels in series_keys:
+                if ts in series[labels]:
+                    sys.stdout.write(json.dumps({"timestamp": ts, "metric": dict(labels), "value": series[labels][ts]}) + "\n")
+    elif args.output == 'csv':
+        # Long format: one row per series per timestamp
+        label_names = sorted({name for labels in series_keys for name, _ in labels})
+        rows = (
+            dict(labels, timestamp=datetime.datetime.fromtimestamp(ts).isoformat(), value=series[labels][ts])
+            for ts in timestamps for labels in series_keys if ts in series[labels]
+        )
+        fieldnames = ["timestamp"] + label_names + ["value"]
+        if args.csv_file:
+            with open(args.csv_file, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.DictWriter(f, fieldnames=fieldnames, restval="")
+                writer.writeheader()
+                writer.writerows(rows)
+            print(f"CSV output written to {args.csv_file} ({len(timestamps)} timestamps, {len(series_keys)} series)")
+        else:
+            writer = csv.DictWriter(sys.stdout, fieldnames=fieldnames, restval="")
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        # Wide table: one row per timestamp, one column per series
+        header = ["time"] + [get_series_name(labels) for labels in series_keys]
+        table = [
+            [datetime.datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S")]
+            + [format_metric_value(series[labels][ts]) if ts in series[labels] else "-" for labels in series_keys]
+            for ts in timestamps
+        ]
+        widths = [max(len(row[i]) for row in [header] + table) for i in range(len(header))]
+        for row in [header] + table:
+            print("  ".join(cell.rjust(width) if i else cell.ljust(width) for i, (cell, width) in enumerate(zip(row, widths))))
+    
+    return 0
+
+def flatten_fields(value, prefix=""):
+    """Flatten nested JSON objects into one dict with dotted keys."""
+    fields = {}
+    for key, item in value.items():
+        key = f"{prefix}{key}"
+        if isinstance(item, dict):
+            fields.update(flatten_fields(item, f"{key}."))
+        elif isinstance(item, list):
+            fields[key] = json.dumps(item)
+        else:
+            fields[key] = item
+    return fields
+
+def parse_structured_fields(log_entry):
+    """Return the fields of a JSON or logfmt log line as a flat dict ({} for plain text).
+
+    Plain text lines with a few key=value pairs in them yield those pairs.
+    """
+    stripped = log_entry.strip()
+    if stripped.startswith('{'):
+        try:
+            value = decode_json(stripped)
+        except ValueError:
+            return {}
+        return flatten_fields(value) if isinstance(value, dict) else {}
+    if '=' not in log_entry:
+        return {}
+    fields = {}
+    for key, value in LOGFMT_PATTERN.findall(log_entry):
+        if value.startswith('"'):
+            value = value[1:-1].replace('\\"', '"')
+        fields[key] = value
+    return fields
+
+def get_entry_level(log_entry, fields):
+    """Return the level of a log line, from its structured fields if it has one."""
+    for name in LEVEL_FIELDS:
+        level = fields.get(name)
+        if isinstance(level, int) and level in PINO_LEVELS:
+            return PINO_LEVELS[level]
+        if isinstance(level, str) and level.upper() in LOG_LEVELS:
+            return level.upper()
+    return parse_log_level(log_entry)
+
+def is_id_field(key):
+    """Whether a structured field name looks like it holds an ID (id, request_id, req.id, conversationId)."""
+    return key == "id" or key.endswith(("_id", ".id", "Id", "ID"))
+
+class CorrelationIndex:
+    """The log entries of one --correlate pull, with an ID -> entry offsets index.
+
+    Entries are appended in timeline order, so every offset list is in
+    timeline order too. ID-like tokens (ID_TOKEN_PATTERN) and the values of
+    ID fields are indexed as entries arrive. The token pattern misses IDs
+    embedded in longer words (conv_<uuid>, chunks/<uuid>_000.webm), so the
+    first lookup of an ID also scans every entry for it as a substring and
+    caches the merged offsets; a single pull answers any number of IDs.
+    """
+
+    def __init__(self):
+        # (timestamp, log_entry, labels, structured fields)
+        self.entries = []
+        self.offsets = {}
+        # IDs whose offsets include the substring matches
+        self.scanned = set()
+
+    def add(self, timestamp, log_entry, labels):
+        offset = len(self.entries)
+        fields = parse_structured_fields(log_entry)
+        self.entries.append((timestamp, log_entry, labels, fields))
+        ids = set(ID_TOKEN_PATTERN.findall(log_entry))
+        ids.update(str(value) for key, value in fields.items() if is_id_field(key) and value not in (None, ""))
+        ids.update(correlate_id for correlate_id in self.scanned if correlate_id in log_entry)
+        for correlate_id in ids:
+            self.offsets.setdefault(correlate_id, []).append(offset)
+
+    def lookup(self, correlate_id):
+        """Return the offsets of the entries mentioning an ID, in timeline order."""
+        if correlate_id not in self.scanned:
+            offsets = set(self.offsets.get(correlate_id, ()))
+            offsets.update(offset for offset, (_, log_entry, _, _) in enumerate(self.entries) if correlate_id in log_entry)
+            self.offsets[correlate_id] = sorted(offsets)
+            self.scanned.add(correlate_id)
+        return self.offsets[correlate_id]
+
+def iter_correlated_entries(args):
+    """Yield (timestamp, log_entry, labels) for every --correlate component and namespace as one timeline."""
+    query_args = []
+    for namespace in args.namespace.split(','):
+        for component in args.correlate_components.split(','):
+            query_args.append(copy.copy(args))
+            query_args[-1].namespace = namespace.strip()
+            query_args[-1].component = component.strip()
+            query_args[-1].all = False
+    return iter_merged_entries(args, query_args)
+
+def build_correlation_timeline(index, correlate_id):
+    """Return the timeline of one ID: its entries with the time since the previous one, and the hops.
+
+    A hop is a change of component between two consecutive entries; its
+    latency is the time from the last entry in one component to the first
+    in the next.
+    """
+    entries = []
+    hops = []
+    previous_ts = None
+    previous_component = None
+    for offset in index.lookup(correlate_id):
+        timestamp, log_entry, labels, fields = index.entries[offset]
+        component, pod, container = get_stream_fields(labels)
+        ts = int(timestamp)
+        delta_ms = (ts - previous_ts) / 1e6 if previous_ts is not None else 0.0
+        if previous_component is not None and component != previous_component:
+            hops.append({"from": previous_component, "to": component, "latency_ms": delta_ms})
+        message = next((fields[name] for name in MESSAGE_FIELDS if isinstance(fields.get(name), str)), log_entry)
+        entries.append({
+            "timestamp": timestamp,
+            "namespace": labels.get("namespace", "unknown"),
+            "component": component,
+            "pod": pod,
+            "container": container,
+            "level": get_entry_level(log_entry, fields),
+            "delta_ms": delta_ms,
+            "message": message,
+            "fields": {
+                key: value for key, value in fields.items()
+                if key not in MESSAGE_FIELDS + LEVEL_FIELDS + TIME_FIELDS
+            },
+        })
+        previous_ts = ts
+        previous_component = component
+    span_ms = (previous_ts - int(entries[0]["timestamp"])) / 1e6 if entries else 0.0
+    return {"id": correlate_id, "span_ms": span_ms, "hops": hops, "entries": entries}
+
+def format_milliseconds(milliseconds):
+    """Format a duration given in milliseconds for the --correlate timeline."""
+    if milliseconds >= 1000:
+        return f"{milliseconds / 1000:.3f}s"
+    return f"{milliseconds:.1f}ms"
+
+def output_correlation_timeline(timeline):
+    """Print one ID's timeline in a human-readable format."""
+    entries = timeline["entries"]
+    if not entries:
+        print(f"\n=== {timeline['id']}: no log entries found ===")
+        return
+    
+    path = [entries[0]["component"]] + [hop["to"] for hop in timeline["hops"]]
+    print(f"\n=== {timeline['id']}: {len(entries)} entries, {' -> '.join(path)}, span {format_milliseconds(timeline['span_ms'])} ===\n")
+    for entry in entries:
+        ts = datetime.datetime.fromtimestamp(float(entry["timestamp"]) / 1e9)
+        fields = " ".join(f"{key}={value}" for key, value in entry["fields"].items())
+        print(f"[{ts}] +{format_milliseconds(entry['delta_ms']):>9} echo-{entry['component']}/{entry['pod']} "
+              f"{entry['level']}: {entry['message']}" + (f"  {{{fields}}}" if fields else ""))
+    if timeline["hops"]:
+        print("\nHops: " + ", ".join(
+            f"{hop['from']} -> {hop['to']} {format_milliseconds(hop['latency_ms'])}" for hop in timeline["hops"]))
+
+# Field names for --correlate CSV output
+CORRELATE_CSV_FIELDNAMES = ["id", "timestamp", "delta_ms", "namespace", "component", "pod", "container", "level", "message", "fields"]
+
+def iter_correlation_csv_rows(timelines):
+    """Yield a CSV row dict for every entry of every timeline."""
+    for timeline in timelines:
+        for entry in timeline["entries"]:
+            row = dict(entry, id=timeline["id"], fields=json.dumps(entry["fields"], default=str))
+            row["timestamp"] = datetime.datetime.fromtimestamp(float(entry["timestamp"]) / 1e9).isoformat()
+            row["message"] = str(entry["message"]).replace('\r', ' ').replace('\n', ' ')
+            yield row
+
+def iter_stdin_ids():
+    """Yield IDs typed or piped on stdin, one per line, prompting when interactive."""
+    interactive = sys.stdin.isatty()
+    while True:
+        if interactive:
+            print("ID> ", end="", file=sys.stderr, flush=True)
+        line = sys.stdin.readline()
+        if not line:
+            return
+        if line.strip():
+            yield line.strip()
+
+def query_correlation(args):
+    """Pull the logs of the --correlate components once and print a timeline per ID."""
+    index = CorrelationIndex()
+    entries = iter_correlated_entries(args)
+    stats = get_stats(args)
+    if stats:
+        entries = stats.iter_timed(entries)
+    for timestamp, log_entry, labels in entries:
+        index.add(timestamp, log_entry, labels)
+    if args.debug:
+        print(f"DEBUG: Indexed {len(index.entries)} log entries under {len(index.offsets)} IDs", file=sys.stderr)
+    
+    correlate_ids = iter_stdin_ids() if args.correlate == ['-'] else args.correlate
+    timelines = (build_correlation_timeline(index, correlate_id) for correlate_id in correlate_ids)
+    
+    if args.output == 'json':
+        print(json.dumps({"ids": {timeline["id"]: timeline for timeline in timelines}}, indent=2, default=str))
+    elif args.output == 'ndjson':
+        for timeline in timelines:
+            for entry in timeline["entries"]:
+                sys.stdout.write(json.dumps(dict(entry, id=timeline["id"]), default=str) + "\n")
+            sys.stdout.flush()
+    elif args.output == 'csv':
+        rows = iter_correlation_csv_rows(timelines)
+        if args.csv_file:
+            with open(args.csv_file, 'w', newline='', encoding='utf-8') as f:
+                row_count = write_csv_rows(f, rows, CORRELATE_CSV_FIELDNAMES)
+            print(f"CSV output written to {args.csv_file} ({row_count} entries)")
+        else:
+            write_csv_rows(sys.stdout, rows, CORRELATE_CSV_FIELDNAMES)
+    else:
+        for timeline in timelines:
+            output_correlation_timeline(timeline)
+            sys.stdout.flush()
+    return 0
+
+class LogCluster:
+    """One --cluster pattern: its template tokens and what was seen of it."""
+    
+    __slots__ = ("template", "node", "count", "first_seen", "last_seen", "components", "pods", "sample")
+    
+    def __init__(self, template, node, timestamp, labels, log_entry):
+        self.template = template
+        # The tree leaf holding this cluster, so an evicted cluster can be unlinked
+        self.node = node
+        self.count = 0
+        self.first_seen = timestamp
+        self.last_seen = timestamp
+        self.components = set()
+        self.pods = set()
+        self.sample = log_entry[:CLUSTER_SAMPLE_CHARS]
+    
+    def add(self, timestamp, labels):
+        self.count += 1
+        self.first_seen = min(self.first_seen, timestamp)
+        self.last_seen = max(self.last_seen, timestamp)
+        component, pod, _ = get_stream_fields(labels)
+        for values, value in ((self.components, component), (self.pods, pod)):
+            if len(values) < CLUSTER_MAX_LABEL_VALUES or value in values:
+                values.add(value)
+
+class LogClusterNode:
+    """A node of the --cluster parse tree."""
+    
+    __slots__ = ("children", "clusters")
+    
+    def __init__(self):
+        self.children = {}
+        self.clusters = []
+
+class LogClusterMiner:
+    """Drain-style online template miner for --cluster.
+
+    Variable parts of a line (numbers, IDs, timestamps, ...) are first masked
+    with CLUSTER_MASK_PATTERN. The masked tokens then walk a fixed-depth
+    tree, keyed first by the token count and then by the first tokens (a
+    token with digits, or one past max_children, takes the <*> branch), to a
+    leaf holding a handful of clusters. The line joins the most similar one
+    if at least `similarity` of the tokens are equal, and that cluster's
+    template turns every differing token into <*>; otherwise it starts a new
+    cluster. So each line costs a short tree walk and a comparison against a
+    few templates, whatever the number of lines.
+
+    At most max_clusters clusters are kept: the least recently matched one is
+    evicted to make room, so memory stays bounded on any input.
+    """
+    
+    def __init__(self, similarity=0.4, depth=4, max_clusters=5000, max_children=100):
+        self.similarity = similarity
+        self.depth = depth
+        self.max_clusters = max_clusters
+        self.max_children = max_children
+        self.root = LogClusterNode()
+        # Least recently matched first
+        self.clusters = collections.OrderedDict()
+        self.evicted = 0
+        self.evicted_lines = 0
+    
+    def get_leaf(self, tokens):
+        node = self.root.children.setdefault(len(tokens), LogClusterNode())
+        for token in tokens[:self.depth - 2]:
+            if any(char.isdigit() for char in token):
+                token = CLUSTER_WILDCARD
+            if token not in node.children:
+                if len(node.children) >= self.max_children:
+                    token = CLUSTER_WILDCARD
+                node = node.children.setdefault(token, LogClusterNode())
+            else:
+                node = node.children[token]
+        return node
+    
+    def match(self, node, tokens):
+        """Return the most similar cluster in a leaf, or None if none is similar enough."""
+        best = None
+        best_score = (-1, -1)
+        for cluster in node.clusters:
+            equal = 0
+            wildcards = 0
+            for template_token, token in zip(cluster.template, tokens):
+                if template_token == CLUSTER_WILDCARD:
+                    wildcards += 1
+                elif template_token == token:
+                    equal += 1
+            # Ties go to the more specific template
+            score = (equal, -wildcards)
+            if score > best_score:
+                best, best_score = cluster, score
+        if best is not None and best_score[0] >= self.similarity * len(tokens):
+            return best
+        return None
+    
+    def add(self, message, timestamp, labels, log_entry):
+        """Add one log line (its message, for the template) to its cluster."""
+        tokens = CLUSTER_MASK_PATTERN.sub(CLUSTER_WILDCARD, message).split()
+        node = self.get_leaf(tokens)
+        cluster = self.match(node, tokens)
+        if cluster is None:
+            cluster = LogCluster(tokens, node, timestamp, labels, log_entry)
+            node.clusters.append(cluster)
+            self.clusters[id(cluster)] = cluster
+            if len(self.clusters) > self.max_clusters:
+                _, evicted = self.clusters.popitem(last=False)
+                evicted.node.clusters.remove(evicted)
+                self.evicted += 1
+                self.evicted_lines += evicted.count
+        else:
+            cluster.template = [
+                template_token if template_token == token else CLUSTER_WILDCARD
+                for template_token, token in zip(cluster.template, tokens)
+            ]
+            self.clusters.move_to_end(id(cluster))
+        cluster.add(timestamp, labels)
+
+def get_cluster_message(log_entry):
+    """Return the part of a log line to mine a template from: the message of a structured line, else the line."""
+    if log_entry.lstrip().startswith('{'):
+        fields = parse_structured_fields(log_entry)
+        for name in MESSAGE_FIELDS:
+            if isinstance(fields.get(name), str):
+                return fields[name]
+    return log_entry
+
+def iter_cluster_rows(miner):
+    """Yield a row dict per cluster, the most frequent first."""
+    for cluster in sorted(miner.clusters.values(), key=lambda cluster: (-cluster.count, cluster.first_seen)):
+        yield {
+            "count": cluster.count,
+            "first_seen": datetime.datetime.fromtimestamp(cluster.first_seen / 1e9).isoformat(),
+            "last_seen": datetime.datetime.fromtimestamp(cluster.last_seen / 1e9).isoformat(),
+            "components": ",".join(sorted(cluster.components)),
+            "pods": ",".join(sorted(cluster.pods)),
+            "pattern": " ".join(cluster.template),
+            "sample": cluster.sample.replace('\r', ' ').replace('\n', ' '),
+        }
+
+# Field names for --cluster CSV output
+CLUSTER_CSV_FIELDNAMES = ["count", "first_seen", "last_seen", "components", "pods", "pattern", "sample"]
+
+def query_clusters(args):
+    """Stream the query's log lines through the --cluster miner and print one row per pattern."""
+    if args.index:
+        entries = iter_index_entries(args)
+    elif ',' in args.namespace:
+        entries = iter_namespace_entries(args)
+    else:
+        entries = iter_entries(iter_log_pages(args))
+    stats = get_stats(args)
+    if stats:
+        entries = stats.iter_timed(entries)
+    
+    miner = LogClusterMiner(args.cluster_similarity, args.cluster_depth, args.cluster_max)
+    for timestamp, log_entry, labels in entries:
+        miner.add(get_cluster_message(log_entry), int(timestamp), labels, log_entry)
+    
+    if miner.evicted:
+        print(f"Warning: dropped the {miner.evicted} least recently seen pattern(s) and the counts of their "
+              f"{miner.evicted_lines} lines to stay within --cluster-max {args.cluster_max}; raise it to keep them",
+              file=sys.stderr)
+    if not miner.clusters:
+        print("No logs found for the specified criteria")
+        return 0
+    
+    rows = iter_cluster_rows(miner)
+    if args.output == 'json':
+        print(json.dumps(list(rows), indent=2))
+    elif args.output == 'ndjson':
+        for row in rows:
+            sys.stdout.write(json.dumps(row) + "\n")
+    elif args.output == 'csv':
+        if args.csv_file:
+            with open(args.csv_file, 'w', newline='', encoding='utf-8') as f:
+                row_count = write_csv_rows(f, rows, CLUSTER_CSV_FIELDNAMES)
+            print(f"CSV output written to {args.csv_file} ({row_count} patterns)")
+        else:
+            write_csv_rows(sys.stdout, rows, CLUSTER_CSV_FIELDNAMES)
+    else:
+        for row in rows:
+            print(f"{row['count']:>8}  {row['first_seen'][:19]} .. {row['last_seen'][:19]}  [{row['components']}]  {row['pattern']}")
+    return 0
+
+def run_instrumented(args):
+    """Run query_loki_logs, under cProfile with --profile, and write the --stats report at the end."""
+    get_stats(args)
+    profiler = cProfile.Profile() if args.profile else None
+    try:
+        if profiler:
+            return profiler.runcall(query_loki_logs, args)
+        return query_loki_logs(args)
+    finally:
+        # Also report on runs that failed or were interrupted, that is when it matters most
+        if profiler:
+            if args.profile == '-':
+                # Only the main thread is profiled; with --workers > 1 fetching shows up as waiting
+                pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(PROFILE_TOP_FUNCTIONS)
+            else:
+                profiler.dump_stats(args.profile)
+                print(f"Profile written to {args.profile}", file=sys.stderr)
+        if _stats:
+            report = json.dumps(_stats.get_report(), indent=2)
+            if args.stats == '-':
+                print(report, file=sys.stderr)
+            else:
+                with open(args.stats, 'w', encoding='utf-8') as f:
+                    f.write(report + "\n")
 
 if __name__ == "__main__":
     args = setup_arg_parser()
-    sys.exit(query_loki_logs(args)) 
\ No newline at end of file
+    try:
+        sys.exit(run_instrumented(args))
+    except LokiQueryError as e:
+        print(f"Error querying Loki: {e}", file=sys.stderr)
+        print("The output is incomplete.", file=sys.stderr)
+        sys.exit(1)
+    except BrokenPipeError:
+        # Output is streamed, so piping into e.g. `head` closes stdout early
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(0)
@@ -7,17 +7,28 @@ secrets/backend-secrets-<env>.yaml in the format secret-manager.sh expects.
 Secret VALUES are never printed — only key names + count, so the transcript
 stays clean. Run before adding a new key so a reseal won't purge anything.
 
-Usage: python3 scripts/reconstruct-secrets.py <dev|testing|prod> [--comments]
+Usage: python3 scripts/reconstruct-secrets.py <dev|testing|prod|all> [--comments] [--diff]
+
+`all` fetches every environment in ENVS concurrently. A file whose keys and
+values already match the cluster is left untouched.
 
 --comments decodes each value and writes it as `# <plaintext>` comment lines
 above the key (matching secret-manager.sh's human-readable format). Multi-line
 values get one comment line per line so the YAML stays valid. Decoded values
 are still only written to the file, never printed.
+
+--diff writes nothing. It compares each live Secret with the existing local
+file, and with more than one environment, the environments with each other.
+Values are compared by hash, and neither values nor hashes are printed: keys
+are listed with a letter per environment, where the same letter means the
+same value.
 """
 import sys
 import json
 import base64
+import hashlib
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 
 ENVS = {
     "dev": ("do-ams3-dbr-echo-dev-k8s-cluster", "echo-dev"),
@@ -25,28 +36,45 @@ ENVS = {
     "prod": ("do-ams3-dbr-echo-prod-k8s-cluster", "echo-prod"),
 }
 
-def main() -> int:
-    argv = sys.argv[1:]
-    comments = "--comments" in argv
-    argv = [a for a in argv if a != "--comments"]
-    if len(argv) != 1 or argv[0] not in ENVS:
-        print("usage: reconstruct-secrets.py <dev|testing|prod> [--comments]")
-        return 2
-    env = argv[0]
+def fetch_secret(env):
+    """Return (data, error) for the live Secret of env."""
     ctx, ns = ENVS[env]
-
     out = subprocess.run(
         ["kubectl", "--context", ctx, "get", "secret",
          "echo-backend-secrets", "-n", ns, "-o", "json"],
         capture_output=True, text=True,
     )
     if out.returncode != 0:
-        sys.stderr.write(out.stderr)
-        return 1
+        return None, out.stderr
+    return json.loads(out.stdout).get("data", {}), None
+
+def read_local(path):
+    """(key -> base64 value, raw text) of a file we wrote, or (None, None)."""
+    try:
+        with open(path) as f:
+            text = f.read()
+    except FileNotFoundError:
+        return None, None
+    data = {}
+    in_data = False
+    for line in text.splitlines():
+        if line == "data:":
+            in_data = True
+        elif in_data and line.startswith("  ") and not line.lstrip().startswith("#"):
+            k, _, v = line.strip().partition(":")
+            data[k] = v.strip()
+    return data, text
 
-    data = json.loads(out.stdout).get("data", {})
-    keys = sorted(data)
+def value_hash(value):
+    # hash the decoded bytes so two encodings of the same value compare equal
+    try:
+        raw = base64.b64decode(value)
+    except ValueError:
+        raw = value.encode()
+    return hashlib.sha256(raw).digest()
 
+def render(env, data, comments):
+    _, ns = ENVS[env]
     lines = [
         "apiVersion: v1",
         "kind: Secret",
@@ -57,7 +85,7 @@ def main() -> int:
         "data:",
     ]
     # values are already base64 in .data; write verbatim, never print them
-    for k in keys:
+    for k in sorted(data):
         if comments:
             try:
                 plain = base64.b64decode(data[k]).decode("utf-8")
@@ -67,15 +95,110 @@ def main() -> int:
             except (ValueError, UnicodeDecodeError):
                 lines.append("  # <binary value, not shown>")
         lines.append(f"  {k}: {data[k]}")
+    return "\n".join(lines) + "\n"
+
+def diff_keys(old, new):
+    """(added, removed, changed) key lists going from old to new."""
+    added = sorted(set(new) - set(old))
+    removed = sorted(set(old) - set(new))
+    changed = sorted(k for k in set(old) & set(new)
+                     if value_hash(old[k]) != value_hash(new[k]))
+    return added, removed, changed
+
+def print_local_diff(env, path, live, local):
+    if local is None:
+        print(f"{env}: no local file at {path} ({len(live)} live keys)")
+        return
+    added, removed, changed = diff_keys(local, live)
+    if not (added or removed or changed):
+        print(f"{env}: {path} matches the cluster ({len(live)} keys)")
+        return
+    print(f"{env}: {path} differs from the cluster: "
+          f"{len(added)} only live, {len(removed)} only local, {len(changed)} changed")
+    for marker, keys in (("+", added), ("-", removed), ("~", changed)):
+        for k in keys:
+            print(f"  {marker} {k}")
+
+def print_env_matrix(live):
+    """Keys that are missing somewhere or whose values differ across envs.
+
+    Each environment gets a letter per distinct value of a key (same letter,
+    same value) and `-` where the key is missing, so equality is visible
+    without showing values or hashes.
+    """
+    envs = list(live)
+    rows = []
+    for k in sorted(set().union(*live.values())):
+        letters = {}
+        cells = []
+        for env in envs:
+            if k not in live[env]:
+                cells.append("-")
+                continue
+            h = value_hash(live[env][k])
+            letters.setdefault(h, "abcdefghijklmnopqrstuvwxyz"[len(letters)])
+            cells.append(letters[h])
+        # hide the normal case: present everywhere with a distinct value each
+        if len(letters) < len(envs):
+            rows.append((k, cells))
+    if not rows:
+        print(f"across {', '.join(envs)}: same keys, all values differ")
+        return
+    width = max(len(k) for k, _ in rows)
+    print("across environments (same letter = same value, - = missing):")
+    print(f"  {'key':<{width}}  " + "  ".join(f"{e:^7}" for e in envs))
+    for k, cells in rows:
+        print(f"  {k:<{width}}  " + "  ".join(f"{c:^7}" for c in cells))
+
+def main() -> int:
+    argv = sys.argv[1:]
+    comments = "--comments" in argv
+    diff = "--diff" in argv
+    argv = [a for a in argv if a not in ("--comments", "--diff")]
+    if len(argv) != 1 or argv[0] not in (*ENVS, "all"):
+        print("usage: reconstruct-secrets.py <dev|testing|prod|all> [--comments] [--diff]")
+        return 2
+    envs = list(ENVS) if argv[0] == "all" else argv
+
+    # kubectl is the slow part; run one per context in parallel
+    with ThreadPoolExecutor(max_workers=len(envs)) as pool:
+        results = dict(zip(envs, pool.map(fetch_secret, envs)))
+
+    status = 0
+    live = {}
+    for env in envs:
+        data, err = results[env]
+        if err is not None:
+            sys.stderr.write(f"{env}: kubectl failed\n{err}")
+            status = 1
+            continue
+        live[env] = data
+
+    for env, data in live.items():
+        path = f"secrets/backend-secrets-{env}.yaml"
+        local, text = read_local(path)
+        if diff:
+            print_local_diff(env, path, data, local)
+            continue
+
+        keys = sorted(data)
+        new_text = render(env, data, comments)
+        unchanged = local is not None and not any(diff_keys(local, data))
+        # an unchanged file is kept as is (including any comments in it)
+        # unless --comments asks for a different rendering
+        if text == new_text or unchanged and not comments:
+            print(f"{env}: {len(keys)} keys unchanged, not rewriting {path}")
+            continue
+        with open(path, "w") as f:
+            f.write(new_text)
 
-    path = f"secrets/backend-secrets-{env}.yaml"
-    with open(path, "w") as f:
-        f.write("\n".join(lines) + "\n")
+        print(f"{env}: wrote {len(keys)} keys -> {path}")
+        for k in keys:
+            print(f"  {k}")
 
-    print(f"{env}: wrote {len(keys)} keys -> {path}")
-    for k in keys:
-        print(f"  {k}")
-    return 0
+    if diff and len(live) > 1:
+        print_env_matrix(live)
+    return status
 
 if __name__ == "__main__":
     raise SystemExit(main())
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The scripts are not a package; make them importable by module name
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SCRIPTS_DIR)
+sys.path.insert(0, os.path.join(SCRIPTS_DIR, "k6"))
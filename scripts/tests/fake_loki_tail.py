@@ -0,0 +1,110 @@
+"""A fake of Loki's websocket tail endpoint that keeps dropping the connection.
+
+The server has a fixed list of entries for two streams, with pairs of lines
+sharing a timestamp. With lag_steps, the second stream delivers its lines that
+many timestamp steps behind the first. Like Loki, every connection replays the entries from its
+`start` parameter on (inclusive). Each of the first `drops` connections is cut
+after `batch` messages, alternating between a clean close frame and just
+closing the socket, and the cut lands between the two lines of a pair. The
+connection after that sends the rest and stays open.
+
+Only the server side of RFC 6455 that a tail needs is implemented: the
+handshake, unmasked text frames and a close frame. Whatever the client sends
+is never parsed.
+"""
+import base64
+import contextlib
+import hashlib
+import json
+import socketserver
+import threading
+from urllib.parse import parse_qs, urlparse
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+TIMESTAMP_STEP_NS = 1_000_000
+STREAMS = ({"namespace": "echo-dev", "pod": "api-a"}, {"namespace": "echo-dev", "pod": "api-b"})
+
+def make_entries(base_ns, count, lag_steps=0):
+    """Return count (stream, timestamp, line) entries from base_ns on, two lines per stream and timestamp."""
+    entries = []
+    for i in range(count):
+        stream = STREAMS[i // 2 % 2]
+        ts = base_ns + (i // 4 + (lag_steps if stream is STREAMS[0] else 0)) * TIMESTAMP_STEP_NS
+        entries.append((stream, ts, f"{stream['pod']} line {i}"))
+    return entries
+
+def encode_frame(opcode, payload):
+    """Encode an unmasked, unfragmented server frame."""
+    header = bytes([0x80 | opcode])
+    if len(payload) < 126:
+        header += bytes([len(payload)])
+    elif len(payload) < 1 << 16:
+        header += bytes([126]) + len(payload).to_bytes(2, "big")
+    else:
+        header += bytes([127]) + len(payload).to_bytes(8, "big")
+    return header + payload
+
+class FakeTailHandler(socketserver.StreamRequestHandler):
+    """Serves one tail connection from server.entries."""
+
+    def handle(self):
+        request_line = self.rfile.readline().decode("latin-1")
+        headers = {}
+        for line in iter(self.rfile.readline, b"\r\n"):
+            if not line:
+                return
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        accept = base64.b64encode(hashlib.sha1((headers["sec-websocket-key"] + WEBSOCKET_GUID).encode()).digest())
+        self.wfile.write(b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                         b"Sec-WebSocket-Accept: " + accept + b"\r\n\r\n")
+
+        params = {name: values[0] for name, values in parse_qs(urlparse(request_line.split()[1]).query).items()}
+        start = int(params["start"])
+        server = self.server
+        with server.lock:
+            if not server.entries:
+                server.entries = make_entries(start, server.entry_count, server.lag_steps)
+            server.starts.append(start)
+            connection = len(server.starts)
+
+        sent = 0
+        for stream, ts, line in server.entries:
+            if ts < start:
+                continue
+            message = {"streams": [{"stream": stream, "values": [[str(ts), line]]}]}
+            self.wfile.write(encode_frame(0x1, json.dumps(message).encode("utf-8")))
+            sent += 1
+            if connection <= server.drops and sent == server.batch:
+                if connection % 2:
+                    self.wfile.write(encode_frame(0x8, b""))
+                return
+        # The last connection stays open until the client starts its close handshake
+        self.rfile.read(1)
+
+class FakeTailServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, entry_count=40, batch=7, drops=4, lag_steps=0):
+        super().__init__(("127.0.0.1", 0), FakeTailHandler)
+        self.entry_count = entry_count
+        self.lag_steps = lag_steps
+        self.batch = batch
+        self.drops = drops
+        self.entries = []
+        self.starts = []
+        self.lock = threading.Lock()
+
+@contextlib.contextmanager
+def fake_loki_tail(**options):
+    """Run a FakeTailServer in a thread and yield it; its URL is server.url."""
+    server = FakeTailServer(**options)
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
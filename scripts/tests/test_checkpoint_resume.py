@@ -0,0 +1,109 @@
+import contextlib
+import http.server
+import json
+import threading
+
+import pytest
+
+import bench_query_logs
+import query_logs
+from bench_query_logs import make_fake_config
+
+class FailingFakeLokiHandler(bench_query_logs.FakeLokiHandler):
+    """The benchmark's fake Loki, answering 500 to every request after the first server.fail_after."""
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests += 1
+            failing = self.server.fail_after is not None and self.server.requests > self.server.fail_after
+        if failing:
+            self.send_error(500)
+            return
+        super().do_GET()
+
+@contextlib.contextmanager
+def fake_loki(config, fail_after=None):
+    """Run the fake Loki in a thread and yield its URL."""
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FailingFakeLokiHandler)
+    server.daemon_threads = True
+    server.config = config
+    server.responses = {}
+    server.fail_after = fail_after
+    server.requests = 0
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def export(url, csv_file, *options):
+    args = bench_query_logs.make_query_args(url, bench_query_logs.PIPELINE_HOURS, "--output", "csv", "--csv-file", str(csv_file),
+                                            "--checkpoint", "--retries", "0", *options)
+    bench_query_logs.reset_query_logs()
+    return query_logs.query_loki_logs(args)
+
+def load_manifest(csv_file):
+    with open(query_logs.get_manifest_path(str(csv_file)), encoding="utf-8") as f:
+        return json.load(f)
+
+# 1080 entries in three one-hour chunks: eight pages of 50 per chunk
+@pytest.mark.parametrize("options, fail_after", [
+    (["--paginate", "--limit", "50"], 5),
+    (["--paginate", "--limit", "50", "--workers", "2"], 18),
+    (["--limit", "100000"], 2),
+], ids=["mid-chunk", "parallel-chunks", "whole-chunks"])
+def test_resumed_export_is_identical_to_an_uninterrupted_one(tmp_path, options, fail_after):
+    config = make_fake_config(interval_ns=60 * 10**9, streams=3, repeats=2)
+    full_csv = tmp_path / "full.csv"
+    resumed_csv = tmp_path / "resumed.csv"
+
+    with fake_loki(config) as url:
+        assert export(url, full_csv, *options) == 0
+    with fake_loki(config, fail_after=fail_after) as url:
+        with pytest.raises(query_logs.LokiQueryError):
+            export(url, resumed_csv, *options)
+    interrupted = load_manifest(resumed_csv)
+    assert not interrupted["complete"]
+    assert 0 < interrupted["entries"] < 1080
+    # Sequential pagination stops inside a chunk, the others between chunks
+    assert bool(interrupted["cursor"]) == ("--workers" not in options and "--paginate" in options)
+
+    with fake_loki(config) as url:
+        assert export(url, resumed_csv, "--resume", *options) == 0
+
+    assert resumed_csv.read_bytes() == full_csv.read_bytes()
+    manifest = load_manifest(resumed_csv)
+    assert manifest["complete"]
+    assert manifest["next_chunk"] == len(manifest["chunks"])
+    assert manifest["cursor"] is None
+    assert manifest["offset"] == resumed_csv.stat().st_size
+    assert manifest["entries"] == load_manifest(full_csv)["entries"] == 3 * 60 * 3 * 2
+
+def test_resume_drops_rows_written_after_the_last_checkpoint(tmp_path, monkeypatch):
+    config = make_fake_config(interval_ns=60 * 10**9, streams=3, repeats=2)
+    options = ["--paginate", "--limit", "50"]
+    full_csv = tmp_path / "full.csv"
+    resumed_csv = tmp_path / "resumed.csv"
+    with fake_loki(config) as url:
+        assert export(url, full_csv, *options) == 0
+
+        # Killed after a page is written to the CSV but before its checkpoint is saved
+        save_export_manifest = query_logs.save_export_manifest
+        saves = []
+        def killed_on_fifth_save(manifest_path, manifest):
+            saves.append(manifest_path)
+            if len(saves) == 5:
+                raise KeyboardInterrupt
+            save_export_manifest(manifest_path, manifest)
+        monkeypatch.setattr(query_logs, "save_export_manifest", killed_on_fifth_save)
+        with pytest.raises(KeyboardInterrupt):
+            export(url, resumed_csv, *options)
+        monkeypatch.setattr(query_logs, "save_export_manifest", save_export_manifest)
+        assert resumed_csv.stat().st_size > load_manifest(resumed_csv)["offset"]
+
+        assert export(url, resumed_csv, "--resume", *options) == 0
+
+    assert resumed_csv.read_bytes() == full_csv.read_bytes()
+    assert load_manifest(resumed_csv)["complete"]
@@ -0,0 +1,27 @@
+import query_logs
+from bench_query_logs import make_query_args
+
+LABELS = {"app_kubernetes_io_component": "api", "pod": "api-1"}
+# Three patterns: one frequent early on, then two that are seen once each
+LINES = ["cache warmed for tenant a"] * 5 + ["upload of chunk started", "transcription job queued for worker"]
+
+def test_cluster_max_drops_the_least_recently_seen_pattern_and_its_count():
+    miner = query_logs.LogClusterMiner(max_clusters=2)
+    for i, line in enumerate(LINES):
+        miner.add(line, i, LABELS, line)
+
+    assert sorted(" ".join(cluster.template) for cluster in miner.clusters.values()) == [
+        "transcription job queued for worker", "upload of chunk started",
+    ]
+    assert (miner.evicted, miner.evicted_lines) == (1, 5)
+
+def test_cluster_max_warning_says_what_was_dropped(monkeypatch, capsys):
+    args = make_query_args("http://127.0.0.1:9", 1, "--cluster", "--cluster-max", "2")
+    monkeypatch.setattr(query_logs, "iter_log_pages", lambda args: None)
+    monkeypatch.setattr(query_logs, "iter_entries", lambda pages: [(str(i), line, LABELS) for i, line in enumerate(LINES)])
+
+    assert query_logs.query_clusters(args) == 0
+    captured = capsys.readouterr()
+    assert ("dropped the 1 least recently seen pattern(s) and the counts of their 5 lines "
+            "to stay within --cluster-max 2") in captured.err
+    assert "cache warmed" not in captured.out
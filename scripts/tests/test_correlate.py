@@ -0,0 +1,32 @@
+import query_logs
+
+CONVERSATION_ID = "5fd8d61f-706c-4397-8411-b22ca5e387c6"
+API = {"app_kubernetes_io_component": "api"}
+WORKER = {"app_kubernetes_io_component": "worker"}
+
+def make_index(lines):
+    index = query_logs.CorrelationIndex()
+    for i, (labels, line) in enumerate(lines):
+        index.add(str(1_700_000_000_000_000_000 + i * 10**6), line, labels)
+    return index
+
+def test_lookup_finds_ids_embedded_in_longer_words():
+    index = make_index([
+        (API, f'{{"level": "info", "msg": "initiated", "conversation_id": "{CONVERSATION_ID}"}}'),
+        (API, f"uploaded chunks/{CONVERSATION_ID}_000.webm"),
+        (WORKER, f"task transcribe started for conv_{CONVERSATION_ID}"),
+        (WORKER, "task transcribe started for conv_6ffc71e4-4d14-4075-8d1b-7d1c2d5a0b1e"),
+    ])
+    assert index.offsets[CONVERSATION_ID] == [0]
+    assert index.lookup(CONVERSATION_ID) == [0, 1, 2]
+    # Cached lookups stay complete as the pull goes on
+    index.add("1700000000100000000", f"transcribed conv_{CONVERSATION_ID}", WORKER)
+    assert index.lookup(CONVERSATION_ID) == [0, 1, 2, 4]
+
+    timeline = query_logs.build_correlation_timeline(index, CONVERSATION_ID)
+    assert len(timeline["entries"]) == 4
+
+def test_lookup_of_an_unindexed_string_scans_once():
+    index = make_index([(API, "POST /api/participant/upload-chunk 200"), (WORKER, "upload-chunk done")])
+    assert index.lookup("upload-chunk") == [0, 1]
+    assert index.lookup("missing") == []
@@ -0,0 +1,38 @@
+import json
+
+import pytest
+
+import query_logs
+from bench_query_logs import (PIPELINE_HOURS, fake_loki, get_fake_labels, iter_fake_entries, make_fake_config,
+                              make_query_args, reset_query_logs)
+
+# Layouts that pagination has to get exactly right: (description, fake config, query_logs options).
+# Timestamps are a minute apart, so the one-hour chunk boundaries land on them.
+PAGINATION_CASES = [
+    ("timestamps shared by every stream", make_fake_config(interval_ns=60 * 10**9, streams=5, shared_timestamps=True), ["--paginate", "--limit", "7"]),
+    ("timestamps repeated within a stream", make_fake_config(interval_ns=60 * 10**9, streams=2, repeats=3), ["--paginate", "--limit", "4"]),
+    ("page size equal to the lines per timestamp", make_fake_config(interval_ns=60 * 10**9, streams=3, repeats=2, shared_timestamps=True), ["--paginate", "--limit", "6"]),
+    ("page size of one", make_fake_config(interval_ns=300 * 10**9, streams=2), ["--paginate", "--limit", "1"]),
+    ("parallel chunks", make_fake_config(interval_ns=60 * 10**9, streams=4, shared_timestamps=True), ["--paginate", "--limit", "9", "--workers", "3"]),
+    ("chunks without pagination", make_fake_config(interval_ns=60 * 10**9, streams=4), ["--limit", "100000"]),
+]
+
+@pytest.mark.parametrize("config, options", [case[1:] for case in PAGINATION_CASES], ids=[case[0] for case in PAGINATION_CASES])
+def test_pagination_returns_every_entry_once_in_order(config, options):
+    with fake_loki(config) as url:
+        query_args = make_query_args(url, PIPELINE_HOURS, *options)
+        start_time, end_time = query_logs.get_time_range(query_args)
+        labels = get_fake_labels(config)
+        expected = [
+            (timestamp, json.dumps(labels[stream_index], sort_keys=True), line)
+            for timestamp, stream_index, line in iter_fake_entries(config, int(start_time), int(end_time))
+        ]
+        reset_query_logs()
+        actual = [
+            (int(timestamp), json.dumps(entry_labels, sort_keys=True), line)
+            for timestamp, line, entry_labels in query_logs.iter_entries(query_logs.iter_log_pages(query_args))
+        ]
+
+    assert len(set(actual)) == len(actual), "duplicate entries"
+    assert set(actual) == set(expected)
+    assert [entry[0] for entry in actual] == sorted(entry[0] for entry in actual)
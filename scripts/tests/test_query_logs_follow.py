@@ -0,0 +1,66 @@
+import sys
+import threading
+
+import pytest
+
+import query_logs
+from fake_loki_tail import TIMESTAMP_STEP_NS, fake_loki_tail
+
+def make_follow_args(monkeypatch, url):
+    monkeypatch.setattr(sys, "argv", ["query_logs.py", "--url", url, "--namespace", "echo-dev", "--follow", "--output", "ndjson"])
+    return query_logs.setup_arg_parser()
+
+def collect_tail(args, count, timeout=30):
+    """Return the (pod, timestamp, line) of the first count tailed entries, or fewer if none come in within timeout."""
+    received = []
+    pages = query_logs.iter_tail_pages(args)
+
+    def consume():
+        for page in pages:
+            for stream in page:
+                received.extend((stream["stream"]["pod"], int(ts), line) for ts, line in stream["values"])
+            if len(received) >= count:
+                return
+
+    thread = threading.Thread(target=consume, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if not thread.is_alive():
+        pages.close()
+    return received
+
+def test_follow_reconnects_without_losing_or_duplicating_lines(monkeypatch):
+    pytest.importorskip("websocket")
+    monkeypatch.setattr(query_logs, "FOLLOW_RECONNECT_MIN_SECONDS", 0)
+    monkeypatch.setattr(query_logs, "FOLLOW_RESUME_OVERLAP_SECONDS", 0)
+    with fake_loki_tail(entry_count=40, batch=7, drops=4) as server:
+        args = make_follow_args(monkeypatch, server.url)
+        received = collect_tail(args, 40)
+        expected = [(stream["pod"], ts, line) for stream, ts, line in server.entries]
+
+    assert len(server.starts) == 5
+    # Every reconnect resumes from a timestamp whose pair was cut in half
+    assert len(set(server.starts)) == 5
+    assert received == expected
+
+def test_follow_reconnects_without_losing_lines_of_a_lagging_stream(monkeypatch):
+    pytest.importorskip("websocket")
+    monkeypatch.setattr(query_logs, "FOLLOW_RECONNECT_MIN_SECONDS", 0)
+    # api-b runs 3 steps behind api-a: every cut leaves api-b lines older than
+    # the newest api-a line undelivered, which the overlap has to cover
+    monkeypatch.setattr(query_logs, "FOLLOW_RESUME_OVERLAP_SECONDS", 3 * TIMESTAMP_STEP_NS / 1e9)
+    with fake_loki_tail(entry_count=60, batch=12, drops=4, lag_steps=3) as server:
+        args = make_follow_args(monkeypatch, server.url)
+        received = collect_tail(args, 60)
+        expected = [(stream["pod"], ts, line) for stream, ts, line in server.entries]
+
+    assert len(server.starts) == 5
+    assert received == expected
+
+def test_follow_without_websocket_client_exits_with_error(monkeypatch, capsys):
+    monkeypatch.setitem(sys.modules, "websocket", None)
+    args = make_follow_args(monkeypatch, "http://127.0.0.1:1")
+    with pytest.raises(SystemExit) as excinfo:
+        next(query_logs.iter_tail_pages(args))
+    assert excinfo.value.code == 1
+    assert "requires websocket-client" in capsys.readouterr().err
@@ -0,0 +1,130 @@
+import base64
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+SCRIPT = os.path.join(os.path.dirname(__file__), "..", "reconstruct-secrets.py")
+spec = importlib.util.spec_from_file_location("reconstruct_secrets", SCRIPT)
+reconstruct_secrets = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(reconstruct_secrets)
+
+# Answers `get secret` with clusters/<context>.json. With KUBECTL_STUB_BARRIER=n,
+# every call waits for n calls to have started, so sequential fetches fail.
+KUBECTL_STUB = """#!{python}
+import os, sys, time
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+context = sys.argv[sys.argv.index("--context") + 1]
+started = os.path.join(root, "started")
+os.makedirs(started, exist_ok=True)
+open(os.path.join(started, context), "w").close()
+deadline = time.monotonic() + 10
+while len(os.listdir(started)) < int(os.environ.get("KUBECTL_STUB_BARRIER", "1")):
+    if time.monotonic() > deadline:
+        sys.exit("kubectl stub: calls did not overlap")
+    time.sleep(0.01)
+try:
+    with open(os.path.join(root, "clusters", context + ".json")) as f:
+        sys.stdout.write(f.read())
+except FileNotFoundError:
+    sys.exit(f"error: context {{context}} does not exist")
+"""
+
+def b64(value):
+    return base64.b64encode(value.encode()).decode()
+
+@pytest.fixture
+def clusters(tmp_path):
+    """Put a kubectl stub in tmp_path/bin and return a function setting the live Secret of an env."""
+    (tmp_path / "bin").mkdir()
+    (tmp_path / "clusters").mkdir()
+    (tmp_path / "secrets").mkdir()
+    kubectl = tmp_path / "bin" / "kubectl"
+    kubectl.write_text(KUBECTL_STUB.format(python=sys.executable))
+    kubectl.chmod(0o755)
+
+    def set_cluster(env, plain):
+        context, _ = reconstruct_secrets.ENVS[env]
+        secret = {"kind": "Secret", "data": {k: b64(v) for k, v in plain.items()}}
+        (tmp_path / "clusters" / f"{context}.json").write_text(json.dumps(secret))
+    return set_cluster
+
+def run(tmp_path, *args, barrier=1):
+    for marker in (tmp_path / "started").glob("*"):
+        marker.unlink()
+    env = dict(os.environ, PATH=f"{tmp_path / 'bin'}{os.pathsep}{os.environ['PATH']}", KUBECTL_STUB_BARRIER=str(barrier))
+    return subprocess.run([sys.executable, os.path.abspath(SCRIPT), *args], cwd=tmp_path, env=env,
+                          capture_output=True, text=True, timeout=60)
+
+def test_all_fetches_every_environment_in_parallel(tmp_path, clusters):
+    for env in reconstruct_secrets.ENVS:
+        clusters(env, {"DATABASE_URL": f"postgres://{env}", "API_KEY": f"key-{env}"})
+
+    result = run(tmp_path, "all", barrier=len(reconstruct_secrets.ENVS))
+    assert result.returncode == 0, result.stderr
+    for env in reconstruct_secrets.ENVS:
+        path = tmp_path / "secrets" / f"backend-secrets-{env}.yaml"
+        assert path.read_text().endswith(f"data:\n  API_KEY: {b64('key-' + env)}\n  DATABASE_URL: {b64('postgres://' + env)}\n")
+        assert f"{env}: wrote 2 keys -> secrets/backend-secrets-{env}.yaml" in result.stdout
+    assert "key-dev" not in result.stdout
+
+def test_failed_environment_does_not_stop_the_others(tmp_path, clusters):
+    clusters("dev", {"API_KEY": "key-dev"})
+    clusters("prod", {"API_KEY": "key-prod"})
+
+    result = run(tmp_path, "all")
+    assert result.returncode == 1
+    assert "testing: kubectl failed" in result.stderr
+    assert sorted(path.name for path in (tmp_path / "secrets").iterdir()) == [
+        "backend-secrets-dev.yaml", "backend-secrets-prod.yaml",
+    ]
+
+def test_diff_compares_local_files_and_environments_without_values(tmp_path, clusters):
+    clusters("dev", {"SHARED": "shared-value", "REGION": "eu", "SENTRY_DSN": "dsn-dev", "TOKEN": "t-dev"})
+    clusters("testing", {"SHARED": "shared-value", "REGION": "us", "TOKEN": "t-testing"})
+    clusters("prod", {"SHARED": "shared-value", "REGION": "eu", "SENTRY_DSN": "dsn-prod", "TOKEN": "t-prod"})
+    assert run(tmp_path, "dev").returncode == 0
+    assert run(tmp_path, "testing").returncode == 0
+    clusters("testing", {"SHARED": "shared-value", "REGION": "ap", "TOKEN": "t-testing", "NEW_KEY": "new"})
+    before = {path.name: path.read_text() for path in (tmp_path / "secrets").iterdir()}
+
+    result = run(tmp_path, "all", "--diff")
+    assert result.returncode == 0, result.stderr
+    lines = result.stdout.splitlines()
+    assert "dev: secrets/backend-secrets-dev.yaml matches the cluster (4 keys)" in lines
+    assert "testing: secrets/backend-secrets-testing.yaml differs from the cluster: 1 only live, 0 only local, 1 changed" in lines
+    assert "  + NEW_KEY" in lines and "  ~ REGION" in lines
+    assert "prod: no local file at secrets/backend-secrets-prod.yaml (4 live keys)" in lines
+    matrix = lines[lines.index("across environments (same letter = same value, - = missing):") + 2:]
+    assert [line.split() for line in matrix] == [
+        ["NEW_KEY", "-", "a", "-"],
+        ["REGION", "a", "b", "a"],
+        ["SENTRY_DSN", "a", "-", "b"],
+        ["SHARED", "a", "a", "a"],
+    ]
+    for secret in ("shared-value", "dsn-dev", "t-prod", b64("shared-value"), b64("t-prod")):
+        assert secret not in result.stdout
+    assert {path.name: path.read_text() for path in (tmp_path / "secrets").iterdir()} == before
+
+def test_unchanged_file_is_not_rewritten(tmp_path, clusters):
+    clusters("dev", {"API_KEY": "key-dev", "PEM": "line one\nline two"})
+    assert run(tmp_path, "dev", "--comments").returncode == 0
+    path = tmp_path / "secrets" / "backend-secrets-dev.yaml"
+    text = path.read_text()
+    assert "  # line one\n  # line two\n  PEM: " in text
+    os.utime(path, (1_000_000_000, 1_000_000_000))
+
+    # Without --comments the rendering would differ, but the keys and values match
+    result = run(tmp_path, "dev")
+    assert result.returncode == 0, result.stderr
+    assert result.stdout == "dev: 2 keys unchanged, not rewriting secrets/backend-secrets-dev.yaml\n"
+    assert path.read_text() == text
+    assert path.stat().st_mtime == 1_000_000_000
+
+    clusters("dev", {"API_KEY": "rotated", "PEM": "line one\nline two"})
+    result = run(tmp_path, "dev")
+    assert "dev: wrote 2 keys -> secrets/backend-secrets-dev.yaml" in result.stdout
+    assert path.stat().st_mtime != 1_000_000_000
@@ -0,0 +1,55 @@
+import asyncio
+import sys
+
+import pytest
+
+import replay_chunks
+
+@pytest.mark.parametrize("pool_idle_seconds", [replay_chunks.POOL_IDLE_SECONDS, 0.1], ids=["retry", "expire"])
+def test_builtin_client_survives_server_keepalive_timeout(monkeypatch, capsys, pool_idle_seconds):
+    # Uploads are 0.5s apart and the stub drops the first request on a
+    # connection idle for 0.2s: every reused connection fails, unless it
+    # expires in the pool first
+    monkeypatch.setattr(replay_chunks, "POOL_IDLE_SECONDS", pool_idle_seconds)
+    monkeypatch.setattr(sys, "argv", [
+        "replay_chunks.py", "--stub", "--no-aiohttp", "--stub-latency", "0", "--stub-keepalive-timeout", "0.2",
+        "--end", "2", "--sleep", "0.5", "--conversations", "4", "--concurrency", "4",
+    ])
+    assert replay_chunks.main(replay_chunks.setup_arg_parser()) == 0
+    out = capsys.readouterr().out
+    assert "4 conversations" in out and "0 failed" in out
+    assert "statuses" not in out
+
+def test_builtin_client_records_a_response_cut_short(monkeypatch, capsys):
+    monkeypatch.setattr(sys, "argv", [
+        "replay_chunks.py", "--stub", "--no-aiohttp", "--stub-latency", "0", "--stub-truncate-rate", "1",
+        "--end", "0", "--sleep", "0", "--conversations", "3",
+    ])
+    assert replay_chunks.main(replay_chunks.setup_arg_parser()) == 1
+    out = capsys.readouterr().out
+    assert "3 conversations" in out and "3 failed" in out
+    assert "initiate statuses: IncompleteReadError: 3" in out
+
+def test_builtin_client_retries_a_reused_connection_closed_mid_body(monkeypatch):
+    monkeypatch.setattr(sys, "argv", ["replay_chunks.py", "--stub", "--stub-latency", "0"])
+    server = replay_chunks.start_stub_server(replay_chunks.setup_arg_parser())
+    # Only the first response after the switch is cut off: the one on the reused connection
+    cuts = iter([0.0, 0.99])
+    monkeypatch.setattr(replay_chunks.random, "random", lambda: next(cuts))
+
+    async def initiate_twice():
+        client = replay_chunks.HttpClient(f"http://127.0.0.1:{server.server_port}", 1, 5)
+        try:
+            first = await client.request("POST", "/conversations/initiate")
+            server.truncate_rate = 0.5
+            second = await client.request("POST", "/conversations/initiate")
+        finally:
+            await client.close()
+        return first[0], second[0]
+
+    try:
+        assert asyncio.run(initiate_twice()) == (200, 200)
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert next(cuts, None) is None
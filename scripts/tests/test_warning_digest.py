@@ -0,0 +1,135 @@
+import importlib.util
+import json
+import os
+
+import pytest
+
+# The warning digest CronJob mounts this file from a ConfigMap
+DIGEST_PATH = os.path.join(os.path.dirname(__file__), "..", "..", "helm", "monitoring", "files", "digest.py")
+STEP = 15
+ALERT = {"__name__": "ALERTS", "alertname": "HighLatency", "alertstate": "firing", "severity": "warning", "pod": "api-1"}
+SERIES_ID = json.dumps(tuple(sorted(ALERT.items())))
+
+@pytest.fixture
+def digest():
+    spec = importlib.util.spec_from_file_location("digest", DIGEST_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def fake_prometheus(digest, monkeypatch, firing):
+    """Answer ALERTS range queries with ALERT sampled at every step inside one of the [start, end) firing spans."""
+    def query_prom_range(promql, start, end, step):
+        values = [[t, "1"] for t in range(start, end + 1, step) if any(s <= t < e for s, e in firing)]
+        return [{"metric": ALERT, "values": values}] if values else []
+    monkeypatch.setattr(digest, "query_prom_range", query_prom_range)
+
+def fetch_series(digest, start, end):
+    return digest.merge_slices([digest.fetch_intervals(window, STEP) for window in digest.make_slices(start, end, STEP)])
+
+def test_slices_cover_the_range_on_the_step_grid(digest, monkeypatch):
+    monkeypatch.setattr(digest, "SLICE_HOURS", 1)
+    slices = digest.make_slices(0, 3 * 3600 + 100 * STEP, STEP)
+    assert slices[0][0] == 0 and slices[-1][1] == 3 * 3600 + 100 * STEP
+    assert all(end == next_start for (_, end), (next_start, _) in zip(slices, slices[1:]))
+    assert all(start % STEP == 0 and end - start <= 3600 for start, end in slices)
+
+def test_interval_crossing_a_slice_boundary_is_one_incident(digest, monkeypatch):
+    monkeypatch.setattr(digest, "SLICE_HOURS", 1)
+    # Fires from 00:50 to 01:20, across the 01:00 slice boundary
+    fake_prometheus(digest, monkeypatch, [(3000, 4800)])
+    series = fetch_series(digest, 0, 3 * 3600)
+    assert dict(series) == {tuple(sorted(ALERT.items())): [[3000, 4800]]}
+
+    by_name, still_open = digest.summarize(series, (0, 3 * 3600), {})
+    assert by_name["HighLatency"]["events"] == 1
+    assert by_name["HighLatency"]["seconds"] == by_name["HighLatency"]["longest"] == 1800
+    assert not by_name["HighLatency"]["ongoing"]
+    assert still_open == {}
+
+def test_interval_still_firing_at_the_end_of_the_window_stays_open(digest, monkeypatch):
+    monkeypatch.setattr(digest, "SLICE_HOURS", 1)
+    fake_prometheus(digest, monkeypatch, [(600, 1200), (9000, 20000)])
+    series = fetch_series(digest, 0, 3 * 3600)
+
+    by_name, still_open = digest.summarize(series, (0, 3 * 3600), {})
+    assert by_name["HighLatency"]["events"] == 2
+    assert by_name["HighLatency"]["seconds"] == 600 + 3 * 3600 - 9000
+    assert by_name["HighLatency"]["ongoing"]
+    assert still_open == {SERIES_ID: 9000}
+
+class FakeSlack:
+    """Stands in for urlopen, recording the text of every post."""
+
+    status = 200
+
+    def __init__(self):
+        self.posts = []
+
+    def __call__(self, req, timeout=None):
+        self.posts.append(json.loads(req.data)["text"])
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+@pytest.fixture
+def digest_job(digest, monkeypatch, tmp_path):
+    """The digest module with its state in tmp_path, a webhook secret and a fake Slack."""
+    webhook_path = tmp_path / "webhook-url"
+    webhook_path.write_text("https://hooks.slack.invalid/services/T0/B0/x\n")
+    monkeypatch.setattr(digest, "SLACK_WEBHOOK_PATH", str(webhook_path))
+    monkeypatch.setattr(digest, "STATE_PATH", str(tmp_path / "state.json"))
+    slack = FakeSlack()
+    monkeypatch.setattr(digest.urllib.request, "urlopen", slack)
+    digest.slack = slack
+    return digest
+
+def run_at(digest, monkeypatch, now):
+    monkeypatch.setattr(digest.time, "time", lambda: now)
+    return digest.main()
+
+def test_incident_open_at_the_end_of_a_run_carries_over_to_the_next(digest_job, monkeypatch):
+    digest = digest_job
+    first_end = 8 * 86400
+    # Starts ten minutes before the first run and ends half an hour into the second
+    fake_prometheus(digest, monkeypatch, [(first_end - 600, first_end + 1800)])
+
+    assert run_at(digest, monkeypatch, first_end) == 0
+    state = digest.load_state()
+    assert state["open"] == {SERIES_ID: first_end - 600}
+    assert state["runs"][-1]["alerts"]["HighLatency"]["events"] == 1
+
+    assert run_at(digest, monkeypatch, first_end + 3600) == 0
+    state = digest.load_state()
+    assert [run["start"] for run in state["runs"]] == [first_end - 7 * 86400, first_end]
+    second = state["runs"][-1]["alerts"]["HighLatency"]
+    # Same incident: no new event, and its length includes the part before this run
+    assert second["events"] == 0
+    assert second["seconds"] == 1800
+    assert second["longest"] == 2400
+    assert not second["ongoing"]
+    assert state["open"] == {}
+    assert len(digest.slack.posts) == 2
+
+def test_failed_state_write_after_a_post_still_succeeds(digest_job, monkeypatch, tmp_path, capsys):
+    digest = digest_job
+    monkeypatch.setattr(digest, "STATE_PATH", str(tmp_path / "missing" / "state.json"))
+    fake_prometheus(digest, monkeypatch, [(8 * 86400 - 600, 9 * 86400)])
+
+    # A non-zero exit would make the CronJob retry and post the digest twice
+    assert run_at(digest, monkeypatch, 8 * 86400) == 0
+    assert len(digest.slack.posts) == 1
+    assert "saving state to" in capsys.readouterr().err
+    assert not (tmp_path / "missing").exists()
+
+def test_interrupted_state_write_keeps_the_previous_state(digest_job, tmp_path):
+    digest = digest_job
+    digest.save_state({"runs": [], "open": {SERIES_ID: 1}})
+    with pytest.raises(TypeError):
+        digest.save_state({"runs": [object()], "open": {}})
+    assert digest.load_state() == {"runs": [], "open": {SERIES_ID: 1}}
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["state.json", "webhook-url"]